@@ -1,24 +1,88 @@
 import pandas as pd
+import numpy as np
 import os
-import glob
+import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from schema_registry import iter_typed_chunks
+import instrument
+from profiling import HotPathProfiler
+from window_shards import WindowShardWriter
+from block_index import write_index
+from fault_windows import build_windows
+from prefetch import prefetch
+from csv_io import glob_csv, find_csv, pandas_compression, compression_of
+from csv_engine import read_csv_chunks
+from sharding import shard_index, write_manifest, check_shard_args
+from checkpoint import Checkpointer, file_fingerprint
 
 # --- 1. 配置区域 ---
 ECS_FILE_PATH = '/workspace/process_data_byBD/Data_alignment/tuomin_data/1.24/original_data/ecs_cleaned_data.csv'
 GPU_DATA_DIR = '/workspace/process_data_byBD/Data_alignment/tuomin_data/1.24/original_data/'
 OUTPUT_DIR = '/workspace/process_data_byBD/Data_alignment/tuomin_data/1.24/output/the_same_id/' # 使用新的输出目录
+# 输出文件后缀：'.csv.gz' / '.csv.zst' 时按扩展名透明压缩（zstd 多线程压缩）；输入文件同样可以是压缩的
+OUTPUT_SUFFIX = '.csv'
 TIME_WINDOW_SECONDS = 10 * 60
 CHUNK_SIZE = 500000
+# 后台线程预读的 chunk 数（0 关闭）：解析下一块与匹配当前块重叠；队列中的 chunk 总内存不超过 PREFETCH_MAX_MB
+PREFETCH_CHUNKS = 2
+PREFETCH_MAX_MB = 2048
+# GPU 文件已用 external_sort.py 按 (instance_id, timestamp) 预排序时置为 True，
+# 匹配改为有序归并：每个实例的行是连续一段，每个故障用二分定位窗口，不再逐行遍历所有故障
+GPU_FILES_SORTED = False
+# 按 schema_registry 的紧凑类型读取GPU文件（category 的 instance_id/ip/device_name、小整数列）；
+# 指标列保持 float64（floats=False），输出与 pandas 默认推断一致。默认关闭
+USE_SCHEMA_REGISTRY = False
+# 对齐热点剖析（默认关闭）：ALIGN_PROFILE=phases 统计 read/rename/filter/match/merge 各阶段耗时，
+# ALIGN_PROFILE=cprofile 额外输出每个GPU文件的 cProfile 热点；ALIGN_PROFILE_ALLOC=1 打开 tracemalloc
+PROFILE_MODE = os.environ.get('ALIGN_PROFILE') or None
+PROFILE_TRACK_ALLOCATIONS = os.environ.get('ALIGN_PROFILE_ALLOC') == '1'
+PROFILE_REPORT_DIR = os.environ.get('ALIGN_PROFILE_DIR')  # 可选：保存 .prof/.txt 报告
+# 可选：直接导出定长训练窗口（故障前 WINDOW_PRE_STEPS 个、故障后 WINDOW_POST_STEPS 个GPU采样，
+# 不足处补齐并给出 mask），写成大小受限的 .npz 分片 + manifest.json，训练端无需再解析CSV
+EXPORT_TRAINING_WINDOWS = False
+WINDOW_OUTPUT_DIR = os.path.join(OUTPUT_DIR, 'windows')
+WINDOW_PRE_STEPS = 10
+WINDOW_POST_STEPS = 10
+WINDOW_SHARD_MAX_MB = 256
+
+# 每个实例CSV旁写一个 <instance_id>.csv.idx.json 块索引（每个故障块的字节偏移、行数、故障时间戳），
+# 下游 get_data.filter_files 等可直接 seek 到故障块
+WRITE_BLOCK_INDEX = True
+# 时间上重叠的故障窗口（同一实例相邻故障间隔 <= 2*TIME_WINDOW_SECONDS）合成一簇，簇内GPU行只存一份。
+# False：仍按故障各写一个块（与原输出一致，块在写出时才展开）；
+# True：每簇只写一个共享块，含簇内全部故障的 status == 0 行，GPU行的 status 相对最近的故障（等距时归前一个故障）
+SHARED_FAULT_BLOCKS = False
+# 输出阶段并行写文件的进程数（1 为串行）；各实例相互独立，输出文件与串行逐字节一致
+OUTPUT_WORKERS = 1
+# 按实例分片：只处理 crc32(instance_id) % SHARD_COUNT == SHARD_ID 的实例（故障索引、GPU行过滤、输出一致），
+# 各分片输出互不重叠，并在 OUTPUT_DIR/shards/ 写清单；全部分片完成后用 sharding.py 校验合并。
+# 命令行 --shards N --shard-id k 或环境变量 ALIGN_SHARDS / ALIGN_SHARD_ID
+SHARD_COUNT = int(os.environ.get('ALIGN_SHARDS', 1))
+SHARD_ID = int(os.environ.get('ALIGN_SHARD_ID', 0))
+# 检查点：process_gpu_files 处理GPU文件时，每隔 CHECKPOINT_INTERVAL_SECONDS（0 关闭）把已完成的文件、当前文件已处理的行数
+# 和匹配状态原子写入 CHECKPOINT_DIR；保存耗时超过处理时间的 CHECKPOINT_MAX_OVERHEAD 时自动拉长间隔。
+# --resume 从最近一次检查点继续（输入文件或设置变化时从头开始），对齐全部完成后删除检查点
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, 'checkpoint')
+CHECKPOINT_INTERVAL_SECONDS = 600
+CHECKPOINT_MAX_OVERHEAD = 0.05
 
 # 定义不应被重命名的关键列
 KEY_COLUMNS = {'instance_id', 'ip', 'timestamp', 'device_name'}
 
+PROFILER = HotPathProfiler(PROFILE_MODE, PROFILE_TRACK_ALLOCATIONS, report_dir=PROFILE_REPORT_DIR)
+
 # --- 2. 核心处理函数 ---
 
+@instrument.instrumented('align.build_fault_index')
 def build_fault_index(ecs_df):
     """
     从ECS DataFrame构建一个故障索引字典。
     """
+    instrument.current().rows_in = len(ecs_df)
     print("开始构建故障索引...")
     ecs_df['timestamp'] = pd.to_numeric(ecs_df['timestamp'], errors='coerce')
     ecs_df.dropna(subset=['timestamp'], inplace=True)
@@ -38,29 +102,143 @@ def build_fault_index(ecs_df):
             faults_index[instance_id] = []
         faults_index[instance_id].append((row['timestamp'], row.get('ip'), row))
         
+    instrument.current().rows_out = len(faults_index)
     print("故障索引构建完成。")
     return faults_index
 
+def _add_matched_row(matched_data, instance_id, members, gpu_ts, gpu_row):
+    # 因为列名已经被重命名，现在 update 会安全地添加新列
+    # 例如：先添加 t2_temp，后添加 t3_temp，两者都会保留
+    # 同一行命中多个重叠故障窗口时只存一份，members 记录它属于哪些故障
+    if PROFILER.enabled:
+        start = time.perf_counter()
+    matched_data[instance_id].add(members, gpu_ts, gpu_row.to_dict())
+    if PROFILER.enabled:
+        PROFILER.add('merge', time.perf_counter() - start)
+
+
+def _ip_blank(fault_ip):
+    return pd.isna(fault_ip) or str(fault_ip).strip() == ''
+
+
+def match_chunk_rows(relevant_chunk, faults_index, matched_data):
+    """
+    逐行匹配：每个GPU行在其实例的有序故障时间上二分，找出窗口覆盖它的全部故障。
+    """
+    for _, gpu_row in relevant_chunk.iterrows():
+        gpu_instance_id = gpu_row['instance_id']
+        gpu_ts = gpu_row['timestamp']
+        members = matched_data[gpu_instance_id].match(gpu_ts, gpu_row.get('ip'))
+        if members:
+            _add_matched_row(matched_data, gpu_instance_id, members, gpu_ts, gpu_row)
+
+
+def match_sorted_chunk(relevant_chunk, faults_index, matched_data):
+    """
+    有序归并匹配：chunk 按 (instance_id, timestamp) 排序时，每个实例的行是连续的一段，
+    用该实例最早/最晚故障的窗口二分截出候选行，只访问这些行。
+    同一 gpu_ts 的行仍按文件顺序 update，结果与逐行匹配一致。
+    """
+    inst_values = relevant_chunk['instance_id'].to_numpy()
+    ts_values = relevant_chunk['timestamp'].to_numpy()
+    ip_values = relevant_chunk['ip'].to_numpy() if 'ip' in relevant_chunk.columns else None
+
+    boundaries = np.flatnonzero(inst_values[1:] != inst_values[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(relevant_chunk)]))
+
+    for start, end in zip(starts, ends):
+        instance_id = inst_values[start]
+        windows = matched_data[instance_id]
+        positions = np.arange(start, end)
+        seg_ts = ts_values[start:end]
+        if len(seg_ts) > 1 and np.any(seg_ts[1:] < seg_ts[:-1]):
+            # 段内未排序（输入并非完全有序）时退化为段内稳定排序，保证结果正确
+            order = np.argsort(seg_ts, kind='stable')
+            positions = positions[order]
+            seg_ts = seg_ts[order]
+
+        first_ts, last_ts = windows.time_span()
+        lo = np.searchsorted(seg_ts, first_ts - TIME_WINDOW_SECONDS, side='left')
+        hi = np.searchsorted(seg_ts, last_ts + TIME_WINDOW_SECONDS, side='right')
+        for pos in positions[lo:hi]:
+            gpu_ip = ip_values[pos] if ip_values is not None else None
+            members = windows.match(ts_values[pos], gpu_ip)
+            if members:
+                _add_matched_row(matched_data, instance_id, members, ts_values[pos], relevant_chunk.iloc[pos])
+
+
+def process_chunk(chunk, prefix, instance_ids_to_find, faults_index, matched_data, all_columns):
+    """
+    处理一个GPU数据块：重命名、更新列集合、过滤相关实例并匹配。返回相关行数。
+    """
+    with PROFILER.phase('rename'):
+        # --- **新的逻辑：重命名列** ---
+        if prefix:
+            cols_to_rename = [col for col in chunk.columns if col not in KEY_COLUMNS]
+            rename_dict = {col: f"{prefix}_{col}" for col in cols_to_rename}
+            chunk.rename(columns=rename_dict, inplace=True)
+
+        # 更新全局列集合
+        all_columns.update(chunk.columns)
+
+    with PROFILER.phase('filter'):
+        # 预处理数据类型 (与之前相同)
+        chunk['timestamp'] = pd.to_numeric(chunk['timestamp'], errors='coerce')
+        chunk.dropna(subset=['timestamp', 'instance_id'], inplace=True)
+        chunk['timestamp'] = chunk['timestamp'].astype(int)
+
+        relevant_chunk = chunk[chunk['instance_id'].isin(instance_ids_to_find)]
+    if relevant_chunk.empty:
+        return 0
+
+    # match 为不含 merge（行合并）的纯匹配耗时
+    with PROFILER.phase('match'):
+        if GPU_FILES_SORTED:
+            match_sorted_chunk(relevant_chunk, faults_index, matched_data)
+        else:
+            match_chunk_rows(relevant_chunk, faults_index, matched_data)
+    return len(relevant_chunk)
+
+
 # --- **已重构以支持列重命名和动态列发现** ---
-def process_gpu_files(gpu_file_paths, faults_index, initial_all_columns_set):
+def process_gpu_files(gpu_file_paths, faults_index, initial_all_columns_set, checkpointer=None, resume_state=None):
     """
     流式处理GPU文件，在合并前重命名冲突列，并动态发现所有列。
+    checkpointer 定期保存进度；resume_state（检查点内容）给出时跳过已完成的文件和当前文件已处理的行。
     """
     print("\n开始处理GPU数据文件并合并行...")
     
-    # matched_data 结构不变
-    matched_data = {
-        instance_id: {
-            fault[0]: {} for fault in faults
-        } for instance_id, faults in faults_index.items()
-    }
+    if resume_state is not None:
+        matched_data = resume_state['matched_data']
+        all_columns = resume_state['all_columns']
+        files_done = set(resume_state['files_done'])
+        resume_file, resume_rows = resume_state['current_file'], resume_state['rows_done']
+        print(f"从检查点恢复：已完成 {len(files_done)} 个文件"
+              + (f"，{os.path.basename(resume_file)} 已处理 {resume_rows} 行。" if resume_file else "。"))
+    else:
+        # matched_data: instance_id -> InstanceWindows，窗口重叠的故障合成一簇，簇内每个GPU行只存一份
+        matched_data = build_windows(faults_index, TIME_WINDOW_SECONDS, is_blank=_ip_blank)
+        # 使用传入的集合来动态收集所有列名
+        all_columns = initial_all_columns_set.copy()
+        files_done = set()
+        resume_file, resume_rows = None, 0
     
     instance_ids_to_find = set(faults_index.keys())
-    # 使用传入的集合来动态收集所有列名
-    all_columns = initial_all_columns_set.copy()
+    progressed = False
+
+    def checkpoint_state(current_file, rows_done):
+        return {'matched_data': matched_data, 'all_columns': all_columns, 'files_done': sorted(files_done),
+                'current_file': current_file, 'rows_done': rows_done}
 
     for file_path in gpu_file_paths:
+        if file_path in files_done:
+            print(f"  跳过已完成的文件: {os.path.basename(file_path)}")
+            continue
         print(f"  正在处理文件: {os.path.basename(file_path)}")
+        # 检查点之前已匹配的行（按原 chunk 边界跳过，需重新解析但不再匹配）
+        skip_rows = resume_rows if file_path == resume_file else 0
+        rows_seen = 0
         
         # --- **新的逻辑：确定列前缀** ---
         filename = os.path.basename(file_path)
@@ -70,59 +248,142 @@ def process_gpu_files(gpu_file_paths, faults_index, initial_all_columns_set):
         elif filename.startswith('t3_'): # 假设t3文件名是 t3_masked.csv
             prefix = 't3'
 
-        try:
-            for chunk in pd.read_csv(file_path, chunksize=CHUNK_SIZE, low_memory=False):
-                # --- **新的逻辑：重命名列** ---
-                if prefix:
-                    cols_to_rename = [col for col in chunk.columns if col not in KEY_COLUMNS]
-                    rename_dict = {col: f"{prefix}_{col}" for col in cols_to_rename}
-                    chunk.rename(columns=rename_dict, inplace=True)
-                
-                # 更新全局列集合
-                all_columns.update(chunk.columns)
-
-                # 预处理数据类型 (与之前相同)
-                chunk['timestamp'] = pd.to_numeric(chunk['timestamp'], errors='coerce')
-                chunk.dropna(subset=['timestamp', 'instance_id'], inplace=True)
-                chunk['timestamp'] = chunk['timestamp'].astype(int)
-                
-                relevant_chunk = chunk[chunk['instance_id'].isin(instance_ids_to_find)]
-                if relevant_chunk.empty:
-                    continue
-
-                for _, gpu_row in relevant_chunk.iterrows():
-                    gpu_instance_id = gpu_row['instance_id']
-                    gpu_ts = gpu_row['timestamp']
-                    gpu_ip = gpu_row.get('ip')
-                    
-                    for fault_ts, fault_ip, _ in faults_index[gpu_instance_id]:
-                        if abs(gpu_ts - fault_ts) <= TIME_WINDOW_SECONDS:
-                            ip_match = (pd.isna(fault_ip) or str(fault_ip).strip() == '') or (fault_ip == gpu_ip)
-
-                            if ip_match:
-                                # 因为列名已经被重命名，现在 update 会安全地添加新列
-                                # 例如：先添加 t2_temp，后添加 t3_temp，两者都会保留
-                                existing_record = matched_data[gpu_instance_id][fault_ts].get(gpu_ts)
-                                if existing_record:
-                                    existing_record.update(gpu_row.to_dict())
-                                else:
-                                    matched_data[gpu_instance_id][fault_ts][gpu_ts] = gpu_row.to_dict()
-        except Exception as e:
-            print(f"    处理文件 {file_path} 时发生错误: {e}")
-            continue
+        PROFILER.begin_file(filename)
+        with instrument.stage('align.process_gpu_file', file=filename) as file_metrics:
+            file_metrics.add_input(file_path)
+            chunks = None
+            try:
+                if USE_SCHEMA_REGISTRY:
+                    chunks = iter_typed_chunks(file_path, CHUNK_SIZE, floats=False, low_memory=False)
+                else:
+                    chunks = read_csv_chunks(file_path, CHUNK_SIZE, low_memory=False)
+                # 开启预读时剖析中的 read 为等待预读线程的时间
+                chunks = prefetch(chunks, depth=PREFETCH_CHUNKS, max_bytes=PREFETCH_MAX_MB * 1024 * 1024)
+                for chunk_idx, chunk in enumerate(PROFILER.timed_iter(chunks, 'read')):
+                    chunk_rows = len(chunk)
+                    if rows_seen < skip_rows:
+                        rows_seen += chunk_rows
+                        continue
+                    with instrument.stage('align.process_chunk', file=filename, chunk=chunk_idx) as chunk_metrics:
+                        chunk_metrics.rows_in = chunk_rows
+                        chunk_metrics.rows_out = process_chunk(chunk, prefix, instance_ids_to_find,
+                                                               faults_index, matched_data, all_columns)
+                    file_metrics.rows_in += chunk_metrics.rows_in
+                    file_metrics.rows_out += chunk_metrics.rows_out
+                    rows_seen += chunk_rows
+                    progressed = True
+                    if checkpointer is not None and checkpointer.due():
+                        checkpointer.save(checkpoint_state(file_path, rows_seen))
+            except Exception as e:
+                print(f"    处理文件 {file_path} 时发生错误: {e}")
+                file_metrics.extra['error'] = str(e)
+            finally:
+                if chunks is not None:
+                    chunks.close()  # 出错时停止预读线程
+                PROFILER.end_file()
+        # 出错的文件与原逻辑一样视为处理结束，继续下一个文件
+        files_done.add(file_path)
 
-    print("GPU数据文件处理完成。")
+    if checkpointer is not None and checkpointer.interval and progressed:
+        # 全部文件完成后的检查点：写出阶段崩溃时 --resume 直接进入写出
+        checkpointer.save(checkpoint_state(None, 0))
+    if checkpointer is not None and checkpointer.saves:
+        saves, seconds, fraction = checkpointer.overhead()
+        print(f"检查点：保存 {saves} 次，共 {seconds:.2f} 秒（占GPU文件处理时间 {fraction:.1%}），"
+              f"最近一次 {checkpointer.last_bytes / 1024 / 1024:.1f} MB。")
+        instrument.current().extra['checkpoint'] = {'saves': saves, 'seconds': round(seconds, 3),
+                                                    'bytes': checkpointer.last_bytes}
+
+    stored = expanded = 0
+    for windows in matched_data.values():
+        s_rows, e_rows = windows.stats()
+        stored += s_rows
+        expanded += e_rows
+    print(f"GPU数据文件处理完成。共享存储 {stored} 条GPU行（按故障展开为 {expanded} 条）。")
     # 返回匹配的数据和所有动态发现的列的集合
     return matched_data, all_columns
 
 
-def generate_output_files(matched_data, faults_index, output_dir, all_discovered_columns_set):
+def _row_status(ts, fault_times):
+    # fault_times 升序；行相对最近的故障在前为 -1，否则为 1
+    nearest = min(fault_times, key=lambda f: abs(ts - f))
+    return -1 if ts < nearest else 1
+
+
+def _fault_blocks(faults, windows):
+    """按故障时间顺序产出 (该块的故障列表, 块内GPU行字典)。"""
+    sorted_faults = sorted(faults, key=lambda x: x[0])
+    if not SHARED_FAULT_BLOCKS:
+        for fault in sorted_faults:
+            yield [fault], windows.fault_view(fault[0])
+        return
+    by_cluster = {}
+    for fault in sorted_faults:
+        by_cluster.setdefault(windows.fault_cluster[fault[0]], []).append(fault)
+    for cluster, cluster_faults in by_cluster.items():
+        yield cluster_faults, windows.cluster_view(cluster)
+
+
+def block_frame(block_faults, merged_gpu_rows_dict, final_ordered_cols):
     """
-    根据匹配并合并后的数据，为每个instance_id生成一个CSV文件。
+    一个故障块：GPU行（status -1/1）加故障行（status 0），按完整列顺序重排并按时间排序。
     """
-    print("\n开始生成输出文件...")
-    os.makedirs(output_dir, exist_ok=True)
-    
+    fault_times = [fault_ts for fault_ts, _, _ in block_faults]
+
+    ecs_df_rows = []
+    for _, _, ecs_row in block_faults:
+        ecs_df_row = ecs_row.to_frame().T
+        ecs_df_row['status'] = 0
+        ecs_df_rows.append(ecs_df_row)
+
+    if merged_gpu_rows_dict:
+        gpu_df = pd.DataFrame(list(merged_gpu_rows_dict.values()))
+        gpu_df['status'] = gpu_df['timestamp'].apply(lambda ts: _row_status(ts, fault_times))
+        combined_df = pd.concat([gpu_df] + ecs_df_rows, ignore_index=True)
+    elif len(ecs_df_rows) == 1:
+        combined_df = ecs_df_rows[0]
+    else:
+        combined_df = pd.concat(ecs_df_rows, ignore_index=True)
+
+    # 使用新的、完整的列顺序来重新索引
+    combined_df = combined_df.reindex(columns=final_ordered_cols)
+    # 同一时间戳按 status 排（-1 前窗口行、0 故障行、1 后窗口行），多列排序是稳定的，
+    # 结果与 GPU 行的到达顺序无关，批量对齐和 stream_align 写出的块一致
+    combined_df.sort_values(by=['timestamp', 'status'], inplace=True, ascending=True)
+    return combined_df
+
+
+def write_instance_file(instance_id, faults, windows, final_ordered_cols, output_dir):
+    """
+    为单个instance_id生成CSV（可在子进程中运行）。返回 (输出路径, 输入GPU行数, 输出行数)，无故障块时路径为 None。
+    """
+    all_blocks_for_instance = []
+    rows_in = 0
+
+    for block_faults, merged_gpu_rows_dict in _fault_blocks(faults, windows):
+        rows_in += len(merged_gpu_rows_dict)
+        all_blocks_for_instance.append(block_frame(block_faults, merged_gpu_rows_dict, final_ordered_cols))
+
+    if not all_blocks_for_instance:
+        return None, rows_in, 0
+
+    final_df_for_instance = pd.DataFrame(columns=final_ordered_cols)
+    for i, block in enumerate(all_blocks_for_instance):
+        final_df_for_instance = pd.concat([final_df_for_instance, block], ignore_index=True)
+        if i < len(all_blocks_for_instance) - 1:
+            empty_row = pd.DataFrame([{}], columns=final_ordered_cols)
+            final_df_for_instance = pd.concat([final_df_for_instance, empty_row], ignore_index=True)
+
+    output_path = os.path.join(output_dir, f"{instance_id}{OUTPUT_SUFFIX}")
+    final_df_for_instance.to_csv(output_path, index=False, compression=pandas_compression(output_path))
+    # 压缩文件无法 seek，不写块索引
+    if WRITE_BLOCK_INDEX and compression_of(output_path) is None:
+        write_index(output_path)
+    return output_path, rows_in, len(final_df_for_instance)
+
+
+def final_column_order(all_discovered_columns_set):
+    """输出列顺序：status、关键列，其余列按字母排序。"""
     # --- **新的逻辑：对动态发现的列进行排序** ---
     # 将集合转换为列表并排序，以获得一致的列顺序
     # 将关键列放在前面，其他列按字母排序
@@ -130,74 +391,128 @@ def generate_output_files(matched_data, faults_index, output_dir, all_discovered
     # 使用 set 而不是 list for KEY_COLUMNS for faster lookups
     ordered_key_cols = [col for col in ['instance_id', 'ip', 'timestamp', 'device_name'] if col in sorted_cols]
     other_cols = [col for col in sorted_cols if col not in ordered_key_cols]
-    final_ordered_cols = ['status'] + ordered_key_cols + other_cols
+    return ['status'] + ordered_key_cols + other_cols
+
+
+def _iter_instance_results(tasks, workers):
+    """按 faults_index 的顺序依次产出每个实例的写出结果；workers > 1 时用进程池并行，最多 2*workers 个任务在途。"""
+    if workers <= 1:
+        for task in tasks:
+            yield write_instance_file(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for task in tasks:
+            # 限制在途任务数，避免所有实例的匹配数据同时被序列化进队列
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+            in_flight.append(pool.submit(write_instance_file, *task))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+@instrument.instrumented('align.generate_output_files')
+def generate_output_files(matched_data, faults_index, output_dir, all_discovered_columns_set, workers=None):
+    """
+    根据匹配并合并后的数据，为每个instance_id生成一个CSV文件。
+    workers > 1 时各实例在进程池中并行生成，文件名和内容与串行完全一致。
+    """
+    workers = OUTPUT_WORKERS if workers is None else workers
+    metrics = instrument.current()
+    print("\n开始生成输出文件...")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    final_ordered_cols = final_column_order(all_discovered_columns_set)
 
     # 后续逻辑与之前基本相同，但使用新的列顺序
-    for instance_id, faults in faults_index.items():
-        # ... (此部分代码与原版相同) ...
-        sorted_faults = sorted(faults, key=lambda x: x[0])
-        all_blocks_for_instance = []
-        
-        for fault_ts, _, ecs_row in sorted_faults:
-            merged_gpu_rows_dict = matched_data[instance_id].get(fault_ts, {})
-            
-            ecs_df_row = ecs_row.to_frame().T
-            ecs_df_row['status'] = 0
-            
-            if merged_gpu_rows_dict:
-                gpu_df = pd.DataFrame(list(merged_gpu_rows_dict.values()))
-                gpu_df['status'] = gpu_df['timestamp'].apply(lambda ts: -1 if ts < fault_ts else 1)
-                combined_df = pd.concat([gpu_df, ecs_df_row], ignore_index=True)
-            else:
-                combined_df = ecs_df_row
-
-            # 使用新的、完整的列顺序来重新索引
-            combined_df = combined_df.reindex(columns=final_ordered_cols)
-            combined_df.sort_values(by='timestamp', inplace=True, ascending=True)
-
-            all_blocks_for_instance.append(combined_df)
-
-        if not all_blocks_for_instance:
+    tasks = ((instance_id, faults, matched_data[instance_id], final_ordered_cols, output_dir)
+             for instance_id, faults in faults_index.items())
+    outputs = []
+    results = _iter_instance_results(tasks, workers)
+    for instance_id, (output_path, rows_in, rows_out) in zip(list(faults_index), results):
+        metrics.rows_in += rows_in
+        outputs.append((instance_id, output_path, rows_out))
+        if output_path is None:
             continue
-
-        final_df_for_instance = pd.DataFrame(columns=final_ordered_cols)
-        for i, block in enumerate(all_blocks_for_instance):
-            final_df_for_instance = pd.concat([final_df_for_instance, block], ignore_index=True)
-            if i < len(all_blocks_for_instance) - 1:
-                empty_row = pd.DataFrame([{}], columns=final_ordered_cols)
-                final_df_for_instance = pd.concat([final_df_for_instance, empty_row], ignore_index=True)
-                
-        output_path = os.path.join(output_dir, f"{instance_id}.csv")
-        final_df_for_instance.to_csv(output_path, index=False)
+        metrics.rows_out += rows_out
+        metrics.add_output(output_path)
         print(f"  已生成文件: {output_path}")
 
     print("所有输出文件已生成完毕。")
+    # [(instance_id, 输出路径或 None, 输出行数)]，供分片清单使用
+    return outputs
+
+
+@instrument.instrumented('align.export_training_windows')
+def export_training_windows(matched_data, faults_index, output_dir, all_discovered_columns_set, ecs_columns):
+    """
+    把每个故障的前后定长窗口写成 .npz 分片，指标列为除关键列和ECS列之外的所有GPU列。
+    """
+    metrics = instrument.current()
+    print("\n开始导出训练窗口...")
+    metric_columns = sorted(all_discovered_columns_set - KEY_COLUMNS - set(ecs_columns) - {'status'})
+    writer = WindowShardWriter(output_dir, metric_columns, WINDOW_PRE_STEPS, WINDOW_POST_STEPS,
+                               shard_max_bytes=WINDOW_SHARD_MAX_MB * 1024 * 1024)
+    for instance_id, faults in faults_index.items():
+        for fault_ts, _, ecs_row in sorted(faults, key=lambda x: x[0]):
+            gpu_rows = matched_data[instance_id].fault_view(fault_ts)
+            metrics.rows_in += len(gpu_rows)
+            writer.add(instance_id, fault_ts, ecs_row, gpu_rows)
+    manifest = writer.close()
+    metrics.rows_out = manifest['windows']
+    metrics.bytes_out = sum(s['bytes'] for s in manifest['shards'])
+    print(f"训练窗口导出完成：{manifest['windows']} 个窗口，{len(manifest['shards'])} 个分片，"
+          f"{len(metric_columns)} 个指标 -> {output_dir}")
+
+
+def _shard_settings():
+    # 各分片须一致的设置，合并时校验
+    return {'time_window_seconds': TIME_WINDOW_SECONDS, 'output_suffix': OUTPUT_SUFFIX,
+            'shared_fault_blocks': SHARED_FAULT_BLOCKS, 'ecs_file': os.path.basename(ECS_FILE_PATH)}
 
 
 # --- 3. 主执行逻辑 (已调整) ---
-def main():
+@instrument.instrumented('align.main')
+def main(shards=None, shard_id=None, resume=False):
     start_time = time.time()
+    shards = SHARD_COUNT if shards is None else shards
+    shard_id = SHARD_ID if shard_id is None else shard_id
+    check_shard_args(shards, shard_id)
     
     try:
-        ecs_df = pd.read_csv(ECS_FILE_PATH, low_memory=False)
+        with instrument.stage('align.read_ecs') as m:
+            m.add_input(ECS_FILE_PATH)
+            ecs_df = pd.read_csv(ECS_FILE_PATH, low_memory=False)
+            m.rows_out = len(ecs_df)
     except FileNotFoundError:
         print(f"错误：找不到ECS文件 '{ECS_FILE_PATH}'。请检查路径。")
         return
         
     faults_index = build_fault_index(ecs_df)
+    all_instance_ids = list(faults_index)
+    window_output_dir = WINDOW_OUTPUT_DIR
+    if shards > 1:
+        # GPU行按 faults_index 的实例过滤，故只需对故障索引分片
+        faults_index = shard_index(faults_index, shards, shard_id)
+        window_output_dir = os.path.join(WINDOW_OUTPUT_DIR, f"shard-{shard_id}-of-{shards}")
+        print(f"分片 {shard_id}/{shards}：处理 {len(faults_index)}/{len(all_instance_ids)} 个实例。")
     
     if not faults_index:
         print("没有有效的故障数据可供处理。")
+        if shards > 1 and all_instance_ids:
+            write_manifest(OUTPUT_DIR, shards, shard_id, all_instance_ids, [], _shard_settings())
         return
 
     # --- **新的逻辑：准备文件路径和初始列集合** ---
     # 初始化列集合，首先包含ECS文件的所有列
     initial_columns_set = set(ecs_df.columns)
 
-    t2_files = glob.glob(os.path.join(GPU_DATA_DIR, 't2_*_masked.csv'))
-    t3_file = os.path.join(GPU_DATA_DIR, 't3_masked.csv')
+    # 同时匹配 .csv.gz / .csv.zst 压缩文件
+    t2_files = glob_csv(os.path.join(GPU_DATA_DIR, 't2_*_masked.csv'))
+    t3_file = find_csv(os.path.join(GPU_DATA_DIR, 't3_masked.csv'))
     gpu_file_paths = sorted(t2_files)
-    if os.path.exists(t3_file):
+    if t3_file:
         # 确保 t3 文件在 t2 文件之后处理，以防万一
         gpu_file_paths.append(t3_file)
 
@@ -207,16 +522,42 @@ def main():
         
     # **旧的 discover_all_columns 函数已被移除**
     
+    ckpt_name = 'align.ckpt' if shards <= 1 else f"align-shard-{shard_id}-of-{shards}.ckpt"
+    fingerprint = {
+        'files': file_fingerprint([ECS_FILE_PATH] + gpu_file_paths),
+        'settings': [CHUNK_SIZE, TIME_WINDOW_SECONDS, GPU_FILES_SORTED, USE_SCHEMA_REGISTRY, shards, shard_id],
+    }
+    checkpointer = Checkpointer(os.path.join(CHECKPOINT_DIR, ckpt_name), fingerprint,
+                                CHECKPOINT_INTERVAL_SECONDS, CHECKPOINT_MAX_OVERHEAD)
+    resume_state = checkpointer.load() if resume else None
+    if resume and resume_state is None:
+        print("没有可用的检查点，从头开始处理。")
+
     # 调用重构后的核心函数，它会返回匹配数据和所有列的集合
-    matched_data, all_columns_set = process_gpu_files(gpu_file_paths, faults_index, initial_columns_set)
+    matched_data, all_columns_set = process_gpu_files(gpu_file_paths, faults_index, initial_columns_set,
+                                                      checkpointer, resume_state)
     
     print(f"\n动态发现完成。共发现 {len(all_columns_set)} 个唯一的列。")
 
     # 将最终的列集合传递给输出函数
-    generate_output_files(matched_data, faults_index, OUTPUT_DIR, all_columns_set)
+    outputs = generate_output_files(matched_data, faults_index, OUTPUT_DIR, all_columns_set)
+    if EXPORT_TRAINING_WINDOWS:
+        export_training_windows(matched_data, faults_index, window_output_dir, all_columns_set, ecs_df.columns)
+    if shards > 1:
+        path = write_manifest(OUTPUT_DIR, shards, shard_id, all_instance_ids, outputs, _shard_settings())
+        print(f"分片清单已写入: {path}")
+    checkpointer.remove()
 
+    PROFILER.summary()
     end_time = time.time()
     print(f"\n任务完成！总耗时: {end_time - start_time:.2f} 秒。")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="GPU 与 ECS 数据对齐（其余设置见脚本顶部配置区域）。")
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help="分片总数")
+    parser.add_argument('--shard-id', type=int, default=SHARD_ID, help="本次运行的分片编号（0 起）")
+    parser.add_argument('--resume', action='store_true', help="从 CHECKPOINT_DIR 中最近一次检查点继续")
+    args = parser.parse_args()
+    main(args.shards, args.shard_id, args.resume)
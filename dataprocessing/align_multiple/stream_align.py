@@ -0,0 +1,270 @@
+"""
+流式对齐：按时间顺序消费GPU行和ECS故障事件，故障的后窗口一过就写出该故障的 -1/0/1 块，
+不必等所有GPU文件导出后再跑批量对齐。
+
+- 每个实例保留最近 TIME_WINDOW_SECONDS（+ max_delay）的GPU行（环形缓冲，按时间淘汰），
+  故障到达时从中取出故障前的行；
+- 之后到达、落在窗口内的行直接追加到待写出的故障；
+- 水位线（见过的最大时间戳）超过 故障时间 + 窗口 + max_delay 时写出该故障的块。
+  max_delay 秒以内的乱序行仍会被计入。
+
+块的内容与 align_multiple.generate_output_files 一致（同一时间戳的行合并、IP 过滤、status、
+列顺序、块间空行），按故障时间顺序追加到 <instance_id><OUTPUT_SUFFIX>。列需事先给定（回放时取
+各文件表头），未知列会被丢弃。不支持 SHARED_FAULT_BLOCKS。
+
+回放：replay_csvs() 把现有 ECS/GPU CSV 按时间戳归并成一条事件流送入对齐器。GPU 文件需按时间
+有序（python ../external_sort.py t2_0_masked.csv t2_0_sorted.csv -k timestamp -n timestamp），
+否则超出 max_delay 的乱序行会被计为迟到并丢弃。
+
+    python stream_align.py --ecs ecs.csv --gpu-dir ./sorted --output-dir ./stream_out --max-delay 0
+"""
+import os
+import sys
+import heapq
+import itertools
+import warnings
+from collections import deque
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if __package__:
+    from . import align_multiple as am  # python cli.py stream_align
+else:
+    import align_multiple as am
+import instrument
+from block_index import write_index
+from csv_io import glob_csv, find_csv, pandas_compression, compression_of
+from schema_registry import iter_typed_chunks
+from csv_engine import read_csv_chunks
+
+
+class _PendingFault:
+    """同一实例、同一时间戳的故障共用一个待写出窗口（与批量对齐按时间戳取窗口一致）。"""
+
+    def __init__(self, fault_ts):
+        self.fault_ts = fault_ts
+        self.faults = []
+        self.any_ip = False
+        self.ips = set()
+        self.rows = []  # [(gpu_ts, gpu_ip, row), ...] 按到达顺序
+
+    def add_fault(self, fault_ip, ecs_row):
+        self.faults.append((self.fault_ts, fault_ip, ecs_row))
+        if am._ip_blank(fault_ip):
+            self.any_ip = True
+        else:
+            self.ips.add(fault_ip)
+
+    def merged_rows(self):
+        """{gpu_ts: row}：IP 匹配的行，同一时间戳按到达顺序合并。"""
+        merged = {}
+        for gpu_ts, gpu_ip, row in self.rows:
+            if self.any_ip or gpu_ip in self.ips:
+                if gpu_ts in merged:
+                    merged[gpu_ts].update(row)
+                else:
+                    merged[gpu_ts] = dict(row)
+        return merged
+
+
+class StreamAligner:
+    def __init__(self, columns, output_dir, window=None, max_delay=0, on_block=None, write_files=True):
+        """
+        columns: 全部输入列（ECS列 + 重命名后的GPU列），决定输出列顺序。
+        on_block(instance_id, fault_ts, block_df)：每写出一个故障块时回调。
+        """
+        self.final_ordered_cols = am.final_column_order(set(columns))
+        self.output_dir = output_dir
+        self.window = am.TIME_WINDOW_SECONDS if window is None else window
+        self.max_delay = max_delay
+        self.on_block = on_block
+        self.write_files = write_files
+        self.watermark = None
+        self.ring = {}       # instance_id -> deque[(gpu_ts, gpu_ip, row)]
+        self.pending = {}    # instance_id -> {fault_ts: _PendingFault}
+        self.due = []        # 堆：(fault_ts, seq, instance_id)
+        self._seq = itertools.count()
+        self.written = set()
+        self.stats = {'gpu_rows': 0, 'faults': 0, 'blocks': 0, 'late_rows': 0, 'late_faults': 0,
+                      'peak_buffered_rows': 0}
+        self._buffered = 0
+        if write_files:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def add_gpu_row(self, instance_id, gpu_ts, row):
+        """row：已重命名列的GPU行字典（含 ip、timestamp）。"""
+        self.stats['gpu_rows'] += 1
+        if self.watermark is not None and gpu_ts < self.watermark - self.max_delay:
+            self.stats['late_rows'] += 1
+            return
+        entry = (gpu_ts, row.get('ip'), row)
+        ring = self.ring.get(instance_id)
+        if ring is None:
+            ring = self.ring[instance_id] = deque()
+        ring.append(entry)
+        self._buffered += 1
+        for pending in self.pending.get(instance_id, {}).values():
+            if abs(gpu_ts - pending.fault_ts) <= self.window:
+                pending.rows.append(entry)
+        self.advance(gpu_ts)
+
+    def add_fault(self, instance_id, fault_ts, fault_ip, ecs_row):
+        self.stats['faults'] += 1
+        if self.watermark is not None and fault_ts + self.window < self.watermark - self.max_delay:
+            # 环形缓冲已淘汰其窗口内的行，仍写出（可能缺行）
+            self.stats['late_faults'] += 1
+        by_ts = self.pending.setdefault(instance_id, {})
+        pending = by_ts.get(fault_ts)
+        if pending is None:
+            pending = by_ts[fault_ts] = _PendingFault(fault_ts)
+            pending.rows = [e for e in self.ring.get(instance_id, ()) if abs(e[0] - fault_ts) <= self.window]
+            heapq.heappush(self.due, (fault_ts, next(self._seq), instance_id))
+        pending.add_fault(fault_ip, ecs_row)
+        self.advance(fault_ts)
+
+    def advance(self, ts):
+        """推进水位线，写出后窗口已结束的故障，淘汰环形缓冲中过期的行。"""
+        if self.watermark is not None and ts <= self.watermark:
+            return
+        self.watermark = ts
+        horizon = ts - self.max_delay
+        while self.due and self.due[0][0] + self.window < horizon:
+            self._emit(*heapq.heappop(self.due))
+        self.stats['peak_buffered_rows'] = max(self.stats['peak_buffered_rows'], self._buffered)
+        oldest = horizon - self.window
+        for ring in self.ring.values():
+            while ring and ring[0][0] < oldest:
+                ring.popleft()
+                self._buffered -= 1
+
+    def close(self):
+        """流结束：写出所有未写出的故障，并为输出文件写块索引。"""
+        while self.due:
+            self._emit(*heapq.heappop(self.due))
+        if self.write_files and am.WRITE_BLOCK_INDEX:
+            for path in sorted(self.written):
+                if compression_of(path) is None:
+                    write_index(path)
+        return self.stats
+
+    def _emit(self, fault_ts, _seq, instance_id):
+        pending = self.pending[instance_id].pop(fault_ts)
+        merged = pending.merged_rows()
+        for fault in pending.faults:
+            block = am.block_frame([fault], merged, self.final_ordered_cols)
+            self.stats['blocks'] += 1
+            if self.write_files:
+                self._append_block(instance_id, block)
+            if self.on_block is not None:
+                self.on_block(instance_id, fault_ts, block)
+
+    def _append_block(self, instance_id, block):
+        path = os.path.join(self.output_dir, f"{instance_id}{am.OUTPUT_SUFFIX}")
+        cols = self.final_ordered_cols
+        # 与 generate_output_files 一样先并入空的 object 表，整数列按 object 写出（-1 而不是 -1.0）
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            frame = pd.concat([pd.DataFrame(columns=cols), block], ignore_index=True)
+            if path in self.written:
+                # 块之间的空行
+                frame = pd.concat([pd.DataFrame([{}], columns=cols), frame], ignore_index=True)
+        if path in self.written:
+            frame.to_csv(path, mode='a', header=False, index=False, compression=pandas_compression(path))
+        else:
+            frame.to_csv(path, index=False, compression=pandas_compression(path))
+            self.written.add(path)
+
+
+def _gpu_prefix(filename):
+    if filename.startswith('t2_'):
+        return 't2'
+    if filename.startswith('t3_'):
+        return 't3'
+    return None
+
+
+def _renamed(columns, prefix):
+    if not prefix:
+        return list(columns)
+    return [col if col in am.KEY_COLUMNS else f"{prefix}_{col}" for col in columns]
+
+
+def gpu_events(file_path, instance_ids=None, chunksize=None):
+    """按文件顺序产出 (gpu_ts, instance_id, row)，预处理与 process_chunk 相同。"""
+    prefix = _gpu_prefix(os.path.basename(file_path))
+    chunksize = chunksize or am.CHUNK_SIZE
+    if am.USE_SCHEMA_REGISTRY:
+        chunks = iter_typed_chunks(file_path, chunksize, floats=False, low_memory=False)
+    else:
+        chunks = read_csv_chunks(file_path, chunksize, low_memory=False)
+    for chunk in chunks:
+        chunk.columns = _renamed(chunk.columns, prefix)
+        chunk['timestamp'] = pd.to_numeric(chunk['timestamp'], errors='coerce')
+        chunk.dropna(subset=['timestamp', 'instance_id'], inplace=True)
+        chunk['timestamp'] = chunk['timestamp'].astype(int)
+        if instance_ids is not None:
+            chunk = chunk[chunk['instance_id'].isin(instance_ids)]
+        if chunk.empty:
+            continue
+        for _, gpu_row in chunk.iterrows():
+            yield gpu_row['timestamp'], gpu_row['instance_id'], gpu_row.to_dict()
+
+
+@instrument.instrumented('align.replay_csvs')
+def replay_csvs(ecs_file, gpu_file_paths, output_dir, max_delay=0, window=None, on_block=None):
+    """
+    把 ECS 和GPU CSV 按时间戳归并成一条事件流回放给 StreamAligner。
+    同一时间戳按文件顺序（GPU 文件在前，与批量对齐的合并顺序一致）。
+    """
+    metrics = instrument.current()
+    ecs_df = pd.read_csv(ecs_file, low_memory=False)
+    faults_index = am.build_fault_index(ecs_df)
+    columns = set(ecs_df.columns)
+    for path in gpu_file_paths:
+        header = pd.read_csv(path, nrows=0).columns
+        columns.update(_renamed(header, _gpu_prefix(os.path.basename(path))))
+        metrics.add_input(path)
+
+    fault_events = sorted(
+        ((fault_ts, instance_id, fault_ip, ecs_row)
+         for instance_id, faults in faults_index.items() for fault_ts, fault_ip, ecs_row in faults),
+        key=lambda e: e[0])
+    streams = [((ts, 0, iid, row) for ts, iid, row in gpu_events(path, set(faults_index))) for path in gpu_file_paths]
+    streams.append((ts, 1, iid, (ip, ecs_row)) for ts, iid, ip, ecs_row in fault_events)
+
+    aligner = StreamAligner(columns, output_dir, window=window, max_delay=max_delay, on_block=on_block)
+    print(f"\n开始回放事件流（max_delay={max_delay}s）...")
+    for ts, kind, instance_id, payload in heapq.merge(*streams, key=lambda e: e[0]):
+        if kind == 0:
+            aligner.add_gpu_row(instance_id, ts, payload)
+        else:
+            aligner.add_fault(instance_id, ts, *payload)
+    stats = aligner.close()
+    metrics.rows_in = stats['gpu_rows']
+    metrics.rows_out = stats['blocks']
+    for path in sorted(aligner.written):
+        metrics.add_output(path)
+    print(f"回放完成：{stats['gpu_rows']} 条GPU行，{stats['faults']} 个故障，写出 {stats['blocks']} 个块，"
+          f"缓冲峰值 {stats['peak_buffered_rows']} 行，迟到丢弃 {stats['late_rows']} 行，迟到故障 {stats['late_faults']} 个。")
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay the ECS/GPU CSVs through the streaming aligner.")
+    parser.add_argument('--ecs', default=am.ECS_FILE_PATH)
+    parser.add_argument('--gpu-dir', default=am.GPU_DATA_DIR)
+    parser.add_argument('--output-dir', default=os.path.join(am.OUTPUT_DIR, 'stream'))
+    parser.add_argument('--max-delay', type=int, default=0, help="Seconds of out-of-order rows to tolerate.")
+    args = parser.parse_args()
+
+    gpu_files = sorted(glob_csv(os.path.join(args.gpu_dir, 't2_*_masked.csv')))
+    t3 = find_csv(os.path.join(args.gpu_dir, 't3_masked.csv'))
+    if t3:
+        gpu_files.append(t3)
+    if not gpu_files:
+        print(f"错误：在 '{args.gpu_dir}' 中找不到GPU数据文件。")
+    else:
+        replay_csvs(args.ecs, gpu_files, args.output_dir, max_delay=args.max_delay)
@@ -0,0 +1,177 @@
+"""
+As-of join of the transfer_* outputs into one wide table per host.
+
+transfer_dcgm / transfer_cpu / transfer_network / transfer_request each write
+a CSV with its own sampling times and host column (url, ip, IP; the request
+features have none and apply to every host). Each source is normalised to
+(Time, host), DCGM is pivoted to one column per metric and GPU, and every
+source is matched onto a per-host time grid with pd.merge_asof: the latest
+sample at or before the grid time, shifted by the source's lag and no older
+than its tolerance.
+
+    python asof_join.py train.csv --dcgm dcgm.csv --cpu cpu.csv --network net.csv \\
+        --request request.csv --step 1 --tolerance 2 --lag request=-0.5
+
+Columns are prefixed with the source name; each source's label becomes
+<source>_target and `target` is 1 where any of them is.
+"""
+import re
+
+import instrument
+
+# time column, host column (None: applies to all hosts), column pivoted into per-value columns
+SOURCES = {
+    'dcgm': {'time': 'Time', 'host': 'url', 'pivot': 'gpu_id'},
+    'cpu': {'time': 'Time', 'host': 'ip', 'pivot': None},
+    'network': {'time': 'Time', 'host': 'IP', 'pivot': None},
+    'request': {'time': 'Time', 'host': None, 'pivot': None},
+}
+DROP_COLUMNS = {'type', 'anomaly_metric'}
+DEFAULT_TOLERANCE = 2.0
+
+
+def _find_column(df, preferred, candidates):
+    if preferred in df.columns:
+        return preferred
+    return next((c for c in candidates if c in df.columns), None)
+
+
+def load_source(path, name):
+    """Read one source CSV and normalise it to Time, [host], <name>_<metric> columns."""
+    import pandas as pd
+    from schema_registry import typed_read_csv
+
+    spec = SOURCES[name]
+    df = typed_read_csv(path, floats=False)
+    time_col = _find_column(df, spec['time'], ('Time', 'timestamp', 'time'))
+    if time_col is None:
+        raise ValueError(f"{path}: no time column")
+    host_col = _find_column(df, spec['host'], ('url', 'ip', 'IP')) if spec['host'] else None
+
+    df = df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns])
+    df = df.rename(columns={time_col: 'Time'})
+    df['Time'] = pd.to_numeric(df['Time'], errors='coerce').astype('float64')
+    df = df[df['Time'].notna()]
+    key = ['Time']
+    if host_col:
+        # url is "ip:port" before swap_gpuid_url_and_replace_ip, plain ip after
+        df['host'] = df[host_col].astype(str).str.replace(r':\d+$', '', regex=True)
+        if host_col != 'host':
+            df = df.drop(columns=[host_col])
+        key.append('host')
+
+    pivot = spec['pivot'] if spec['pivot'] in df.columns else None
+    values = [c for c in df.columns if c not in key and c != pivot]
+    if pivot:
+        df[pivot] = df[pivot].astype(str)
+        wide = df.pivot_table(index=key, columns=pivot, values=values, aggfunc='last')
+        wide.columns = [f"{name}_{metric}_gpu{gpu}" for metric, gpu in wide.columns]
+        wide = wide.reset_index()
+        # One label per (Time, host): any GPU
+        targets = [c for c in wide.columns if re.match(rf'^{name}_target_gpu', c)]
+        if targets:
+            wide[f"{name}_target"] = wide[targets].max(axis=1)
+            wide = wide.drop(columns=targets)
+        df = wide
+    else:
+        df = df.groupby(key, sort=False, observed=True)[values].last().reset_index()
+        df = df.rename(columns={c: f"{name}_{c}" for c in values})
+    return df.sort_values('Time', kind='stable').reset_index(drop=True)
+
+
+def build_grid(frames, step=None, base=None):
+    """
+    Per-host time grid: every `step` seconds over the span of all sources of
+    that host, or the (Time, host) rows of the `base` source. A base source
+    without a host column (request) gives its times for every host of the others.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if base is not None:
+        if 'host' in frames[base].columns:
+            grid = frames[base][['Time', 'host']].drop_duplicates()
+        else:
+            hosts = pd.concat([f['host'] for f in frames.values() if 'host' in f.columns]).drop_duplicates()
+            grid = frames[base][['Time']].drop_duplicates().merge(hosts.to_frame(), how='cross')
+        return grid.sort_values('Time', kind='stable').reset_index(drop=True)
+
+    spans = pd.concat([f[['Time', 'host']] for f in frames.values() if 'host' in f.columns])
+    bounds = spans.groupby('host', observed=True)['Time'].agg(['min', 'max'])
+    starts = np.floor(bounds['min'].to_numpy() / step) * step
+    counts = (np.floor((bounds['max'].to_numpy() - starts) / step) + 1).astype(np.int64)
+    hosts = np.repeat(bounds.index.to_numpy(), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    times = np.repeat(starts, counts) + offsets * step
+    return pd.DataFrame({'Time': times, 'host': hosts}).sort_values('Time', kind='stable').reset_index(drop=True)
+
+
+@instrument.instrumented('asof_join.join_sources', outputs=('output_path',))
+def join_sources(paths, output_path=None, step=None, base=None, tolerance=DEFAULT_TOLERANCE, lags=None):
+    """
+    paths: {source: csv path} for any subset of SOURCES. Give either `step`
+    (seconds) or `base` (a source whose sample times become the grid).
+    tolerance: seconds, or {source: seconds}; lags: {source: seconds added
+    to that source's timestamps before matching}.
+    """
+    import pandas as pd
+
+    if (step is None) == (base is None):
+        raise ValueError("Give exactly one of step or base")
+    m = instrument.current()
+    lags = lags or {}
+    frames = {}
+    for name, path in paths.items():
+        if name not in SOURCES:
+            raise ValueError(f"Unknown source {name!r}, expected one of {sorted(SOURCES)}")
+        m.add_input(path)
+        frames[name] = load_source(path, name)
+        m.rows_in += len(frames[name])
+        if lags.get(name):
+            frames[name]['Time'] = frames[name]['Time'] + lags[name]
+    if not any('host' in f.columns for f in frames.values()):
+        raise ValueError("At least one source with a host column is needed for the grid")
+
+    table = build_grid(frames, step, base)
+    for name, frame in frames.items():
+        tol = tolerance.get(name, DEFAULT_TOLERANCE) if isinstance(tolerance, dict) else tolerance
+        if name == base:
+            # Grid times are this source's own times: an exact join
+            table = table.merge(frame, on=['Time', 'host'] if 'host' in frame.columns else 'Time', how='left')
+            continue
+        by = 'host' if 'host' in frame.columns else None
+        if by:
+            frame = frame[frame['host'].isin(table['host'].unique())]
+        table = pd.merge_asof(table, frame, on='Time', by=by, tolerance=tol, direction='backward')
+
+    targets = [c for c in table.columns if c.endswith('_target') and c[:-len('_target')] in SOURCES]
+    if targets:
+        table['target'] = (table[targets].fillna(0) > 0).any(axis=1).astype('int8')
+    table = table.sort_values(['host', 'Time'], kind='stable').reset_index(drop=True)
+    m.rows_out = len(table)
+
+    if output_path:
+        table.to_csv(output_path, index=False)
+        print(f"💾 已合并 {len(frames)} 个数据源: {len(table)} 行 x {table.shape[1]} 列 -> {output_path}")
+    return table
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="As-of join transfer_* CSVs onto one time grid per host.")
+    parser.add_argument('output')
+    for source in SOURCES:
+        parser.add_argument(f'--{source}', default=None, help=f"{source} CSV")
+    grid = parser.add_mutually_exclusive_group(required=True)
+    grid.add_argument('--step', type=float, help="Grid spacing in seconds.")
+    grid.add_argument('--base', choices=sorted(SOURCES), help="Use this source's sample times as the grid.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Max age in seconds of a matched sample.")
+    parser.add_argument('--lag', nargs='*', default=[], metavar='SOURCE=SECONDS',
+                        help="Seconds added to a source's timestamps before matching.")
+    args = parser.parse_args()
+
+    paths = {s: getattr(args, s) for s in SOURCES if getattr(args, s)}
+    lags = {k: float(v) for k, v in (item.split('=', 1) for item in args.lag)}
+    join_sources(paths, args.output, step=args.step, base=args.base, tolerance=args.tolerance, lags=lags)
@@ -0,0 +1,163 @@
+"""
+Block offset index for the aligned per-instance CSVs.
+
+Every the_same_id/<instance>.csv is a header followed by fault blocks separated
+by empty (commas only) rows. The sidecar <instance>.csv.idx.json records, per
+block, its byte offset and length, physical line count, CSV row count and the
+fault timestamp (the status == 0 row), so tools can seek to a block or skip it
+without reading the file:
+
+    index = load_index(path)
+    for block in index['blocks']:
+        if block['lines'] >= 21:
+            lines = read_block_lines(path, block)
+
+The scan tracks quote parity, so a quoted field spanning lines never splits a
+row. The index stores the CSV's size and mtime; a stale or missing sidecar is
+rebuilt in memory by load_index().
+"""
+import io
+import os
+import re
+import csv
+import json
+
+from csv_io import compression_of
+
+INDEX_SUFFIX = '.idx.json'
+INDEX_VERSION = 1
+EMPTY_LINE = re.compile(rb'^[, \t\r\n]*$')
+
+
+def index_path(csv_path):
+    return csv_path + INDEX_SUFFIX
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(path, encoding='utf-8'):
+    """Scan `path` once and return its block index."""
+    blocks = []
+    total_lines = 0
+    status_idx = ts_idx = None
+    header_bytes = 0
+    current = None
+    pending = b''  # physical lines of a row still inside quotes
+    pending_lines = 0
+    offset = 0
+
+    with open(path, 'rb') as f:
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            total_lines += 1
+            if total_lines == 1:
+                header = next(csv.reader([line.decode(encoding, errors='ignore')]), [])
+                status_idx = header.index('status') if 'status' in header else None
+                ts_idx = header.index('timestamp') if 'timestamp' in header else None
+                header_bytes = offset
+                continue
+
+            row_start = line_offset - len(pending)
+            record = pending + line
+            lines_in_record = pending_lines + 1
+            if record.count(b'"') % 2:
+                # Odd number of quotes so far: the row continues on the next line
+                pending, pending_lines = record, lines_in_record
+                continue
+            pending, pending_lines = b'', 0
+
+            if EMPTY_LINE.match(record):
+                current = None
+                continue
+            if current is None:
+                current = {'offset': row_start, 'length': 0, 'lines': 0, 'rows': 0, 'fault_ts': None}
+                blocks.append(current)
+            current['length'] = offset - current['offset']
+            current['lines'] += lines_in_record
+            current['rows'] += 1
+            if status_idx is not None and current['fault_ts'] is None:
+                row = next(csv.reader([record.decode(encoding, errors='ignore')]), [])
+                if len(row) > status_idx and row[status_idx].strip() in ('0', '0.0'):
+                    ts = row[ts_idx].strip() if ts_idx is not None and len(row) > ts_idx else ''
+                    current['fault_ts'] = ts or None
+
+    if pending:
+        # Unbalanced quote at EOF: count the tail as its own block so no line is lost
+        blocks.append({'offset': offset - len(pending), 'length': len(pending),
+                       'lines': pending_lines, 'rows': 1, 'fault_ts': None})
+
+    size, mtime_ns = _file_stamp(path)
+    return {
+        'version': INDEX_VERSION,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'lines': total_lines,
+        'header_bytes': header_bytes,
+        'blocks': blocks,
+    }
+
+
+def write_index(path, encoding='utf-8'):
+    """Build the index for `path` and save it next to it."""
+    index = build_index(path, encoding)
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path(path))
+    return index
+
+
+def load_index(path, rebuild=True):
+    """
+    The sidecar index of `path` if it matches the file, else a freshly built
+    one (or None with rebuild=False). Rebuilt indexes are not written back.
+    Compressed CSVs can't be seeked into and have no index.
+    """
+    if compression_of(path):
+        return None
+    sidecar = index_path(path)
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION and (index['size'], index['mtime_ns']) == _file_stamp(path):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    return build_index(path) if rebuild else None
+
+
+def read_block(path, block):
+    """Raw bytes of one block."""
+    with open(path, 'rb') as f:
+        f.seek(block['offset'])
+        return f.read(block['length'])
+
+
+def _text_lines(data, encoding, errors):
+    # Same lines as readlines() on the file opened in text mode (universal newlines)
+    text = data.decode(encoding, errors=errors).replace('\r\n', '\n').replace('\r', '\n')
+    return io.StringIO(text, newline='\n').readlines()
+
+
+def read_block_lines(path, block, encoding='utf-8', errors='ignore'):
+    """Physical lines of one block, decoded, as f.readlines() would return them."""
+    return _text_lines(read_block(path, block), encoding, errors)
+
+
+def iter_fault_blocks(path, encoding='utf-8'):
+    """Yield (fault_ts, rows) for every block, rows parsed with csv."""
+    index = load_index(path)
+    with open(path, 'rb') as f:
+        for block in index['blocks']:
+            f.seek(block['offset'])
+            lines = _text_lines(f.read(block['length']), encoding, 'ignore')
+            yield block['fault_ts'], list(csv.reader(lines))
+
+
+def is_index_file(name):
+    return name.endswith(INDEX_SUFFIX) or name.endswith(INDEX_SUFFIX + '.tmp')
@@ -0,0 +1,91 @@
+"""
+Periodic pickled checkpoints for long-running jobs (align_multiple.process_gpu_files).
+
+Checkpointer.save(state) pickles `state` to a temp file, fsyncs it and renames
+it over the previous checkpoint, so the file on disk is always the last
+complete one. due() paces saves: at most one every `interval` seconds, and
+after each save waits at least its duration / `max_overhead`, so from the
+second save on the time spent saving stays under `max_overhead` of the run
+(the interval stretches as the state grows). The checkpoint carries a
+fingerprint of the job's inputs and settings; load() ignores a checkpoint
+whose fingerprint differs.
+"""
+import os
+import time
+import pickle
+
+CHECKPOINT_VERSION = 1
+
+
+def file_fingerprint(paths):
+    """[(path, size, mtime_ns)] of the files a job reads; changes invalidate a checkpoint."""
+    out = []
+    for path in paths:
+        st = os.stat(path)
+        out.append((os.path.abspath(path), st.st_size, st.st_mtime_ns))
+    return out
+
+
+class Checkpointer:
+    def __init__(self, path, fingerprint, interval=600, max_overhead=0.05):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.saves = 0
+        self.save_seconds = 0.0
+        self.last_bytes = 0
+        self._started = time.perf_counter()
+        self._last_end = self._started
+        self._last_duration = 0.0
+
+    def load(self):
+        """The saved state, or None if there is no usable checkpoint."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                saved = pickle.load(f)
+        except Exception as e:
+            print(f"Checkpoint {self.path} unreadable ({e}); starting over.")
+            return None
+        if saved.get('version') != CHECKPOINT_VERSION or saved.get('fingerprint') != self.fingerprint:
+            print(f"Checkpoint {self.path} is for different inputs or settings; starting over.")
+            return None
+        return saved['state']
+
+    def due(self):
+        if not self.interval:
+            return False
+        wait = max(self.interval, self._last_duration / self.max_overhead if self.max_overhead else 0)
+        return time.perf_counter() - self._last_end >= wait
+
+    def save(self, state):
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'fingerprint': self.fingerprint, 'state': state},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.last_bytes = os.path.getsize(self.path)
+        self._last_end = time.perf_counter()
+        self._last_duration = self._last_end - start
+        self.saves += 1
+        self.save_seconds += self._last_duration
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(os.path.abspath(self.path)))
+        except OSError:
+            pass  # not empty
+
+    def overhead(self):
+        """(saves, seconds spent saving, fraction of the elapsed time)."""
+        elapsed = time.perf_counter() - self._started
+        return self.saves, self.save_seconds, self.save_seconds / elapsed if elapsed > 0 else 0.0
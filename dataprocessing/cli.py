@@ -0,0 +1,135 @@
+"""
+One entry point for the data-processing scripts.
+
+    python cli.py check_duplicates --input-file merge.csv     # any get_data stage
+    python cli.py get_data --force filter_files               # the whole cleaning pipeline
+    python cli.py transfer_dcgm dcgm-1769854457 dcgm_metrics.csv
+    python cli.py align
+
+A module is imported only when its command runs: the get_data stages use the
+csv module alone, so they start without loading pandas or numpy. get_data
+stage commands take the stage's own paths and parameters as defaults, with
+one --flag per argument of the stage function.
+"""
+import sys
+import runpy
+import argparse
+import importlib
+
+# command -> module whose `if __name__ == '__main__'` block handles the arguments
+SCRIPT_COMMANDS = {
+    'get_data': ('get_data', "Run the merge.csv cleaning pipeline, skipping up-to-date stages."),
+    'align': ('align_multiple.align_multiple', "Align GPU logs to ECS faults (settings at the top of the script)."),
+    'stream_align': ('align_multiple.stream_align', "Replay the ECS/GPU CSVs through the streaming aligner."),
+    'shard_merge': ('sharding', "Verify/combine the manifests of a sharded alignment run (align --shards N --shard-id k)."),
+    'prepare_ecs': ('ecs_process.prepare_ecs', "Repair, deduplicate and sort the raw ECS fault CSV."),
+    'sort': ('external_sort', "External merge sort of a large CSV."),
+    'features': ('fault_features', "Per-fault feature table from the aligned CSVs."),
+    'detect': ('stream_detector', "Label a DCGM/network/CPU CSV with the streaming detector."),
+    'tune': ('threshold_tuner', "Tune per-IP metric thresholds against a labelled CSV."),
+    'join': ('asof_join', "As-of join of the dcgm/cpu/network/request CSVs onto one time grid."),
+    'csv_bench': ('csv_engine', "Benchmark the CSV engines on a file."),
+    'codebook': ('codebook', "Encode/decode string columns of a CSV with a persistent code book."),
+    'profile': ('column_sketch', "Approximate per-column profile (distinct, quantiles, top values) of a CSV."),
+}
+# command -> module whose main(input, output) runs the parse + label example
+TRANSFER_COMMANDS = {
+    'transfer_dcgm': 'transfer_dcgm',
+    'transfer_cpu': 'transfer_cpu',
+    'transfer_network': 'transfer_network',
+    'transfer_request': 'transfer_request',
+}
+
+
+def _run_script(module, argv):
+    # alter_sys makes the module __main__ while it runs, so worker processes can unpickle its functions
+    sys.argv = [module] + argv
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+def _run_transfer(module, argv):
+    import inspect
+
+    main = importlib.import_module(module).main
+    parser = argparse.ArgumentParser(prog=f"cli.py {module}", description=f"Parse and label with {module}.py.")
+    parser.add_argument('input', nargs='?', help="Raw metrics file (default: the script's INPUT_FILE).")
+    parser.add_argument('output', nargs='?', help="Labelled CSV (default: the script's OUTPUT_FILE).")
+    params = inspect.signature(main).parameters
+    if 'detect_threshold' in params:
+        parser.add_argument('--detect-threshold', type=float, default=None,
+                            help="Relabel with the streaming detector (stream_detector) at this score instead of the fixed thresholds.")
+    if 'export_dir' in params:
+        parser.add_argument('--export-dir', default=None,
+                            help="Also export the labelled rows as binary columns (metric_export) here.")
+    args = parser.parse_args(argv)
+    kwargs = {name: getattr(args, name) for name in ('detect_threshold', 'export_dir')
+              if getattr(args, name, None) is not None}
+    main(*[a for a in (args.input, args.output) if a is not None], **kwargs)
+
+
+def _stage_parser(stage):
+    import inspect
+
+    defaults = stage.kwargs()
+    doc = (inspect.getdoc(stage.func) or '').split('\n')[0] or None
+    parser = argparse.ArgumentParser(prog=f"cli.py {stage.name}", description=doc)
+    for name, param in inspect.signature(stage.func).parameters.items():
+        default = defaults.get(name, param.default)
+        flag = '--' + name.replace('_', '-')
+        if isinstance(default, (set, list, tuple)):
+            parser.add_argument(flag, dest=name, nargs='*', default=default, help=f"(default: {sorted(default)})")
+        elif isinstance(default, bool):
+            # --use-index / --no-use-index; a plain string value like 'False' would be truthy
+            parser.add_argument(flag, dest=name, action=argparse.BooleanOptionalAction, default=default,
+                                help=f"(default: {default})")
+        elif default is None or default is inspect.Parameter.empty:
+            parser.add_argument(flag, dest=name, default=default, help=f"(default: {default})")
+        else:
+            parser.add_argument(flag, dest=name, type=type(default), default=default, help=f"(default: {default})")
+    return parser
+
+
+def _run_stage(stage, argv):
+    kwargs = vars(_stage_parser(stage).parse_args(argv))
+    for name, value in kwargs.items():
+        if isinstance(stage.kwargs().get(name), set):
+            kwargs[name] = set(value)
+    stage.func(**kwargs)
+
+
+def _stages():
+    import get_data
+
+    return {stage.name: stage for stage in get_data.build_pipeline()}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command, rest = (argv[0], argv[1:]) if argv else (None, [])
+
+    if command in SCRIPT_COMMANDS:
+        return _run_script(SCRIPT_COMMANDS[command][0], rest)
+    if command in TRANSFER_COMMANDS:
+        return _run_transfer(TRANSFER_COMMANDS[command], rest)
+    stages = _stages()
+    if command in stages:
+        return _run_stage(stages[command], rest)
+
+    print("Usage: python cli.py COMMAND [ARGS...]   (python cli.py COMMAND -h for its arguments)\n")
+    print("Scripts:")
+    for name, (module, help_text) in SCRIPT_COMMANDS.items():
+        print(f"  {name:<36} {help_text}")
+    print("Parse + label (input/output default to the script's paths):")
+    for name in TRANSFER_COMMANDS:
+        print(f"  {name}")
+    print("get_data stages (csv module only):")
+    for name, stage in stages.items():
+        print(f"  {name:<36} get_data.{stage.func.__name__}")
+    if command not in (None, '-h', '--help'):
+        print(f"\nUnknown command: {command}")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
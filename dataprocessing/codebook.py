@@ -0,0 +1,208 @@
+"""
+Persistent code books for repetitive string columns of merge.csv.
+
+description, diag_id, kernel_version and device_name repeat a handful of
+values across millions of rows. encode_csv() rewrites them as integer codes,
+learning one code book per column in a JSON file ({column: [value for code 0,
+value for code 1, ...]}). Books are append-only: values seen for the first
+time get the next free code and existing codes never change, so every file
+encoded against an older version of the book still decodes. Empty cells stay
+empty; every other value, including '[]' and 'Unknown', gets a code, so
+decoding gives back the original text.
+
+decode_csv() restores a CSV; decode_frame() turns code columns of a DataFrame
+into pd.Categorical (int codes + the book as categories) without building one
+string per row. encode_csv() prints, per column, the CSV bytes and the pandas
+memory (object strings vs categorical codes) before and after.
+
+    python codebook.py encode merge_desparse.csv merge_encoded.csv codebook.json
+    python codebook.py decode merge_encoded.csv merge_decoded.csv codebook.json
+"""
+import os
+import sys
+import csv
+import json
+from collections import Counter
+
+from csv_io import open_text
+from csv_engine import open_rows
+from instrument import counted, CountingWriter
+
+ENCODE_COLUMNS = ('description', 'diag_id', 'kernel_version', 'device_name')
+
+# Smallest signed dtype holding every code (-1 marks empty in a Categorical)
+CODE_DTYPES = [('int8', 2 ** 7 - 1), ('int16', 2 ** 15 - 1), ('int32', 2 ** 31 - 1)]
+_POINTER_BYTES = 8
+
+
+class CodeBook:
+    def __init__(self, path=None):
+        self.path = path
+        self.values = {}   # column -> [value, ...], index is the code
+        self._codes = {}   # column -> {value: code}
+        self.added = Counter()
+        if path and os.path.exists(path):
+            with open_text(path, 'r', encoding='utf-8') as f:
+                for column, values in json.load(f).items():
+                    self.values[column] = list(values)
+                    self._codes[column] = {v: i for i, v in enumerate(values)}
+
+    def __contains__(self, column):
+        return column in self.values
+
+    def encode(self, column, value):
+        if not value:
+            return ''
+        codes = self._codes.setdefault(column, {})
+        code = codes.get(value)
+        if code is None:
+            values = self.values.setdefault(column, [])
+            code = codes[value] = len(values)
+            values.append(value)
+            self.added[column] += 1
+        return str(code)
+
+    def decode(self, column, code):
+        if code == '' or code is None:
+            return ''
+        return self.values[column][int(code)]
+
+    def dtype(self, column):
+        n = len(self.values.get(column, ()))
+        return next(name for name, hi in CODE_DTYPES if n - 1 <= hi)
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open_text(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.values, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)  # a crash mid-write keeps the previous book
+
+
+def _object_bytes(counts):
+    # what DataFrame.memory_usage(deep=True) counts for an object column
+    return sum((sys.getsizeof(v) + _POINTER_BYTES) * n for v, n in counts.items())
+
+
+def _categorical_bytes(book, column, rows):
+    itemsize = {'int8': 1, 'int16': 2, 'int32': 4}[book.dtype(column)]
+    return rows * itemsize + sum(sys.getsizeof(v) + _POINTER_BYTES for v in book.values.get(column, ()))
+
+
+def encode_csv(input_file, output_file, codebook_file, columns=ENCODE_COLUMNS):
+    """
+    Rewrite `columns` of input_file as codes from (and added to) codebook_file.
+    Returns {column: stats} with csv_bytes_before/after and memory_bytes_before/after.
+    """
+    book = CodeBook(codebook_file)
+    with open_rows(input_file, encoding='utf-8', errors='ignore') as source, \
+         open_text(output_file, 'w', encoding='utf-8', newline='') as fout:
+        reader = counted(source)
+        writer = CountingWriter(csv.writer(fout))
+        headers = next(reader, None)
+        if not headers:
+            print("File is empty.")
+            return {}
+        writer.writerow(headers)
+        targets = [(i, h) for i, h in enumerate(headers) if h in columns]
+        missing = [c for c in columns if c not in headers]
+        if missing:
+            print(f"Columns not in file, left out: {missing}")
+
+        seen = {h: Counter() for _, h in targets}
+        rows = 0
+        for row in reader:
+            rows += 1
+            for i, column in targets:
+                if i < len(row):
+                    value = row[i]
+                    seen[column][value] += 1
+                    row[i] = book.encode(column, value)
+            writer.writerow(row)
+
+    book.save()
+    stats = {}
+    for _, column in targets:
+        counts = seen[column]
+        code_bytes = sum(len(book.encode(column, v)) * n for v, n in counts.items())
+        stats[column] = {
+            'distinct': len(book.values.get(column, ())),
+            'new_values': book.added[column],
+            'csv_bytes_before': sum(len(v.encode('utf-8')) * n for v, n in counts.items()),
+            'csv_bytes_after': code_bytes,
+            'memory_bytes_before': _object_bytes(counts),
+            'memory_bytes_after': _categorical_bytes(book, column, rows),
+        }
+    _print_gains(stats, rows)
+    print(f"Saved encoded data to {output_file}, code book to {codebook_file}")
+    return stats
+
+
+def _print_gains(stats, rows):
+    print(f"Encoded {len(stats)} columns over {rows} rows:")
+    total_before = total_after = 0
+    for column, s in stats.items():
+        total_before += s['csv_bytes_before']
+        total_after += s['csv_bytes_after']
+        print(f"  {column}: {s['distinct']} codes (+{s['new_values']} new), "
+              f"CSV {s['csv_bytes_before'] / 1e6:.2f} -> {s['csv_bytes_after'] / 1e6:.2f} MB, "
+              f"memory {s['memory_bytes_before'] / 1e6:.2f} -> {s['memory_bytes_after'] / 1e6:.2f} MB")
+    print(f"  CSV bytes saved: {(total_before - total_after) / 1e6:.2f} MB")
+
+
+def decode_csv(input_file, output_file, codebook_file, columns=None):
+    """Replace codes with their values for `columns` (default: every column in the book)."""
+    book = CodeBook(codebook_file)
+    with open_rows(input_file, encoding='utf-8', errors='ignore') as source, \
+         open_text(output_file, 'w', encoding='utf-8', newline='') as fout:
+        reader = counted(source)
+        writer = CountingWriter(csv.writer(fout))
+        headers = next(reader, None)
+        if not headers:
+            print("File is empty.")
+            return
+        writer.writerow(headers)
+        wanted = book.values.keys() if columns is None else columns
+        targets = [(i, h) for i, h in enumerate(headers) if h in wanted and h in book]
+        for row in reader:
+            for i, column in targets:
+                if i < len(row):
+                    row[i] = book.decode(column, row[i])
+            writer.writerow(row)
+    print(f"Saved decoded data to {output_file}")
+
+
+def decode_frame(df, codebook, columns=None):
+    """
+    Turn code columns of `df` into pd.Categorical in place, with the book's
+    values as categories (empty cells become NaN). `codebook` is a CodeBook or a path.
+    """
+    import pandas as pd
+
+    book = codebook if isinstance(codebook, CodeBook) else CodeBook(codebook)
+    wanted = book.values.keys() if columns is None else columns
+    for column in [c for c in df.columns if c in wanted and c in book]:
+        codes = pd.to_numeric(df[column].astype(object), errors='coerce').fillna(-1).astype(book.dtype(column))
+        df[column] = pd.Categorical.from_codes(codes, categories=book.values[column])
+    return df
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Encode/decode string columns with a persistent code book.")
+    parser.add_argument('mode', choices=('encode', 'decode'))
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('codebook')
+    parser.add_argument('--columns', nargs='*', default=None,
+                        help=f"Columns to encode/decode (encode default: {list(ENCODE_COLUMNS)}).")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"File not found: {args.input}")
+    elif args.mode == 'encode':
+        encode_csv(args.input, args.output, args.codebook, args.columns or ENCODE_COLUMNS)
+    else:
+        decode_csv(args.input, args.output, args.codebook, args.columns)
@@ -0,0 +1,356 @@
+"""
+Pluggable CSV readers: pyarrow's multithreaded parser when it is installed,
+the csv module / pandas C engine otherwise.
+
+    with open_rows(path, encoding='utf-8', errors='ignore') as rows:   # csv.reader
+        header = next(rows)
+    with open_dicts(path) as records:                                  # csv.DictReader
+        ...
+    for chunk in read_csv_chunks(path, 500000, dtype=schema):          # pd.read_csv(chunksize=...)
+        ...
+
+The engine is picked per call: GPUCLUSTER_CSV_ENGINE=python forces the old
+engines, =arrow uses Arrow when pyarrow imports, =auto (default) uses it for
+row scans only, and only with more than one core. Arrow reads files up to
+ARROW_MAX_TABLE_MB in one multithreaded pass and streams larger or compressed
+ones block by block. Under 'auto', row scans use Arrow only with a column
+projection: turning every field into a Python string costs as much as
+csv.reader's whole scan (300-column file, 100k rows: csv 1.9s, Arrow parse
+3.4s on one thread plus 2.1s to build the lists). Chunked frame reads
+(read_csv_chunks) use Arrow only with =arrow (4.3-4.9s -> 4.0s on the same
+file), because their result can differ from pandas, see below.
+
+Both paths give the same rows and frames: rows are read as strings exactly as
+csv.reader splits them, and frames take the registry dtypes (parsed the way
+pandas parses them) and pandas' NA strings, with dates kept as text. Whenever
+Arrow can't reproduce the old reader (ragged rows, invalid UTF-8 with
+errors='ignore', duplicate or empty column names, a value that doesn't fit
+the inferred or requested type, pandas-only options) the call falls back to
+the old engine, continuing after the rows already returned. Known differences,
+which is why frames need =arrow: Arrow infers one type per column for the
+whole file, so a column mixing text and numbers stays text in every chunk
+(and an integer column with gaps in some chunks is float in all of them),
+where pandas infers each chunk on its own and the aligned output changes
+(2 vs 2.0); blank lines are skipped rather than returned as [].
+"""
+import os
+import csv
+import time
+import hashlib
+import importlib.util
+from contextlib import contextmanager
+
+from csv_io import open_text, compression_of
+
+ENGINE = os.environ.get('GPUCLUSTER_CSV_ENGINE', 'auto')
+ARROW_BLOCK_MB = 16
+# Files up to this size are parsed in one multithreaded read; larger ones are streamed
+ARROW_MAX_TABLE_MB = 1024
+
+# pandas' default na_values
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+                    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+PANDAS_TRUE_VALUES = ['True', 'TRUE', 'true']
+PANDAS_FALSE_VALUES = ['False', 'FALSE', 'false']
+# read_csv options the Arrow path understands or can ignore
+ARROW_FRAME_KWARGS = {'usecols', 'low_memory'}
+
+
+def arrow_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def use_arrow(engine=None, encoding='utf-8'):
+    engine = engine or ENGINE
+    if engine not in ('auto', 'arrow', 'python'):
+        raise ValueError(f"Unknown CSV engine {engine!r}, expected 'auto', 'arrow' or 'python'")
+    if engine == 'python' or (encoding or 'utf-8').lower().replace('-', '') != 'utf8':
+        return False
+    if engine == 'auto' and (os.cpu_count() or 1) < 2:
+        return False  # Arrow's gain is its threads; single-threaded it parses no faster than csv/pandas
+    return arrow_available()
+
+
+def _arrow_errors():
+    import pyarrow as pa
+
+    return (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError)
+
+
+def _read_header(path, encoding):
+    with open_text(path, 'r', encoding=encoding, errors='ignore', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def _arrow_batches(path, header, column_types, include=None, strings_only=False):
+    """Record batches of `path` (header row skipped), multithreaded when the file is small enough."""
+    import pyarrow as pa
+    import pyarrow.csv as pc
+
+    read_options = pc.ReadOptions(column_names=header, skip_rows=1, use_threads=True,
+                                  block_size=ARROW_BLOCK_MB * 1024 * 1024)
+    parse_options = pc.ParseOptions(newlines_in_values=True)
+    if strings_only:
+        convert_options = pc.ConvertOptions(column_types=column_types, include_columns=include,
+                                            strings_can_be_null=False, null_values=[])
+    else:
+        convert_options = pc.ConvertOptions(column_types=column_types, include_columns=include,
+                                            null_values=PANDAS_NA_VALUES, strings_can_be_null=True,
+                                            true_values=PANDAS_TRUE_VALUES, false_values=PANDAS_FALSE_VALUES)
+    source = pa.input_stream(path, compression=compression_of(path))
+    if compression_of(path) is None and os.path.getsize(path) <= ARROW_MAX_TABLE_MB * 1024 * 1024:
+        with source:
+            table = pc.read_csv(source, read_options=read_options, parse_options=parse_options,
+                                convert_options=convert_options)
+        return table.schema, iter(table.to_batches())
+    reader = pc.open_csv(source, read_options=read_options, parse_options=parse_options,
+                         convert_options=convert_options)
+    return reader.schema, iter(reader)
+
+
+# --- csv.reader / csv.DictReader ---
+
+def _python_rows(path, encoding, errors, columns, skip_records=0):
+    with open_text(path, 'r', encoding=encoding, errors=errors) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        picks = [header.index(c) for c in columns] if columns else None
+        if not skip_records:
+            yield [header[i] for i in picks] if picks else header
+        for row in reader:
+            if skip_records:
+                # Resuming after Arrow: it returned every non-empty record so far
+                skip_records -= bool(row)
+                continue
+            yield [row[i] if i < len(row) else '' for i in picks] if picks else row
+
+
+def _arrow_rows(path, encoding, errors, columns):
+    import pyarrow as pa
+
+    header = _read_header(path, encoding)
+    if not header:
+        return
+    include = list(columns) if columns else None
+    schema, batches = _arrow_batches(path, header, {name: pa.string() for name in header},
+                                     include=include, strings_only=True)
+    yield include or header
+    done = 0
+    try:
+        for batch in batches:
+            columns_data = [col.to_pylist() for col in batch.columns]
+            for row in zip(*columns_data):
+                yield list(row)
+            done += batch.num_rows
+    except _arrow_errors() as e:
+        print(f"Arrow CSV reader stopped at row {done} of {os.path.basename(path)} ({e}); "
+              f"continuing with the csv module.")
+        yield from _python_rows(path, encoding, errors, columns, skip_records=done)
+
+
+def _rows(path, encoding, errors, columns, engine):
+    # Full-width rows are bound by building the Python lists: only 'arrow' forces them through Arrow
+    if use_arrow(engine, encoding) and (columns or (engine or ENGINE) == 'arrow'):
+        try:
+            rows = _arrow_rows(path, encoding, errors, columns)
+            first = next(rows, None)
+        except _arrow_errors() as e:
+            print(f"Arrow CSV reader can't read {os.path.basename(path)} ({e}); using the csv module.")
+        else:
+            if first is not None:
+                yield first
+                yield from rows
+            return
+    yield from _python_rows(path, encoding, errors, columns)
+
+
+@contextmanager
+def open_rows(path, encoding='utf-8', errors=None, columns=None, engine=None):
+    """
+    Rows of `path` as lists of strings, header first, like csv.reader over
+    open_text(path). `columns` projects (and orders) the columns.
+    """
+    rows = _rows(path, encoding, errors, columns, engine)
+    try:
+        yield rows
+    finally:
+        rows.close()
+
+
+def _record(header, row):
+    # csv.DictReader's handling of short and long rows
+    record = dict(zip(header, row))
+    if len(row) > len(header):
+        record[None] = row[len(header):]
+    elif len(row) < len(header):
+        for key in header[len(row):]:
+            record[key] = None
+    return record
+
+
+@contextmanager
+def open_dicts(path, encoding=None, errors=None, engine=None):
+    """Records of `path` as dicts, like csv.DictReader over open_text(path)."""
+    with open_rows(path, encoding, errors, engine=engine) as rows:
+        header = next(rows, None)
+        yield (_record(header, row) for row in rows if row) if header else iter(())
+
+
+# --- pd.read_csv(chunksize=...) ---
+
+def _arrow_column_types(header, dtype):
+    import pyarrow as pa
+
+    types = {}
+    for col, dt in (dtype or {}).items():
+        if col not in header:
+            continue
+        dt = str(dt)
+        if dt == 'category' or dt in ('object', 'str'):
+            types[col] = pa.string()
+        elif dt.startswith(('float', 'Float', 'Int', 'UInt')):
+            types[col] = pa.float64()  # parsed as double, then cast like pandas does
+        elif dt.startswith(('int', 'uint')):
+            types[col] = pa.int64()
+        else:
+            raise TypeError(f"dtype {dt} of column {col} has no Arrow equivalent")
+    return types
+
+
+def _is_text_like(arrow_type):
+    import pyarrow as pa
+
+    return (pa.types.is_temporal(arrow_type) or pa.types.is_decimal(arrow_type)
+            or pa.types.is_dictionary(arrow_type))
+
+
+def _to_frame(table, dtype, start):
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    df = table.to_pandas()
+    df.index = pd.RangeIndex(start, start + len(df))
+    for field in table.schema:
+        col = field.name
+        if pa.types.is_null(field.type):
+            df[col] = np.nan
+        elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    for col, dt in (dtype or {}).items():
+        if col not in df.columns:
+            continue
+        if str(dt).startswith(('int', 'uint')):
+            info = np.iinfo(str(dt))
+            values = df[col]
+            if len(values) and (values.min() < info.min or values.max() > info.max):
+                raise OverflowError(f"Values of column {col} don't fit {dt}")
+        df[col] = df[col].astype(dt)
+    return df
+
+
+def _arrow_frames(path, chunksize, dtype, usecols):
+    import pyarrow as pa
+
+    header = _read_header(path, 'utf-8')
+    if not header or len(set(header)) != len(header) or '' in header:
+        raise ValueError("header has duplicate or empty column names")  # pandas would rename them
+    include = [c for c in header if c in set(usecols)] if usecols is not None else None
+    column_types = _arrow_column_types(header, dtype)
+    schema, batches = _arrow_batches(path, header, column_types, include=include)
+    text_like = {f.name: pa.string() for f in schema if _is_text_like(f.type)}
+    if text_like:
+        # pandas leaves dates and the like as text
+        column_types.update(text_like)
+        schema, batches = _arrow_batches(path, header, column_types, include=include)
+
+    pending, pending_rows, done = [], 0, 0
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=schema)
+            yield _to_frame(table.slice(0, chunksize), dtype, done)
+            done += chunksize
+            rest = table.slice(chunksize)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+    if pending_rows:
+        yield _to_frame(pa.Table.from_batches(pending, schema=schema), dtype, done)
+
+
+def read_csv_chunks(path, chunksize, dtype=None, engine=None, **kwargs):
+    """
+    pd.read_csv(path, chunksize=chunksize, dtype=dtype, **kwargs) as a
+    generator of frames, parsed by Arrow only when the engine is 'arrow'.
+    """
+    import pandas as pd
+
+    done = 0
+    if (engine or ENGINE) == 'arrow' and use_arrow(engine) and set(kwargs) <= ARROW_FRAME_KWARGS:
+        frames = _arrow_frames(path, chunksize, dtype, kwargs.get('usecols'))
+        try:
+            for frame in frames:
+                done += len(frame)
+                yield frame
+            return
+        except _arrow_errors() + (ValueError, TypeError, OverflowError) as e:
+            where = f" after {done} rows" if done else ""
+            print(f"Arrow CSV reader can't read {os.path.basename(path)}{where} ({e}); using pandas.")
+        finally:
+            frames.close()
+
+    skip = range(1, done + 1) if done else None
+    with pd.read_csv(path, chunksize=chunksize, dtype=dtype, skiprows=skip, **kwargs) as reader:
+        for chunk in reader:
+            if done:
+                chunk.index = pd.RangeIndex(done, done + len(chunk))
+                done += len(chunk)
+            yield chunk
+
+
+def benchmark(path, chunksize=500000, dtype=None, engines=('python', 'arrow')):
+    """
+    Time a full row scan and a chunked frame read of `path` with each engine
+    and compare digests of what they returned. Returns
+    {engine: {'rows_s', 'frames_s'}, 'identical': bool}.
+    """
+    import pandas as pd
+
+    results, digests = {}, {}
+    for engine in engines:
+        rows_digest = hashlib.sha1()
+        start = time.perf_counter()
+        with open_rows(path, encoding='utf-8', engine=engine) as rows:
+            for row in rows:
+                if row:
+                    rows_digest.update('\x1f'.join(row).encode('utf-8') + b'\n')
+        rows_s = time.perf_counter() - start
+
+        frames_digest = hashlib.sha1()
+        start = time.perf_counter()
+        for frame in read_csv_chunks(path, chunksize, dtype=dtype, engine=engine, low_memory=False):
+            frames_digest.update(repr(list(frame.dtypes.astype(str).items())).encode('utf-8'))
+            frames_digest.update(pd.util.hash_pandas_object(frame).to_numpy().tobytes())
+        frames_s = time.perf_counter() - start
+
+        results[engine] = {'rows_s': round(rows_s, 3), 'frames_s': round(frames_s, 3)}
+        digests[engine] = (rows_digest.hexdigest(), frames_digest.hexdigest())
+    results['identical'] = len(set(digests.values())) == 1
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+
+    from schema_registry import get_schema
+
+    if len(sys.argv) < 2:
+        print("Usage: python csv_engine.py file.csv [chunksize] [--typed]")
+        sys.exit(1)
+    csv_path = sys.argv[1]
+    size = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 500000
+    schema = get_schema(csv_path) if '--typed' in sys.argv else None
+    print(json.dumps(benchmark(csv_path, size, dtype=schema), indent=1))
@@ -0,0 +1,89 @@
+"""
+Transparent compressed text I/O for the pipeline CSVs.
+
+The compression is chosen by file extension: `.gz` uses gzip, `.zst`/`.zstd`
+uses zstandard (imported only when such a file is opened) with a
+multithreaded compressor, anything else is a plain file. open_text() is a
+drop-in for open() in text mode; pandas_compression() gives the matching
+`compression=` argument for DataFrame.to_csv (pd.read_csv infers it by itself).
+
+    with open_text('merge.csv.zst', 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+"""
+import io
+import os
+import glob
+import gzip
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Compression threads for zstd; -1 uses every core
+ZSTD_THREADS = int(os.environ.get('GPUCLUSTER_ZSTD_THREADS', '-1'))
+
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+CSV_SUFFIXES = ('.csv',) + tuple('.csv' + s for s in COMPRESSION_SUFFIXES)
+
+
+def compression_of(path):
+    """'gzip', 'zstd' or None, from the file extension."""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+
+def is_csv(path):
+    return str(path).lower().endswith(CSV_SUFFIXES)
+
+
+def open_text(path, mode='r', encoding=None, errors=None, newline=None, compression='infer'):
+    """
+    open() in text mode ('r', 'w' or 'a'), compressing or decompressing on the
+    fly. `compression` overrides the extension, e.g. for temporary files.
+    """
+    method = compression_of(path) if compression == 'infer' else compression
+    mode = mode.replace('t', '')
+    if method is None:
+        return open(path, mode, encoding=encoding, errors=errors, newline=newline)
+    if method == 'gzip':
+        return gzip.open(path, mode + 't', compresslevel=GZIP_LEVEL,
+                         encoding=encoding, errors=errors, newline=newline)
+    if method == 'zstd':
+        import zstandard
+
+        raw = open(path, mode + 'b')
+        if 'r' in mode:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            stream = io.BufferedReader(stream)
+        else:
+            # Appending adds a new frame; readers continue across frames
+            cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+            stream = cctx.stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding=encoding, errors=errors, newline=newline)
+    raise ValueError(f"Unknown compression {method!r}")
+
+
+def pandas_compression(path):
+    """`compression=` argument for DataFrame.to_csv(path)."""
+    method = compression_of(path)
+    if method == 'gzip':
+        return {'method': 'gzip', 'compresslevel': GZIP_LEVEL}
+    if method == 'zstd':
+        return {'method': 'zstd', 'level': ZSTD_LEVEL, 'threads': ZSTD_THREADS}
+    return None
+
+
+def glob_csv(pattern):
+    """glob(pattern) for a '*.csv' pattern, also matching its .csv.gz / .csv.zst variants."""
+    paths = set()
+    for suffix in CSV_SUFFIXES:
+        paths.update(glob.glob(pattern[:-len('.csv')] + suffix if pattern.endswith('.csv') else pattern))
+    return sorted(paths)
+
+
+def find_csv(path):
+    """`path` itself if it exists, else its first existing compressed variant, else None."""
+    if os.path.exists(path):
+        return path
+    if path.endswith('.csv'):
+        for suffix in COMPRESSION_SUFFIXES:
+            if os.path.exists(path + suffix):
+                return path + suffix
+    return None
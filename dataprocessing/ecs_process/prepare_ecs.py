@@ -0,0 +1,194 @@
+import os
+import sys
+import csv
+import mmap
+import hashlib
+import heapq
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from external_sort import SortKey, external_sort
+
+# 流式合并 process_ecs.py + sort_unique_ecs.py：
+# 字段修正 -> 整行去重（保留首次出现）-> 按 timestamp 升序外部排序，内存占用与文件大小无关
+
+ECS_INPUT_PATH = "/workspace/process_data_byBD/Data_alignment/tuomin_data/1.24/original_data/shiyan.csv"
+ECS_OUTPUT_PATH = "/workspace/process_data_byBD/Data_alignment/tuomin_data/1.24/original_data/ecs_shiyan.csv"
+
+# 该日数据中 instance_id 缺失而 ip 可用
+REPAIR_DATE = 20260113
+
+CHUNK_ROWS = 200000           # 每个排序 run 的行数
+DEDUP_MEMORY_ITEMS = 2000000  # 内存中最多保留的行摘要数，超出后落盘
+DIGEST_SIZE = 16
+MAX_SPILL_RUNS = 8            # 摘要 run 超过该数量时合并为一个，控制查找次数
+
+
+class SpillingDigestSet:
+    """
+    精确去重用的定长摘要集合，内存有上限。
+    超过 max_items 后把内存中的摘要排序写成 run 文件，之后通过 mmap 二分查找。
+    """
+
+    def __init__(self, max_items=DEDUP_MEMORY_ITEMS, tmp_dir=None, digest_size=DIGEST_SIZE):
+        self.max_items = max_items
+        self.digest_size = digest_size
+        self.memory = set()
+        self.runs = []  # [(file, mmap, count)]
+        self.spill_dir = tempfile.mkdtemp(prefix='ecs_dedup_', dir=tmp_dir)
+        self.spilled_items = 0
+
+    def add(self, digest):
+        """加入摘要；若此前已存在返回 False。"""
+        if digest in self.memory or self._in_runs(digest):
+            return False
+        self.memory.add(digest)
+        if len(self.memory) >= self.max_items:
+            self._spill()
+        return True
+
+    def _in_runs(self, digest):
+        size = self.digest_size
+        for _, mm, count in self.runs:
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                val = mm[mid * size:(mid + 1) * size]
+                if val < digest:
+                    lo = mid + 1
+                elif val > digest:
+                    hi = mid
+                else:
+                    return True
+        return False
+
+    def _spill(self):
+        digests = sorted(self.memory)
+        self.memory = set()
+        self.spilled_items += len(digests)
+        if len(self.runs) + 1 > MAX_SPILL_RUNS:
+            # 流式合并所有 run，避免把全部摘要读回内存
+            digests = heapq.merge(digests, *(self._iter_run(mm, count) for _, mm, count in self.runs))
+        path = os.path.join(self.spill_dir, f"digests_{self.spilled_items}.bin")
+        with open(path, 'wb') as f:
+            f.writelines(digests)
+        if len(self.runs) + 1 > MAX_SPILL_RUNS:
+            self._close_runs()
+        f = open(path, 'rb')
+        count = os.path.getsize(path) // self.digest_size
+        self.runs.append((f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), count))
+
+    def _iter_run(self, mm, count):
+        size = self.digest_size
+        for i in range(count):
+            yield mm[i * size:(i + 1) * size]
+
+    def _close_runs(self):
+        for f, mm, _ in self.runs:
+            mm.close()
+            f.close()
+            os.remove(f.name)
+        self.runs = []
+
+    def close(self):
+        self._close_runs()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def normalize_timestamp(val):
+    """保持整数字符串格式（避免浮点 .0），无效值与 pandas Int64 一致写为 <NA>。"""
+    val = val.strip()
+    try:
+        return str(int(val))
+    except ValueError:
+        pass
+    try:
+        num = float(val)
+    except ValueError:
+        return '<NA>'
+    if num != num or not num.is_integer():
+        return '<NA>'
+    return str(int(num))
+
+
+def _is_repair_date(val):
+    try:
+        return int(float(val)) == REPAIR_DATE
+    except ValueError:
+        return False
+
+
+def iter_repaired_rows(reader, header):
+    """对 date == REPAIR_DATE 的行：ip 移至 instance_id，原 ip 置空。"""
+    date_idx = header.index('date')
+    ip_idx = header.index('ip')
+    inst_idx = header.index('instance_id')
+    width = len(header)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        if not row[inst_idx].strip():
+            row[inst_idx] = ''
+        if _is_repair_date(row[date_idx]):
+            row[inst_idx] = row[ip_idx]
+            row[ip_idx] = ''
+        yield row
+
+
+def iter_unique_rows(rows, seen, stats):
+    """整行完全相同才视为重复，保留首次出现。"""
+    for row in rows:
+        digest = hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+        if seen.add(digest):
+            yield row
+        else:
+            stats['duplicates'] += 1
+
+
+def prepare_ecs(input_path=ECS_INPUT_PATH, output_path=ECS_OUTPUT_PATH, chunk_rows=CHUNK_ROWS,
+                dedup_memory_items=DEDUP_MEMORY_ITEMS, tmp_dir=None):
+    stats = {'rows_in': 0, 'duplicates': 0, 'rows_out': 0}
+    seen = SpillingDigestSet(dedup_memory_items, tmp_dir)
+    # 允许 input_path == output_path（原地覆盖），先写临时文件
+    tmp_output = output_path + '.tmp'
+    try:
+        with open(input_path, 'r', encoding='utf-8-sig', newline='') as fin, \
+             open(tmp_output, 'w', encoding='utf-8-sig', newline='') as fout:
+            reader = csv.reader(fin)
+            header = next(reader)
+            ts_idx = header.index('timestamp')
+
+            def counted(rows):
+                for row in rows:
+                    stats['rows_in'] += 1
+                    yield row
+
+            def with_timestamp(rows):
+                for row in rows:
+                    row[ts_idx] = normalize_timestamp(row[ts_idx])
+                    yield row
+
+            rows = with_timestamp(iter_unique_rows(iter_repaired_rows(counted(reader), header), seen, stats))
+
+            writer = csv.writer(fout, lineterminator='\n')
+            writer.writerow(header)
+            key = SortKey(header, ['timestamp'], numeric=['timestamp'])
+            for row in external_sort(rows, key, chunk_rows=chunk_rows, tmp_dir=tmp_dir):
+                writer.writerow(row)
+                stats['rows_out'] += 1
+        os.replace(tmp_output, output_path)
+    finally:
+        seen.close()
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+    print(f"✅ 文件已修正 + 去重 + 按 timestamp 排序并保存至: {output_path}")
+    print(f"📊 读入 {stats['rows_in']} 行，删除重复 {stats['duplicates']} 行，输出 {stats['rows_out']} 行")
+    return stats
+
+
+if __name__ == '__main__':
+    prepare_ecs()
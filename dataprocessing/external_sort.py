@@ -0,0 +1,184 @@
+"""
+Disk-backed external merge sort for CSV rows.
+
+Rows are buffered into chunks, each chunk is sorted in memory and written to a
+temporary run file, and the runs are combined with a k-way heap merge. The sort
+is stable: rows with equal keys keep their input order. With workers > 1 the
+chunks are sorted and written by a process pool while the next chunk is read.
+
+    python external_sort.py t2_0_masked.csv t2_0_sorted.csv -k instance_id timestamp -n timestamp -j 8
+"""
+import os
+import csv
+import heapq
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+CHUNK_ROWS = 500000
+
+
+class SortKey:
+    """
+    Sort key over named CSV columns. Numeric columns compare as numbers and put
+    unparsable/empty values last (same place pandas puts NaN).
+    """
+
+    def __init__(self, header, columns, numeric=()):
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f"Sort columns not in header: {missing}")
+        self.indices = [header.index(c) for c in columns]
+        self.numeric = [c in numeric for c in columns]
+
+    def __call__(self, row):
+        key = []
+        for idx, is_numeric in zip(self.indices, self.numeric):
+            val = row[idx] if idx < len(row) else ''
+            if is_numeric:
+                key.append(_numeric_key(val))
+            else:
+                key.append(val)
+        return tuple(key)
+
+
+def _numeric_key(val):
+    try:
+        return (0, int(val))
+    except ValueError:
+        pass
+    try:
+        num = float(val)
+    except ValueError:
+        return (1, 0)
+    if num != num:  # NaN
+        return (1, 0)
+    return (0, num)
+
+
+def _write_run(rows, run_dir, run_id, encoding):
+    run_path = os.path.join(run_dir, f"run_{run_id:05d}.csv")
+    with open(run_path, 'w', encoding=encoding, newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(rows)
+    return run_path
+
+
+def _sort_and_write_run(rows, key, run_dir, run_id, encoding):
+    rows.sort(key=key)
+    return _write_run(rows, run_dir, run_id, encoding)
+
+
+def _read_run(run_path, encoding):
+    with open(run_path, 'r', encoding=encoding, newline='') as f:
+        yield from csv.reader(f)
+
+
+def _iter_chunks(rows, chunk_rows):
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= chunk_rows:
+            yield buffer
+            buffer = []
+    if buffer:
+        yield buffer
+
+
+def _generate_runs(chunks, key, run_dir, encoding, workers):
+    if workers <= 1:
+        return [_sort_and_write_run(chunk, key, run_dir, i, encoding) for i, chunk in enumerate(chunks)]
+
+    run_paths = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for i, chunk in enumerate(chunks):
+            # Bound the number of chunks held in memory at once
+            if len(in_flight) >= workers * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+            future = pool.submit(_sort_and_write_run, chunk, key, run_dir, i, encoding)
+            run_paths[future] = i
+            in_flight.add(future)
+    # Runs must be merged in input order for the merge to stay stable
+    return [future.result() for future, _ in sorted(run_paths.items(), key=lambda item: item[1])]
+
+
+def external_sort(rows, key, chunk_rows=CHUNK_ROWS, tmp_dir=None, encoding='utf-8', workers=1):
+    """
+    Yield `rows` (lists of strings) sorted by `key` using at most about
+    `chunk_rows` * (2 * workers + 1) rows of memory plus one buffered row per
+    run during the merge. `key` must be picklable when workers > 1.
+    """
+    chunks = _iter_chunks(rows, chunk_rows)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None:
+        # Everything fit in one chunk, no need to touch the disk
+        first.sort(key=key)
+        yield from first
+        return
+
+    run_dir = tempfile.mkdtemp(prefix='extsort_', dir=tmp_dir)
+    try:
+        def all_chunks():
+            yield first
+            yield second
+            yield from chunks
+
+        run_paths = _generate_runs(all_chunks(), key, run_dir, encoding, workers)
+        # heapq.merge breaks ties by run order, which keeps the sort stable
+        runs = [_read_run(p, encoding) for p in run_paths]
+        yield from heapq.merge(*runs, key=key)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def sort_csv(input_path, output_path, columns, numeric=(), chunk_rows=CHUNK_ROWS, workers=1,
+             tmp_dir=None, encoding='utf-8'):
+    """
+    Sort a CSV file with a header row by `columns`. `output_path` may equal
+    `input_path`. Returns the number of data rows written.
+    """
+    tmp_output = output_path + '.sorting'
+    count = 0
+    try:
+        with open(input_path, 'r', encoding=encoding, newline='') as fin, \
+             open(tmp_output, 'w', encoding=encoding, newline='') as fout:
+            reader = csv.reader(fin)
+            header = next(reader, None)
+            if header is None:
+                return 0
+            key = SortKey(header, columns, numeric)
+            writer = csv.writer(fout, lineterminator='\n')
+            writer.writerow(header)
+            for row in external_sort(reader, key, chunk_rows=chunk_rows, tmp_dir=tmp_dir,
+                                     encoding=encoding, workers=workers):
+                writer.writerow(row)
+                count += 1
+        os.replace(tmp_output, output_path)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    return count
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="External merge sort for large CSV files.")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('-k', '--key', nargs='+', required=True, help="Sort columns, most significant first.")
+    parser.add_argument('-n', '--numeric', nargs='*', default=[], help="Key columns compared as numbers.")
+    parser.add_argument('-c', '--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    parser.add_argument('--tmp-dir', default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    n = sort_csv(args.input, args.output, args.key, args.numeric, args.chunk_rows, args.workers, args.tmp_dir)
+    print(f"Sorted {n} rows by {args.key} into {args.output} in {time.time() - start:.2f}s")
@@ -0,0 +1,202 @@
+"""
+Fault-window features from the per-instance CSVs written by align_multiple.
+
+Each file holds one block per fault, separated by an empty row: GPU rows with
+status -1 (before the fault) and 1 (after it) around the ECS fault row
+(status 0). A block is split per device_name into a series, and all series of
+a file are packed into one padded [series, time, metric] array so every
+statistic is a single NumPy reduction over all blocks at once.
+
+Per metric and side (pre/post): mean, std, min, max, slope (per timestamp
+unit, least squares) and last, the value nearest the fault. `delta` is the
+jump across the fault (first post value - last pre value). Per series:
+n_pre/n_post and pre_time_to_fault/post_time_from_fault, the gap between the
+fault and its nearest GPU row.
+
+    python fault_features.py ./aligned_outputs_chunked fault_features.csv
+"""
+import os
+import warnings
+
+import instrument
+from csv_io import glob_csv
+
+# Numeric columns that are identifiers or labels rather than metrics
+NON_METRIC_COLUMNS = {'status', 'timestamp', 'date', 'diag_id', 'gpu_id', 'target'}
+SIDES = (('pre', -1), ('post', 1))
+STATS = ('mean', 'std', 'min', 'max', 'slope', 'last')
+FLOAT_FORMAT = '%.6g'
+
+
+def read_blocks(path):
+    """Aligned CSV -> (frame of GPU rows with block/fault_ts columns, metric columns)."""
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(path, low_memory=False)
+    separator = df.isna().all(axis=1).to_numpy()
+    df['block'] = np.cumsum(separator)
+    df = df[~separator]
+
+    faults = df[df['status'] == 0]
+    fault_ts = faults.groupby('block')['timestamp'].first().rename('fault_ts')
+    instance = faults.groupby('block')['instance_id'].first().rename('fault_instance_id')
+    gpu = df[df['status'] != 0].join(fault_ts, on='block').join(instance, on='block')
+    gpu = gpu[gpu['fault_ts'].notna()]
+
+    metrics = [c for c in gpu.columns
+               if c not in NON_METRIC_COLUMNS and c not in ('block', 'fault_ts')
+               and pd.api.types.is_numeric_dtype(gpu[c])]
+    return gpu, metrics
+
+
+def pack_series(gpu, metrics):
+    """
+    Pack GPU rows into padded arrays, one series per (block, device_name):
+    values [S, T, M], ts [S, T] and side [S, T] (-1/1, 0 for padding).
+    """
+    import numpy as np
+
+    device = gpu['device_name'].fillna('') if 'device_name' in gpu.columns else ''
+    gpu = gpu.assign(_device=device).sort_values(['block', '_device', 'timestamp'], kind='stable')
+    keys = gpu[['block', '_device']]
+    series_id = keys.ne(keys.shift()).any(axis=1).cumsum().to_numpy() - 1
+    n_series = int(series_id[-1]) + 1 if len(series_id) else 0
+    position = gpu.groupby(series_id).cumcount().to_numpy()
+    width = int(position.max()) + 1 if len(position) else 0
+
+    values = np.full((n_series, width, len(metrics)), np.nan)
+    ts = np.full((n_series, width), np.nan)
+    side = np.zeros((n_series, width), dtype=np.int8)
+    values[series_id, position] = gpu[metrics].to_numpy(dtype='float64', na_value=np.nan)
+    ts[series_id, position] = gpu['timestamp'].to_numpy(dtype='float64')
+    side[series_id, position] = gpu['status'].to_numpy(dtype='int8')
+
+    first = np.r_[True, series_id[1:] != series_id[:-1]] if len(series_id) else np.zeros(0, bool)
+    index = gpu.loc[first, ['fault_instance_id', 'fault_ts', '_device']].rename(
+        columns={'fault_instance_id': 'instance_id', '_device': 'device_name'}).reset_index(drop=True)
+    return index, values, ts, side
+
+
+def _edge_value(arr, valid, last):
+    """Value at the last (or first) valid position along axis 1, NaN if none."""
+    import numpy as np
+
+    if arr.shape[1] == 0:
+        return np.full((arr.shape[0],) + arr.shape[2:], np.nan)
+    if last:
+        idx = arr.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    else:
+        idx = np.argmax(valid, axis=1)
+    picked = np.take_along_axis(arr, np.expand_dims(idx, 1), axis=1).squeeze(1)
+    return np.where(valid.any(axis=1), picked, np.nan)
+
+
+def side_stats(values, ts, mask, nearest_last):
+    """
+    Statistics over the positions in `mask` [S, T] for every series and metric
+    at once. `nearest_last` says whether the fault follows the window (pre)
+    or precedes it (post). Returns {stat: [S, M]}.
+    """
+    import numpy as np
+
+    v = np.where(mask[:, :, None], values, np.nan)
+    valid = ~np.isnan(v)
+    t = np.broadcast_to(np.where(mask, ts, np.nan)[:, :, None], v.shape)
+    t = np.where(valid, t, np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN slices -> NaN
+        out = {
+            'mean': np.nanmean(v, axis=1),
+            'std': np.nanstd(v, axis=1),
+            'min': np.nanmin(v, axis=1),
+            'max': np.nanmax(v, axis=1),
+        }
+        t_centered = t - np.nanmean(t, axis=1, keepdims=True)
+        v_centered = v - out['mean'][:, None, :]
+        sxx = np.nansum(t_centered ** 2, axis=1)
+        sxy = np.nansum(t_centered * v_centered, axis=1)
+        out['slope'] = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1), np.nan)
+    out['last'] = _edge_value(v, valid, last=nearest_last)
+    return out
+
+
+def window_features(index, values, ts, side, metrics):
+    """Feature table (one row per series) from packed arrays."""
+    import numpy as np
+    import pandas as pd
+
+    fault_ts = index['fault_ts'].to_numpy(dtype='float64')
+    columns = {}
+    nearest = {}
+    for name, status in SIDES:
+        mask = side == status
+        # The value nearest the fault is the last one before it / the first one after it
+        stats = side_stats(values, ts, mask, nearest_last=(name == 'pre'))
+        nearest[name] = stats['last']
+        for stat in STATS:
+            for j, metric in enumerate(metrics):
+                columns[f"{metric}__{name}_{stat}"] = stats[stat][:, j]
+
+        columns[f"n_{name}"] = mask.sum(axis=1)
+        edge_ts = _edge_value(ts, mask, last=(name == 'pre'))
+        gap = fault_ts - edge_ts if name == 'pre' else edge_ts - fault_ts
+        columns['pre_time_to_fault' if name == 'pre' else 'post_time_from_fault'] = gap
+
+    delta = nearest['post'] - nearest['pre']
+    for j, metric in enumerate(metrics):
+        columns[f"{metric}__delta"] = delta[:, j]
+
+    features = pd.DataFrame(columns)
+    lead = ['n_pre', 'n_post', 'pre_time_to_fault', 'post_time_from_fault']
+    per_metric = sorted(c for c in features.columns if c not in lead)
+    features = features[lead + per_metric]
+    float_cols = [c for c in features.columns if features[c].dtype == 'float64']
+    features[float_cols] = features[float_cols].astype('float32')
+    return pd.concat([index, features], axis=1)
+
+
+def extract_file(path):
+    gpu, metrics = read_blocks(path)
+    index, values, ts, side = pack_series(gpu, metrics)
+    return window_features(index, values, ts, side, metrics)
+
+
+@instrument.instrumented('features.extract', outputs=('output_path',))
+def extract_features(aligned_dir, output_path):
+    """Extract features for every aligned per-instance CSV into one table."""
+    import pandas as pd
+
+    m = instrument.current()
+    files = glob_csv(os.path.join(aligned_dir, '*.csv'))
+    tables = []
+    for path in files:
+        m.add_input(path)
+        table = extract_file(path)
+        m.rows_in += len(table)
+        if not table.empty:
+            tables.append(table)
+    if not tables:
+        print(f"No fault blocks found in {aligned_dir}")
+        return None
+
+    # Files can have different metric sets; missing metrics stay NaN
+    features = pd.concat(tables, ignore_index=True)
+    # FLOAT_FORMAT is for the features; fault_ts must stay exact to join back to its fault
+    fault_ts = features['fault_ts']
+    features['fault_ts'] = fault_ts.astype('int64') if (fault_ts == fault_ts.round()).all() else fault_ts.map(repr)
+    features.to_csv(output_path, index=False, float_format=FLOAT_FORMAT)
+    m.rows_out += len(features)
+    print(f"Wrote {len(features)} fault windows x {features.shape[1]} columns from {len(files)} files to {output_path}")
+    return features
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-fault pre/post window features from aligned CSVs.")
+    parser.add_argument('aligned_dir', help="Output directory of align_multiple.py")
+    parser.add_argument('output', help="Feature table CSV")
+    args = parser.parse_args()
+    extract_features(args.aligned_dir, args.output)
@@ -0,0 +1,118 @@
+"""
+Overlap-aware storage of the GPU rows matched to fault windows.
+
+Faults of one instance whose windows [ts - W, ts + W] overlap form a cluster.
+A GPU row is stored once per cluster together with the faults it matched,
+instead of once per fault, so flapping hosts with many close faults cost one
+copy of each row. Per-fault views are built only when they are written.
+
+A row piece is [seq, members, row]: `members` is the sorted tuple of fault
+timestamps the row matched, `seq` its arrival order. Consecutive pieces of one
+timestamp with the same members are merged with dict.update, so a fault's
+view (all pieces containing it, merged in order) equals the dict the old
+{fault_ts: {gpu_ts: row}} layout built with the same updates, in the same
+insertion order.
+"""
+from bisect import bisect_left, bisect_right
+
+
+def _is_blank(value):
+    return value is None or value != value or str(value).strip() == ''
+
+
+class InstanceWindows:
+    def __init__(self, faults, window, is_blank=_is_blank):
+        """
+        faults: [(fault_ts, fault_ip, ...), ...] of one instance; window: W in
+        seconds. A fault whose ip is_blank() accepts rows of any ip.
+        """
+        self.window = window
+        entries = sorted((f[0], i, f[1]) for i, f in enumerate(faults))
+        self._fault_ts = [ts for ts, _, _ in entries]
+        # None: any ip matches
+        self._fault_ip = [None if is_blank(ip) else ip for _, _, ip in entries]
+
+        self.clusters = []  # [[fault_ts, ...], ...] sorted unique per cluster
+        self.fault_cluster = {}
+        for ts in self._fault_ts:
+            if ts in self.fault_cluster:
+                continue
+            if self.clusters and ts - self.clusters[-1][-1] <= 2 * window:
+                self.clusters[-1].append(ts)
+            else:
+                self.clusters.append([ts])
+            self.fault_cluster[ts] = len(self.clusters) - 1
+        self.rows = [{} for _ in self.clusters]  # per cluster: gpu_ts -> [[seq, members, row], ...]
+        self.seq = 0
+
+    def time_span(self):
+        """(first, last) fault timestamp."""
+        return self._fault_ts[0], self._fault_ts[-1]
+
+    def match(self, gpu_ts, gpu_ip):
+        """Sorted tuple of the fault timestamps whose window and ip accept this row."""
+        lo = bisect_left(self._fault_ts, gpu_ts - self.window)
+        hi = bisect_right(self._fault_ts, gpu_ts + self.window)
+        members = []
+        for k in range(lo, hi):
+            ts = self._fault_ts[k]
+            if members and members[-1] == ts:
+                continue
+            fault_ip = self._fault_ip[k]
+            if fault_ip is None or fault_ip == gpu_ip:
+                members.append(ts)
+        return tuple(members)
+
+    def add(self, members, gpu_ts, row):
+        """Store `row` (a dict the store may keep) for the faults in `members`."""
+        pieces = self.rows[self.fault_cluster[members[0]]].setdefault(gpu_ts, [])
+        if pieces and pieces[-1][1] == members:
+            pieces[-1][2].update(row)
+        else:
+            pieces.append([self.seq, members, row])
+            self.seq += 1
+
+    def fault_view(self, fault_ts):
+        """{gpu_ts: row} of one fault, in the order its rows first matched."""
+        cluster = self.fault_cluster.get(fault_ts)
+        if cluster is None:
+            return {}
+        items = []
+        for gpu_ts, pieces in self.rows[cluster].items():
+            merged, first = None, None
+            for seq, members, row in pieces:
+                if fault_ts in members:
+                    if merged is None:
+                        merged, first = dict(row), seq
+                    else:
+                        merged.update(row)
+            if merged is not None:
+                items.append((first, gpu_ts, merged))
+        items.sort(key=lambda item: item[0])
+        return {gpu_ts: row for _, gpu_ts, row in items}
+
+    def cluster_view(self, cluster):
+        """{gpu_ts: row} of every row of a cluster, whichever faults it matched."""
+        items = []
+        for gpu_ts, pieces in self.rows[cluster].items():
+            merged = dict(pieces[0][2])
+            for _, _, row in pieces[1:]:
+                merged.update(row)
+            items.append((pieces[0][0], gpu_ts, merged))
+        items.sort(key=lambda item: item[0])
+        return {gpu_ts: row for _, gpu_ts, row in items}
+
+    def stats(self):
+        """(stored row pieces, rows the per-fault layout would hold)."""
+        stored = sum(len(pieces) for rows in self.rows for pieces in rows.values())
+        expanded = 0
+        for rows in self.rows:
+            for pieces in rows.values():
+                expanded += len({ts for _, members, _ in pieces for ts in members})
+        return stored, expanded
+
+
+def build_windows(faults_index, window, is_blank=_is_blank):
+    """{instance_id: InstanceWindows} for a faults_index of {instance_id: [(ts, ip, row), ...]}."""
+    return {instance_id: InstanceWindows(faults, window, is_blank)
+            for instance_id, faults in faults_index.items()}
@@ -1,10 +1,43 @@
 import os
 import re
 import csv
+import json
 
-def check_duplicates():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
-    if not os.path.exists(output_file):
+from pipeline import Stage, run_pipeline
+from schema_registry import learn_schema
+from block_index import load_index, read_block_lines, is_index_file
+from csv_io import open_text
+from csv_engine import open_rows
+from codebook import encode_csv, ENCODE_COLUMNS
+from instrument import instrumented, current, counted, CountingWriter
+
+SOURCE_DIR = '/workspace/lyc/zejun/1.29/the_same_id'
+DATA_DIR = '/workspace/gpu_cluster/data_processing/ecs_get/data'
+
+MERGE_FILE = os.path.join(DATA_DIR, 'merge.csv')
+DEDUP_FILE = os.path.join(DATA_DIR, 'merge_deduplicated.csv')
+DEEMPTY_FILE = os.path.join(DATA_DIR, 'merge_deempty_columns.csv')
+DECONSTANT_FILE = os.path.join(DATA_DIR, 'merge_deconstant_columns.csv')
+DESPARSE_FILE = os.path.join(DATA_DIR, 'merge_desparse.csv')
+
+EMPTY_COLUMNS_REPORT = os.path.join(DATA_DIR, 'empty_columns.csv')
+CONSTANT_COLUMNS_REPORT = os.path.join(DATA_DIR, 'constant_columns_ignore_empty.csv')
+NON_EMPTY_TIMESTAMPS_REPORT = os.path.join(DATA_DIR, 'non_empty_timestamps.csv')
+DESPARSE_SCHEMA = os.path.join(DATA_DIR, 'merge_desparse.schema.json')
+ENCODED_FILE = os.path.join(DATA_DIR, 'merge_encoded.csv')
+CODEBOOK_FILE = os.path.join(DATA_DIR, 'codebook.json')
+
+PIPELINE_CACHE = os.path.join(DATA_DIR, '.pipeline_cache.json')
+
+SPARSE_THRESHOLD = 0.8
+# Columns to keep even if sparse
+SPARSE_WHITELIST = {'description', 'diag_id', 'exception_cnt', 'kernel_version'}
+# Use the <instance>.csv.idx.json block index written by align_multiple to skip short blocks
+USE_BLOCK_INDEX = True
+
+@instrumented('get_data.check_duplicates', inputs=('input_file',))
+def check_duplicates(input_file=MERGE_FILE):
+    if not os.path.exists(input_file):
         return
 
     print("\nChecking for duplicates...")
@@ -13,8 +46,8 @@ def check_duplicates():
     status_idx, inst_idx, ts_idx = -1, -1, -1
 
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             
             for idx, row in enumerate(reader):
                 # Skip empty rows
@@ -61,24 +94,25 @@ def check_duplicates():
             
     except Exception as e:
         print(f"Error during duplicate check: {e}")
+        raise
 
-def check_context_consistency():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
-    if not os.path.exists(output_file):
-        print(f"File not found: {output_file}")
+@instrumented('get_data.check_context_consistency', inputs=('input_file',))
+def check_context_consistency(input_file=MERGE_FILE):
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
         return
 
     print("\nChecking context consistency...")
     
     rows = []
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             for i, row in enumerate(reader):
                 rows.append((i + 1, row)) # Store 1-based index and content
     except Exception as e:
         print(f"Error reading file: {e}")
-        return
+        raise
 
     if not rows:
         print("File is empty.")
@@ -147,9 +181,8 @@ def check_context_consistency():
     if not found_issues:
         print("All status=0 rows passed context check.")
 
-def process_duplicates():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
-    output_file='/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deduplicated.csv'
+@instrumented('get_data.process_duplicates', inputs=('input_file',), outputs=('output_file',))
+def process_duplicates(input_file=MERGE_FILE, output_file=DEDUP_FILE):
     if not os.path.exists(input_file):
         return
 
@@ -157,12 +190,12 @@ def process_duplicates():
     
     rows = []
     try:
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             rows = list(reader)
     except Exception as e:
         print(f"Error reading file: {e}")
-        return
+        raise
 
     # Identify duplicates
     seen = {}
@@ -283,8 +316,8 @@ def process_duplicates():
 
     # Write back
     try:
-        with open(output_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
+        with open_text(output_file, 'w', encoding='utf-8', newline='') as f:
+            writer = CountingWriter(csv.writer(f))
             kept_count = 0
             for i, row in enumerate(rows):
                 if i not in rows_to_delete:
@@ -294,11 +327,49 @@ def process_duplicates():
         
     except Exception as e:
         print(f"Error writing file: {e}")
+        raise
+
+
+def _merge_line_blocks(data_lines, outfile, metrics):
+    """Write every run of 21 consecutive non-empty lines to outfile; returns the number of runs."""
+    blocks_found = 0
+    consecutive_non_empty = 0
+
+    # Check for ALL blocks of 21 consecutive non-empty lines
+    for i, line in enumerate(data_lines):
+        # Check if line is not empty (ignoring whitespace and lines with only commas)
+        if line.strip() and not re.match(r'^[, \t\r\n]*$', line):
+            consecutive_non_empty += 1
+            if consecutive_non_empty >= 21:
+                # We found a block ending at index i
+                # The block is from index (i - 20) to i inclusive
+                start_idx = i - 20
+                end_idx = i + 1 # Slice end is exclusive
+
+                block_lines = data_lines[start_idx:end_idx]
 
+                # Merge content to the output file
+                outfile.writelines(block_lines)
 
-def filter_files():
-    source_dir = '/workspace/lyc/zejun/1.29/the_same_id'
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
+                # Ensure there is a newline between files or blocks if missing
+                if block_lines and not block_lines[-1].endswith('\n'):
+                    outfile.write('\n')
+
+                blocks_found += 1
+                metrics.rows_out += len(block_lines)
+
+                # Reset counter to avoid overlapping blocks?
+                # If "overlapping" blocks (e.g. lines 1-21, 2-22) are NOT desired, reset to 0.
+                # If we want distinct blocks (e.g. lines 1-21, 22-42), reset to 0.
+                # User likely implies distinct groups or just "non-empty" sequences.
+                # Assuming standard distinct blocks logic:
+                consecutive_non_empty = 0
+        else:
+            consecutive_non_empty = 0
+    return blocks_found
+
+@instrumented('get_data.filter_files', outputs=('output_file',))
+def filter_files(source_dir=SOURCE_DIR, output_file=MERGE_FILE, use_index=USE_BLOCK_INDEX):
 
     # Ensure output directory exists
     output_dir = os.path.dirname(output_file)
@@ -315,66 +386,48 @@ def filter_files():
 
     saved_count = 0
     total_files = 0
+    metrics = current()
 
     print(f"Scanning files in {source_dir}...")
 
     # Open the output file in write mode
-    with open(output_file, 'w', encoding='utf-8') as outfile:
+    with open_text(output_file, 'w', encoding='utf-8') as outfile:
         for file in files:
             filepath = os.path.join(source_dir, file)
             
-            # Skip directories
-            if not os.path.isfile(filepath):
+            # Skip directories and block index sidecars
+            if not os.path.isfile(filepath) or is_index_file(file):
                 continue
                 
             total_files += 1
             
             try:
-                with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = f.readlines()
-                
-                # Check if file has enough lines (1 header + 21 data lines)
-                if len(lines) < 22:
-                     print(f"Skipped file (too short): {file}")
-                     continue
+                index = load_index(filepath, rebuild=False) if use_index else None
+                if index is not None:
+                    # Seek straight to the blocks long enough to hold 21 lines
+                    metrics.add_input(filepath)
+                    metrics.rows_in += index['lines']
+                    if index['lines'] < 22:
+                        print(f"Skipped file (too short): {file}")
+                        continue
+                    blocks_found = 0
+                    for block in index['blocks']:
+                        if block['lines'] >= 21:
+                            blocks_found += _merge_line_blocks(read_block_lines(filepath, block), outfile, metrics)
+                else:
+                    with open_text(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+                        lines = f.readlines()
+                    metrics.add_input(filepath)
+                    metrics.rows_in += len(lines)
+
+                    # Check if file has enough lines (1 header + 21 data lines)
+                    if len(lines) < 22:
+                         print(f"Skipped file (too short): {file}")
+                         continue
+
+                    # Ignore header (first line)
+                    blocks_found = _merge_line_blocks(lines[1:], outfile, metrics)
 
-                # Ignore header (first line)
-                data_lines = lines[1:]
-                
-                blocks_found = 0
-                consecutive_non_empty = 0
-                
-                # Check for ALL blocks of 21 consecutive non-empty lines
-                for i, line in enumerate(data_lines):
-                    # Check if line is not empty (ignoring whitespace and lines with only commas)
-                    if line.strip() and not re.match(r'^[, \t\r\n]*$', line):
-                        consecutive_non_empty += 1
-                        if consecutive_non_empty >= 21:
-                            # We found a block ending at index i
-                            # The block is from index (i - 20) to i inclusive
-                            start_idx = i - 20
-                            end_idx = i + 1 # Slice end is exclusive
-                            
-                            block_lines = data_lines[start_idx:end_idx]
-                            
-                            # Merge content to the output file
-                            outfile.writelines(block_lines)
-                            
-                            # Ensure there is a newline between files or blocks if missing
-                            if block_lines and not block_lines[-1].endswith('\n'):
-                                outfile.write('\n')
-                            
-                            blocks_found += 1
-                            
-                            # Reset counter to avoid overlapping blocks? 
-                            # If "overlapping" blocks (e.g. lines 1-21, 2-22) are NOT desired, reset to 0.
-                            # If we want distinct blocks (e.g. lines 1-21, 22-42), reset to 0.
-                            # User likely implies distinct groups or just "non-empty" sequences.
-                            # Assuming standard distinct blocks logic:
-                            consecutive_non_empty = 0 
-                    else:
-                        consecutive_non_empty = 0
-                
                 if blocks_found > 0:
                     saved_count += 1
                 else:
@@ -387,19 +440,18 @@ def filter_files():
     print(f"Total files scanned: {total_files}")
     print(f"Files merged into {output_file}: {saved_count}")
 
-def check_empty_columns():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deduplicated.csv'
-    report_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/empty_columns.csv'
+@instrumented('get_data.check_empty_columns', inputs=('input_file',), outputs=('report_file',))
+def check_empty_columns(input_file=DEDUP_FILE, report_file=EMPTY_COLUMNS_REPORT):
     
-    if not os.path.exists(output_file):
-        print(f"File not found: {output_file}")
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
         return
 
     print("\nChecking for empty columns...")
     
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -435,7 +487,7 @@ def check_empty_columns():
                 
                 # Save to CSV
                 try:
-                    with open(report_file, 'w', encoding='utf-8', newline='') as rf:
+                    with open_text(report_file, 'w', encoding='utf-8', newline='') as rf:
                         writer = csv.writer(rf)
                         writer.writerow(['column_name', 'empty_count'])
                         for col in fully_empty_cols:
@@ -443,6 +495,7 @@ def check_empty_columns():
                     print(f"\nSaved empty columns list to: {report_file}")
                 except Exception as e:
                     print(f"Error saving report: {e}")
+                    raise
             else:
                 print("No completely empty columns found.")
                 
@@ -457,11 +510,10 @@ def check_empty_columns():
 
     except Exception as e:
         print(f"Error checking empty columns: {e}")
+        raise
 
-def delete_empty_columns():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deempty_columns.csv'
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deconstant_columns.csv'
-    empty_cols_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/constant_columns_ignore_empty.csv'
+@instrumented('get_data.delete_empty_columns', inputs=('input_file',), outputs=('output_file',))
+def delete_empty_columns(input_file=DEEMPTY_FILE, output_file=DECONSTANT_FILE, empty_cols_file=CONSTANT_COLUMNS_REPORT):
 
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
@@ -476,7 +528,7 @@ def delete_empty_columns():
     # Read columns to delete
     cols_to_delete = set()
     try:
-        with open(empty_cols_file, 'r', encoding='utf-8') as f:
+        with open_text(empty_cols_file, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             header = next(reader, None) # Skip header
             for row in reader:
@@ -485,14 +537,14 @@ def delete_empty_columns():
         print(f"Loaded {len(cols_to_delete)} columns to delete.")
     except Exception as e:
         print(f"Error reading empty columns file: {e}")
-        return
+        raise
 
     try:
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as fin, \
-             open(output_file, 'w', encoding='utf-8', newline='') as fout:
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source, \
+             open_text(output_file, 'w', encoding='utf-8', newline='') as fout:
             
-            reader = csv.reader(fin)
-            writer = csv.writer(fout)
+            reader = counted(source)
+            writer = CountingWriter(csv.writer(fout))
             
             headers = next(reader, None)
             if not headers:
@@ -527,20 +579,20 @@ def delete_empty_columns():
 
     except Exception as e:
         print(f"Error processing files: {e}")
+        raise
 
-def extract_non_empty_timestamps():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
-    report_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/non_empty_timestamps.csv'
+@instrumented('get_data.extract_non_empty_timestamps', inputs=('input_file',), outputs=('report_file',))
+def extract_non_empty_timestamps(input_file=MERGE_FILE, report_file=NON_EMPTY_TIMESTAMPS_REPORT):
     
-    if not os.path.exists(output_file):
-        print(f"File not found: {output_file}")
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
         return
 
     print("\nExtracting rows with non-empty timestamps...")
     
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -555,8 +607,8 @@ def extract_non_empty_timestamps():
             ts_idx = headers.index('timestamps')
             found_count = 0
             
-            with open(report_file, 'w', encoding='utf-8', newline='') as rf:
-                writer = csv.writer(rf)
+            with open_text(report_file, 'w', encoding='utf-8', newline='') as rf:
+                writer = CountingWriter(csv.writer(rf))
                 writer.writerow(['original_line_number'] + headers)
                 
                 for idx, row in enumerate(reader):
@@ -573,18 +625,19 @@ def extract_non_empty_timestamps():
 
     except Exception as e:
         print(f"Error: {e}")
+        raise
 
-def check_constant_columns():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge.csv'
-    if not os.path.exists(output_file):
-        print(f"File not found: {output_file}")
+@instrumented('get_data.check_constant_columns', inputs=('input_file',))
+def check_constant_columns(input_file=MERGE_FILE):
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
         return
 
     print("\nChecking for constant columns...")
     
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -630,18 +683,19 @@ def check_constant_columns():
 
     except Exception as e:
         print(f"Error checking constant columns: {e}")
+        raise
 
-def check_constant_columns_ignore_empty():
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deempty_columns.csv'
-    if not os.path.exists(output_file):
-        print(f"File not found: {output_file}")
+@instrumented('get_data.check_constant_columns_ignore_empty', inputs=('input_file',), outputs=('report_file',))
+def check_constant_columns_ignore_empty(input_file=DEEMPTY_FILE, report_file=CONSTANT_COLUMNS_REPORT):
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
         return
 
     print("\nChecking for constant columns (ignoring empty values)...")
     
     try:
-        with open(output_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -683,9 +737,8 @@ def check_constant_columns_ignore_empty():
                     print(f"{col} (Value: '{val}')")
                 
                 # Save to CSV
-                report_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/constant_columns_ignore_empty.csv'
                 try:
-                    with open(report_file, 'w', encoding='utf-8', newline='') as rf:
+                    with open_text(report_file, 'w', encoding='utf-8', newline='') as rf:
                         writer = csv.writer(rf)
                         writer.writerow(['column_name', 'constant_value'])
                         for col, val in constant_cols:
@@ -693,14 +746,16 @@ def check_constant_columns_ignore_empty():
                     print(f"\nSaved constant columns list to: {report_file}")
                 except Exception as e:
                     print(f"Error saving report: {e}")
+                    raise
             else:
                 print("No constant columns found.")
 
     except Exception as e:
         print(f"Error checking constant columns: {e}")
+        raise
 
-def check_sparse_columns():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deconstant_columns.csv'
+@instrumented('get_data.check_sparse_columns', inputs=('input_file',))
+def check_sparse_columns(input_file=DECONSTANT_FILE, threshold=SPARSE_THRESHOLD):
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
         return
@@ -708,8 +763,8 @@ def check_sparse_columns():
     print("\nChecking for sparse columns (>= 80% empty)...")
     
     try:
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -736,7 +791,6 @@ def check_sparse_columns():
                 return
 
             print(f"Total rows: {total_rows}")
-            threshold = 0.8
             sparse_cols = []
             
             for col in headers:
@@ -753,25 +807,21 @@ def check_sparse_columns():
 
     except Exception as e:
         print(f"Error checking sparse columns: {e}")
+        raise
 
-def delete_sparse_columns():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_deconstant_columns.csv'
-    output_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_desparse.csv'
+@instrumented('get_data.delete_sparse_columns', inputs=('input_file',), outputs=('output_file',))
+def delete_sparse_columns(input_file=DECONSTANT_FILE, output_file=DESPARSE_FILE, threshold=SPARSE_THRESHOLD, whitelist=SPARSE_WHITELIST):
     
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
         return
 
-    # Columns to keep even if sparse
-    whitelist = {'description', 'diag_id', 'exception_cnt', 'kernel_version'}
-    threshold = 0.8
-
     print(f"\nDeleting sparse columns (>= {threshold*100}% empty), excluding {whitelist}...")
 
     try:
         # First pass: calculate sparsity
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.reader(f)
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -807,11 +857,10 @@ def delete_sparse_columns():
         print(f"Columns to delete: {sorted(list(cols_to_delete))}")
 
         # Second pass: write new file
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as fin, \
-             open(output_file, 'w', encoding='utf-8', newline='') as fout:
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as reader, \
+             open_text(output_file, 'w', encoding='utf-8', newline='') as fout:
             
-            reader = csv.reader(fin)
-            writer = csv.writer(fout)
+            writer = CountingWriter(csv.writer(fout))
             
             # Header
             headers = next(reader)
@@ -840,9 +889,10 @@ def delete_sparse_columns():
 
     except Exception as e:
         print(f"Error deleting sparse columns: {e}")
+        raise
 
-def check_string_columns():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_desparse.csv'
+@instrumented('get_data.check_string_columns', inputs=('input_file',))
+def check_string_columns(input_file=DESPARSE_FILE):
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
         return
@@ -850,10 +900,10 @@ def check_string_columns():
     print("\nChecking for string (non-numeric) columns...")
     
     try:
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
             # Check for large field size
             csv.field_size_limit(10000000)
-            reader = csv.reader(f)
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -903,8 +953,9 @@ def check_string_columns():
 
     except Exception as e:
         print(f"Error checking string columns: {e}")
-def check_numeric_columns():
-    input_file = '/workspace/gpu_cluster/data_processing/ecs_get/data/merge_desparse.csv'
+        raise
+@instrumented('get_data.check_numeric_columns', inputs=('input_file',))
+def check_numeric_columns(input_file=DESPARSE_FILE):
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
         return
@@ -912,10 +963,10 @@ def check_numeric_columns():
     print("\nChecking for non-string (numeric) columns...")
     
     try:
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
+        with open_rows(input_file, encoding='utf-8', errors='ignore') as source:
             # Check for large field size
             csv.field_size_limit(10000000)
-            reader = csv.reader(f)
+            reader = counted(source)
             headers = next(reader, None)
             
             if not headers:
@@ -955,27 +1006,96 @@ def check_numeric_columns():
 
     except Exception as e:
         print(f"Error checking numeric columns: {e}")
+        raise
+@instrumented('get_data.save_column_schema', inputs=('input_file',), outputs=('schema_file',))
+def save_column_schema(input_file=DESPARSE_FILE, schema_file=DESPARSE_SCHEMA):
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
+        return
+
+    print("\nLearning compact column dtypes...")
+    schema = learn_schema(input_file)
+    counts = {}
+    for dtype in schema.values():
+        counts[dtype] = counts.get(dtype, 0) + 1
+    print(f"Typed {len(schema)} columns: {counts}")
+
+    with open_text(schema_file, 'w', encoding='utf-8') as f:
+        json.dump(schema, f, indent=1)
+    print(f"Saved schema to {schema_file}")
+
+@instrumented('get_data.encode_string_columns', inputs=('input_file',), outputs=('output_file', 'codebook_file'))
+def encode_string_columns(input_file=DESPARSE_FILE, output_file=ENCODED_FILE, codebook_file=CODEBOOK_FILE,
+                          columns=ENCODE_COLUMNS):
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
+        return
+
+    print(f"\nEncoding string columns {list(columns)} with code book {codebook_file}...")
+    try:
+        encode_csv(input_file, output_file, codebook_file, columns)
+    except Exception as e:
+        print(f"Error encoding string columns: {e}")
+        raise
+
+def build_pipeline(sparse_threshold=SPARSE_THRESHOLD):
+    """
+    Declare the cleaning stages with the files they read/write.
+    Dependencies follow from the paths: a stage waits for whichever stage writes its inputs.
+    """
+    return [
+        # 合并数据，取连续21行
+        Stage('filter_files', filter_files,
+              inputs={'source_dir': SOURCE_DIR}, outputs={'output_file': MERGE_FILE}),
+        # 检查status为0，且instance_id和timestamp相同的行
+        Stage('check_duplicates', check_duplicates, inputs={'input_file': MERGE_FILE}),
+        Stage('check_context_consistency', check_context_consistency, inputs={'input_file': MERGE_FILE}),
+        # 保留有ip的行，合并description
+        Stage('process_duplicates', process_duplicates,
+              inputs={'input_file': MERGE_FILE}, outputs={'output_file': DEDUP_FILE}),
+        # Verify results
+        Stage('check_duplicates_dedup', check_duplicates, inputs={'input_file': DEDUP_FILE}),
+        # 检查为空，[]，UNKNOWN的列 共计94
+        Stage('check_empty_columns', check_empty_columns,
+              inputs={'input_file': DEDUP_FILE}, outputs={'report_file': EMPTY_COLUMNS_REPORT}),
+        Stage('extract_non_empty_timestamps', extract_non_empty_timestamps,
+              inputs={'input_file': MERGE_FILE}, outputs={'report_file': NON_EMPTY_TIMESTAMPS_REPORT}),
+        Stage('check_constant_columns', check_constant_columns, inputs={'input_file': MERGE_FILE}),
+        # 查看constant的列，忽略空值 共计36
+        Stage('check_constant_columns_ignore_empty', check_constant_columns_ignore_empty,
+              inputs={'input_file': DEEMPTY_FILE}, outputs={'report_file': CONSTANT_COLUMNS_REPORT}),
+        # 先删除空列，再删除constant的列
+        Stage('delete_empty_columns', delete_empty_columns,
+              inputs={'input_file': DEEMPTY_FILE, 'empty_cols_file': CONSTANT_COLUMNS_REPORT},
+              outputs={'output_file': DECONSTANT_FILE}),
+        # 查看80%为空的列
+        Stage('check_sparse_columns', check_sparse_columns,
+              inputs={'input_file': DECONSTANT_FILE}, params={'threshold': sparse_threshold}),
+        # 删除80%为空的列，保留白名单内的列
+        Stage('delete_sparse_columns', delete_sparse_columns,
+              inputs={'input_file': DECONSTANT_FILE}, outputs={'output_file': DESPARSE_FILE},
+              params={'threshold': sparse_threshold, 'whitelist': SPARSE_WHITELIST}),
+        # 查看字符串列
+        Stage('check_string_columns', check_string_columns, inputs={'input_file': DESPARSE_FILE}),
+        Stage('check_numeric_columns', check_numeric_columns, inputs={'input_file': DESPARSE_FILE}),
+        # 为训练读取保存紧凑类型（float32/小整数/category）
+        Stage('save_column_schema', save_column_schema,
+              inputs={'input_file': DESPARSE_FILE}, outputs={'schema_file': DESPARSE_SCHEMA}),
+        # 字符串列编码为整数（codebook.json 可追加，decode 按需还原）
+        Stage('encode_string_columns', encode_string_columns,
+              inputs={'input_file': DESPARSE_FILE},
+              outputs={'output_file': ENCODED_FILE, 'codebook_file': CODEBOOK_FILE},
+              params={'columns': ENCODE_COLUMNS}),
+    ]
+
 if __name__ == "__main__":
-    # 合并数据，取连续21行
-    # filter_files()
-    # 检查status为0，且instance_id和timestamp相同的行
-    # check_duplicates()
-    # 保留有ip的行，合并description
-    # process_duplicates()
-    # check_duplicates() # Verify results
-    # 检查为空，[]，UNKNOWN的列 共计94
-    # check_empty_columns()
-    # 先删除空列，再删除constant的列
-    # delete_empty_columns()
-    # extract_non_empty_timestamps()
-    # 查看constant的列，忽略空值 共计36
-    # check_constant_columns_ignore_empty()
-    # 查看80%为空的列
-    # check_sparse_columns()
-    # delete_sparse_columns()
-    check_numeric_columns()
-    # check_sparse_columns()
-    # 删除80%为空的列，保留白名单内的列
-    # delete_sparse_columns()
-    # 查看字符串列
-    check_string_columns()    
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the merge.csv cleaning pipeline, skipping up-to-date stages.")
+    parser.add_argument('--sparse-threshold', type=float, default=SPARSE_THRESHOLD)
+    parser.add_argument('--force', nargs='*', default=[], help="Stage names to rerun even if cached.")
+    parser.add_argument('--workers', type=int, default=None, help="Max stages running at once.")
+    args = parser.parse_args()
+
+    run_pipeline(build_pipeline(args.sparse_threshold), PIPELINE_CACHE,
+                 workers=args.workers, force=args.force)
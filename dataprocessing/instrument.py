@@ -0,0 +1,185 @@
+"""
+Per-stage metrics for the processing scripts.
+
+Each stage records wall time, rows in/out, bytes read/written and peak RSS, and
+when GPUCLUSTER_METRICS_LOG names a file is appended to it as one JSON line, so
+runs can be compared and graphed:
+
+    with instrument.stage('align.process_gpu_file', file=name) as m:
+        m.add_input(path)
+        m.rows_in += len(chunk)
+
+or, for a whole function, `@instrumented('get_data.check_duplicates', inputs=('input_file',))`
+and `instrument.current()` inside it. Stages nest; each record names its parent.
+Logging is off unless GPUCLUSTER_METRICS_LOG is set.
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_LOG = os.environ.get('GPUCLUSTER_METRICS_LOG', '')
+RUN_ID = os.environ.get('GPUCLUSTER_RUN_ID') or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    """High-water mark of this process' resident memory."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageMetrics:
+    def __init__(self, name, parent=None, **tags):
+        self.name = name
+        self.parent = parent
+        self.tags = tags
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.extra = {}
+        self._start = None
+        self._peak_start = None
+
+    def add_input(self, path):
+        if path and os.path.isfile(path):
+            self.bytes_in += os.path.getsize(path)
+
+    def add_output(self, path):
+        if path and os.path.isfile(path):
+            self.bytes_out += os.path.getsize(path)
+
+    def record(self):
+        peak = peak_rss_mb()
+        rec = {
+            'run_id': RUN_ID,
+            'time': round(self._start, 3),
+            'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else '',
+            'pid': os.getpid(),
+            'stage': self.name,
+            'parent': self.parent,
+            'wall_s': round(time.time() - self._start, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'peak_rss_mb': round(peak, 1) if peak is not None else None,
+            # How much this stage raised the process high-water mark
+            'peak_rss_growth_mb': round(peak - self._peak_start, 1) if peak is not None else None,
+        }
+        rec.update(self.tags)
+        rec.update(self.extra)
+        return rec
+
+
+class _NullMetrics(StageMetrics):
+    """Returned by current() outside any stage; counts are discarded."""
+
+    def __init__(self):
+        super().__init__('<none>')
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    stack = _stack()
+    return stack[-1] if stack else _NullMetrics()
+
+
+def emit(rec):
+    if not METRICS_LOG:
+        return
+    line = json.dumps(rec, default=str, ensure_ascii=False)
+    with _write_lock:
+        with open(METRICS_LOG, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+@contextmanager
+def stage(name, **tags):
+    stack = _stack()
+    m = StageMetrics(name, parent=stack[-1].name if stack else None, **tags)
+    m._start = time.time()
+    m._peak_start = peak_rss_mb()
+    stack.append(m)
+    failed = False
+    try:
+        yield m
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        stack.pop()
+        rec = m.record()
+        if failed:
+            rec['failed'] = True
+        emit(rec)
+
+
+def instrumented(name, inputs=(), outputs=()):
+    """
+    Decorator form of stage(). `inputs`/`outputs` name the function's path
+    arguments whose file sizes count as bytes read/written.
+    """
+    def decorator(func):
+        sig = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            with stage(name) as m:
+                for arg in inputs:
+                    m.add_input(bound.arguments.get(arg))
+                result = func(*args, **kwargs)
+                for arg in outputs:
+                    m.add_output(bound.arguments.get(arg))
+                return result
+        return wrapper
+    return decorator
+
+
+def counted(rows, metrics=None):
+    """Pass rows through, adding them to the current stage's rows_in."""
+    m = metrics or current()
+    for row in rows:
+        m.rows_in += 1
+        yield row
+
+
+class CountingWriter:
+    """csv.writer wrapper adding written rows to the current stage's rows_out."""
+
+    def __init__(self, writer, metrics=None):
+        self._writer = writer
+        self._metrics = metrics or current()
+
+    def writerow(self, row):
+        self._metrics.rows_out += 1
+        return self._writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
@@ -0,0 +1,207 @@
+"""
+Binary column export of parsed metrics for zero-copy loading.
+
+An export is a directory with one raw little-endian array file per column and
+a header.json describing them:
+
+    header.json          {"version", "source", "rows", "columns": {name: dtype},
+                          "keys": {field: [values]}, "blocks": [...]}
+    Time.bin             float64 sample times
+    url.bin, gpu_id.bin  uint32 codes into header["keys"][field] (the host/GPU index)
+    target.bin           int8 label, -1 where a sample has none (only once a block has labels)
+    <metric>.bin         one typed array per metric, NaN where a sample lacks it
+
+Readers np.memmap the files, nothing is parsed. New blocks (e.g. from follow-mode
+ingestion) are appended to the column files and the header is replaced
+atomically afterwards, so a reader never sees rows the header doesn't describe.
+
+    MetricWriter('dcgm_export', 'dcgm').append(rows)   # once per parsed block
+    export_csv('dcgm_metrics_with_label.csv', 'dcgm_export', 'dcgm')   # labelled transfer_* CSV
+    data = load_export('dcgm_export')       # {column: np.memmap}
+"""
+import os
+import json
+
+from stream_detector import SOURCE_KEYS, NON_METRIC_FIELDS
+
+FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+TIME_FIELD = 'Time'
+CODE_DTYPE = '<u4'
+# The label is in NON_METRIC_FIELDS, so it is exported as its own column
+LABEL_FIELD = 'target'
+LABEL_DTYPE = '<i1'
+MISSING_LABEL = -1
+
+
+def _column_path(out_dir, name):
+    # Metric names are Prometheus identifiers, safe as file names
+    return os.path.join(out_dir, f"{name}.bin")
+
+
+def read_header(out_dir):
+    with open(os.path.join(out_dir, HEADER_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class MetricWriter:
+    def __init__(self, out_dir, source, dtype='<f8'):
+        """
+        Open (or create) an export for `source` rows. `dtype` is used for new
+        metric columns, e.g. '<f4' to halve the size when float32 precision is enough.
+        """
+        if source not in SOURCE_KEYS:
+            raise ValueError(f"Unknown source {source!r}, expected one of {sorted(SOURCE_KEYS)}")
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        if os.path.exists(os.path.join(out_dir, HEADER_FILE)):
+            self.header = read_header(out_dir)
+            if self.header['source'] != source:
+                raise ValueError(f"{out_dir} holds {self.header['source']} data, not {source}")
+        else:
+            self.header = {
+                'version': FORMAT_VERSION,
+                'source': source,
+                'rows': 0,
+                'columns': {TIME_FIELD: '<f8', **{k: CODE_DTYPE for k in SOURCE_KEYS[source]}},
+                'keys': {k: [] for k in SOURCE_KEYS[source]},
+                'blocks': [],
+            }
+            self._write_header()
+        self.dtype = dtype
+        self._codes = {k: {v: i for i, v in enumerate(values)} for k, values in self.header['keys'].items()}
+
+    def append(self, rows):
+        """Append parser rows (dicts) as one block. Returns the number of rows written."""
+        import numpy as np
+
+        rows = [r for r in rows if _to_float(r.get(TIME_FIELD)) is not None]
+        if not rows:
+            return 0
+        header = self.header
+        n, start = len(rows), header['rows']
+        self._truncate_to_header()
+
+        metrics = sorted({k for r in rows for k in r
+                          if k not in NON_METRIC_FIELDS and k != TIME_FIELD})
+        for metric in metrics:
+            if metric not in header['columns']:
+                # Earlier blocks didn't have this metric
+                header['columns'][metric] = self.dtype
+                np.full(start, np.nan, dtype=self.dtype).tofile(_column_path(self.out_dir, metric))
+        if LABEL_FIELD not in header['columns'] and any(_to_float(r.get(LABEL_FIELD)) is not None for r in rows):
+            header['columns'][LABEL_FIELD] = LABEL_DTYPE
+            np.full(start, MISSING_LABEL, dtype=LABEL_DTYPE).tofile(_column_path(self.out_dir, LABEL_FIELD))
+
+        arrays = {TIME_FIELD: np.array([float(r[TIME_FIELD]) for r in rows], dtype='<f8')}
+        for field in SOURCE_KEYS[header['source']]:
+            codes = self._codes[field]
+            values = header['keys'][field]
+            col = np.empty(n, dtype=CODE_DTYPE)
+            for i, r in enumerate(rows):
+                value = str(r.get(field, ''))
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+                col[i] = code
+            arrays[field] = col
+        if LABEL_FIELD in header['columns']:
+            arrays[LABEL_FIELD] = np.array([_to_float(r.get(LABEL_FIELD), MISSING_LABEL) for r in rows],
+                                           dtype=LABEL_DTYPE)
+        for name, dtype in header['columns'].items():
+            if name not in arrays:
+                arrays[name] = np.array([_to_float(r.get(name), np.nan) for r in rows], dtype=dtype)
+
+        for name, arr in arrays.items():
+            with open(_column_path(self.out_dir, name), 'ab') as f:
+                arr.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+        times = arrays[TIME_FIELD]
+        header['blocks'].append({'start': start, 'rows': n,
+                                 'time_min': float(times.min()), 'time_max': float(times.max())})
+        header['rows'] = start + n
+        self._write_header()
+        return n
+
+    def _truncate_to_header(self):
+        # Drop bytes from an append that died before its header was written
+        for name, dtype in self.header['columns'].items():
+            path = _column_path(self.out_dir, name)
+            size = self.header['rows'] * _itemsize(dtype)
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            elif os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    def _write_header(self):
+        tmp_path = os.path.join(self.out_dir, HEADER_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.header, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.out_dir, HEADER_FILE))
+
+
+def _itemsize(dtype):
+    import numpy as np
+    return np.dtype(dtype).itemsize
+
+
+def _to_float(raw, default=None):
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return default
+    return value
+
+
+def export_rows(rows, out_dir, source, dtype='<f8'):
+    """Append parser output to the export in `out_dir` (created if missing)."""
+    n = MetricWriter(out_dir, source, dtype).append(rows)
+    print(f"💾 已导出 {n} 行二进制列数据至: {out_dir}")
+    return n
+
+
+def export_csv(path, out_dir, source, dtype='<f8'):
+    """Append a transfer_* CSV, labels included, to the export in `out_dir`."""
+    from csv_engine import open_dicts
+
+    with open_dicts(path) as reader:
+        return export_rows(reader, out_dir, source, dtype)
+
+
+def load_export(out_dir, columns=None):
+    """
+    Memory-map the export: {column: read-only array of header['rows'] items}.
+    Key columns hold codes; decode them with header['keys'][field].
+    """
+    import numpy as np
+
+    header = read_header(out_dir)
+    rows = header['rows']
+    data = {}
+    for name, dtype in header['columns'].items():
+        if columns is not None and name not in columns and name != TIME_FIELD:
+            continue
+        if rows == 0:
+            data[name] = np.empty(0, dtype=dtype)
+        else:
+            data[name] = np.memmap(_column_path(out_dir, name), dtype=dtype, mode='r', shape=(rows,))
+    return data
+
+
+def series_mask(out_dir, **key_values):
+    """Boolean row mask for e.g. series_mask(path, url='192.168.122.102', gpu_id='0')."""
+    import numpy as np
+
+    header = read_header(out_dir)
+    data = load_export(out_dir, columns=list(key_values))
+    mask = np.ones(header['rows'], dtype=bool)
+    for field, value in key_values.items():
+        values = header['keys'][field]
+        if value not in values:
+            return np.zeros(header['rows'], dtype=bool)
+        mask &= data[field] == values.index(value)
+    return mask
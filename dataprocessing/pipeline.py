@@ -0,0 +1,259 @@
+"""
+Small content-addressed stage runner for the cleaning scripts.
+
+A Stage declares the files it reads (inputs), the files it writes (outputs) and
+its parameters. Its cache key hashes the source of the stage's module and of the
+local modules it imports (so editing a helper such as schema_registry reruns the
+stage), an optional version string, the parameters and the contents of every
+input. A stage is skipped when the key matches the last successful run and its
+recorded outputs are still on disk unchanged. A stage that raises is reported
+as failed and its cache entry dropped. Stages that don't depend on each other
+run concurrently.
+"""
+import os
+import json
+import time
+import hashlib
+import inspect
+import types
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class Stage:
+    def __init__(self, name, func, inputs=None, outputs=None, params=None, version=None):
+        # inputs/outputs map the function's keyword argument to a path;
+        # bump version to force a rerun for changes the source hash can't see
+        self.name = name
+        self.func = func
+        self.inputs = dict(inputs or {})
+        self.outputs = dict(outputs or {})
+        self.params = dict(params or {})
+        self.version = version
+
+    def kwargs(self):
+        return {**self.inputs, **self.outputs, **self.params}
+
+
+class FileHasher:
+    """
+    sha256 of file/directory contents, memoized on (size, mtime) so unchanged
+    multi-GB inputs are only read once across runs.
+    """
+
+    def __init__(self, memo):
+        self.memo = memo
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        cached = self.memo.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        self.memo[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def digest(self, path):
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        h = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if os.path.isfile(full):
+                h.update(name.encode('utf-8'))
+                h.update(self.file_digest(full).encode('ascii'))
+        return h.hexdigest()
+
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return str(obj)
+
+
+def _module_file(obj):
+    module = obj if isinstance(obj, types.ModuleType) else inspect.getmodule(obj)
+    path = getattr(module, '__file__', None)
+    return os.path.abspath(path) if path and path.endswith('.py') else None
+
+
+def code_digest(func):
+    """
+    sha256 of the source files of func's module and of every module it uses
+    from the same directory tree, one level deep (helpers like
+    _merge_line_blocks, learn_schema, encode_csv).
+    """
+    func = inspect.unwrap(func)
+    own = _module_file(func)
+    if own is None:
+        return hashlib.sha256(func.__qualname__.encode('utf-8')).hexdigest()
+    root = os.path.dirname(own) + os.sep
+    files = {own}
+    for value in func.__globals__.values():
+        if isinstance(value, types.ModuleType) or callable(value):
+            path = _module_file(value)
+            if path and path.startswith(root):
+                files.add(path)
+    h = hashlib.sha256(func.__qualname__.encode('utf-8'))
+    for path in sorted(files):
+        h.update(os.path.relpath(path, root).encode('utf-8'))
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def stage_key(stage, hasher):
+    payload = {
+        'code': code_digest(stage.func),
+        'version': stage.version,
+        'params': stage.params,
+        'outputs': stage.outputs,
+        'inputs': {k: [p, hasher.digest(p)] for k, p in sorted(stage.inputs.items())},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=_json_default)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _is_fresh(entry, key, hasher):
+    if not entry or entry.get('key') != key:
+        return False
+    for path, digest in entry.get('outputs', {}).items():
+        # Report stages only write their file when there is something to report
+        current = hasher.digest(path) if os.path.exists(path) else None
+        if current != digest:
+            return False
+    return True
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path, cache):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def _run_stage(func, kwargs):
+    start = time.time()
+    func(**kwargs)
+    return time.time() - start
+
+
+def _dependencies(stages):
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs.values():
+            producers[os.path.abspath(path)] = stage.name
+    deps = {}
+    for stage in stages:
+        deps[stage.name] = {
+            producers[os.path.abspath(p)] for p in stage.inputs.values()
+            if os.path.abspath(p) in producers and producers[os.path.abspath(p)] != stage.name
+        }
+    return deps
+
+
+def run_pipeline(stages, cache_path, workers=None, force=()):
+    """
+    Run stages in dependency order, skipping cached ones.
+    Returns {stage name: (status, wall seconds)}.
+    """
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique.")
+
+    cache = _load_cache(cache_path)
+    stage_cache = cache.setdefault('stages', {})
+    hasher = FileHasher(cache.setdefault('files', {}))
+    deps = _dependencies(stages)
+    force = set(force)
+
+    pending = {s.name: s for s in stages}
+    done, failed = set(), set()
+    results = {}
+    pipeline_start = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name in list(pending):
+                    stage = pending[name]
+                    if deps[name] & failed:
+                        print(f"[blocked] {name}: upstream stage failed")
+                        del pending[name]
+                        failed.add(name)
+                        results[name] = ('blocked', 0.0)
+                        progressed = True
+                        continue
+                    if not deps[name] <= done:
+                        continue
+                    del pending[name]
+                    progressed = True
+
+                    missing = [p for p in stage.inputs.values() if not os.path.exists(p)]
+                    if missing:
+                        print(f"[missing] {name}: input not found {missing}")
+                        failed.add(name)
+                        results[name] = ('missing input', 0.0)
+                        continue
+
+                    key = stage_key(stage, hasher)
+                    if name not in force and _is_fresh(stage_cache.get(name), key, hasher):
+                        print(f"[cached] {name}")
+                        done.add(name)
+                        results[name] = ('cached', 0.0)
+                        continue
+
+                    print(f"[run] {name}")
+                    running[pool.submit(_run_stage, stage.func, stage.kwargs())] = (stage, key)
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, key = running.pop(future)
+                try:
+                    wall = future.result()
+                except Exception as e:
+                    print(f"[failed] {stage.name}: {e}")
+                    # Outputs may be half written; never treat them as fresh
+                    stage_cache.pop(stage.name, None)
+                    failed.add(stage.name)
+                    results[stage.name] = ('failed', 0.0)
+                    continue
+
+                stage_cache[stage.name] = {
+                    'key': key,
+                    'outputs': {p: hasher.digest(p) if os.path.exists(p) else None
+                                for p in stage.outputs.values()},
+                    'wall_seconds': round(wall, 3),
+                }
+                done.add(stage.name)
+                results[stage.name] = ('ran', wall)
+
+    _save_cache(cache_path, cache)
+
+    print("\nStage timings:")
+    for name in names:
+        status, wall = results.get(name, ('not run', 0.0))
+        print(f"  {name:<40} {status:<14} {wall:8.2f}s")
+    print(f"  {'total':<40} {'':<14} {time.time() - pipeline_start:8.2f}s")
+    return results
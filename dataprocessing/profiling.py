@@ -0,0 +1,160 @@
+"""
+Opt-in hot-path profiling for the alignment loop.
+
+Modes:
+  None        disabled, every hook is a cheap no-op
+  'phases'    exclusive wall time per phase (read / rename / filter / match / merge) per file
+  'cprofile'  phases plus a deterministic cProfile of the file's chunk work,
+              reported as the top functions by own time
+
+With track_allocations=True, tracemalloc also reports the peak traced memory
+and the top allocating lines per file. Reports are printed after each file and
+optionally saved (.prof / .txt) to report_dir.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_MODES = (None, 'phases', 'cprofile')
+
+
+class HotPathProfiler:
+    def __init__(self, mode=None, track_allocations=False, top_n=15, report_dir=None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+        self.mode = mode
+        self.enabled = mode is not None
+        self.track_allocations = track_allocations and self.enabled
+        self.top_n = top_n
+        self.report_dir = report_dir
+        self.file_name = None
+        self.phase_totals = {}
+        self.file_reports = []
+        self._stack = []  # [phase, start, child_seconds]
+        self._profile = None
+        self._file_start = None
+
+    # --- per file ---
+    def begin_file(self, name):
+        if not self.enabled:
+            return
+        self.file_name = name
+        self.phase_totals = {}
+        self._file_start = time.perf_counter()
+        if self.track_allocations:
+            tracemalloc.start()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def end_file(self):
+        if not self.enabled or self.file_name is None:
+            return
+        if self._profile is not None:
+            self._profile.disable()
+        wall = time.perf_counter() - self._file_start
+        if self.track_allocations:
+            # Snapshot before building the report so its own allocations don't show up
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        lines = [f"[profile] {self.file_name}: {wall:.2f}s"]
+        for phase, seconds in sorted(self.phase_totals.items(), key=lambda kv: -kv[1]):
+            share = seconds / wall * 100 if wall else 0.0
+            lines.append(f"    {phase:<8} {seconds:9.3f}s {share:5.1f}%")
+
+        if self._profile is not None:
+            buf = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=buf)
+            stats.sort_stats('tottime').print_stats(self.top_n)
+            lines.append(self._compact_pstats(buf.getvalue()))
+            if self.report_dir:
+                os.makedirs(self.report_dir, exist_ok=True)
+                stats.dump_stats(os.path.join(self.report_dir, f"{self.file_name}.prof"))
+            self._profile = None
+
+        if self.track_allocations:
+            lines.append(f"    traced peak {peak / (1024 * 1024):.1f} MB; top allocations:")
+            for stat in snapshot.statistics('lineno')[:self.top_n]:
+                frame = stat.traceback[0]
+                lines.append(f"      {stat.size / (1024 * 1024):8.2f} MB {stat.count:9d} blocks "
+                             f"{os.path.basename(frame.filename)}:{frame.lineno}")
+
+        report = '\n'.join(lines)
+        print(report)
+        if self.report_dir:
+            os.makedirs(self.report_dir, exist_ok=True)
+            with open(os.path.join(self.report_dir, f"{self.file_name}.txt"), 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+        self.file_reports.append((self.file_name, wall, dict(self.phase_totals)))
+        self.file_name = None
+
+    def _compact_pstats(self, text):
+        # Keep the column header and the function rows, drop pstats' preamble
+        out = []
+        in_table = False
+        for line in text.splitlines():
+            if line.strip().startswith('ncalls'):
+                in_table = True
+            if in_table and line.strip():
+                out.append('    ' + line.rstrip())
+        return '\n'.join(out)
+
+    # --- phases ---
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._stack.append([name, time.perf_counter(), 0.0])
+        try:
+            yield
+        finally:
+            phase, start, child = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            self._record(phase, elapsed - child, elapsed)
+
+    def add(self, name, seconds):
+        """Record time measured by the caller (for hot per-row code)."""
+        if self.enabled:
+            self._record(name, seconds, seconds)
+
+    def _record(self, name, exclusive, elapsed):
+        self.phase_totals[name] = self.phase_totals.get(name, 0.0) + exclusive
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def timed_iter(self, iterable, name='read'):
+        """Charge the time spent producing each item (e.g. parsing a chunk) to `name`."""
+        if not self.enabled:
+            yield from iterable
+            return
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def summary(self):
+        if not self.enabled or not self.file_reports:
+            return
+        total = sum(wall for _, wall, _ in self.file_reports)
+        phases = {}
+        for _, _, totals in self.file_reports:
+            for phase, seconds in totals.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+        print(f"\n[profile] all files: {total:.2f}s")
+        for phase, seconds in sorted(phases.items(), key=lambda kv: -kv[1]):
+            print(f"    {phase:<8} {seconds:9.3f}s {seconds / total * 100 if total else 0.0:5.1f}%")
+        slowest = sorted(self.file_reports, key=lambda r: -r[1])[:5]
+        print("    slowest files: " + ', '.join(f"{name} ({wall:.1f}s)" for name, wall, _ in slowest))
@@ -0,0 +1,240 @@
+"""
+Compact dtype registry for the t2/t3, DCGM and merged metric CSVs.
+
+pd.read_csv(low_memory=False) gives float64/object for every metric column and
+plain Python strings for IDs that repeat millions of times. The registry maps
+known column patterns to compact dtypes (small ints, categoricals for
+instance_id/ip/device_name) and learns the remaining columns from a sample scan
+with the csv module. float32 is only chosen when every sampled value survives
+the float64 -> float32 round trip exactly; anything else stays float64. Learned
+schemas are cached on disk keyed by the header, so all files sharing a header
+(e.g. every t2_*_masked.csv) are scanned once.
+
+The sample can't vouch for rows after it, so readers whose values are written
+back out or compared against thresholds pass floats=False and keep float64.
+
+pandas is only imported by the readers, so get_data can learn schemas without it.
+"""
+import os
+import re
+import csv
+import json
+import struct
+import hashlib
+
+from csv_io import open_text
+from csv_engine import read_csv_chunks
+
+SCHEMA_CACHE_DIR = os.environ.get(
+    'GPUCLUSTER_SCHEMA_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'gpucluster', 'schemas'))
+SAMPLE_ROWS = 20000
+# Part of the cache key: bump when the learning rules change
+SCHEMA_VERSION = 2
+
+# Columns whose values repeat heavily: stored as categoricals
+CATEGORY_MAX_DISTINCT_RATIO = 0.5
+CATEGORY_MIN_VALUES = 100
+
+EMPTY_VALUES = {'', '[]', 'Unknown', 'nan', 'NaN', 'NA', 'N/A', 'null', 'NULL', 'None'}
+
+# Known columns, matched in order. None means "leave to pandas inference".
+COLUMN_PATTERNS = [
+    (re.compile(r'^(instance_id|ip|IP|url|device_name|type)$'), 'category'),
+    (re.compile(r'^(timestamp|Time|date)$'), None),
+    (re.compile(r'^status$'), 'Int8'),
+    (re.compile(r'^(gpu_id|target)$'), 'Int16'),
+]
+
+INT_RANGES = [
+    ('int8', -2 ** 7, 2 ** 7 - 1),
+    ('int16', -2 ** 15, 2 ** 15 - 1),
+    ('int32', -2 ** 31, 2 ** 31 - 1),
+]
+FLOAT32_EXACT_INT = 2 ** 24
+
+
+def _pattern_dtype(column):
+    for pattern, dtype in COLUMN_PATTERNS:
+        if pattern.match(column):
+            return True, dtype
+    return False, None
+
+
+def _parse_number(val):
+    try:
+        return int(val)
+    except ValueError:
+        return float(val)
+
+
+def _float32_exact(x):
+    return struct.unpack('f', struct.pack('f', x))[0] == x
+
+
+def _learn_column(values, has_empty):
+    """Pick a compact dtype for one column from its non-empty sample values."""
+    if not values:
+        return None
+    numbers = []
+    for v in values:
+        try:
+            numbers.append(_parse_number(v))
+        except ValueError:
+            distinct = len(set(values))
+            if len(values) >= CATEGORY_MIN_VALUES and distinct <= CATEGORY_MAX_DISTINCT_RATIO * len(values):
+                return 'category'
+            return None
+
+    if all(isinstance(n, int) for n in numbers):
+        lo, hi = min(numbers), max(numbers)
+        if has_empty:
+            # NaN forces a float column anyway; float32 holds these ints exactly
+            return 'float32' if max(abs(lo), abs(hi)) <= FLOAT32_EXACT_INT else None
+        for dtype, tmin, tmax in INT_RANGES:
+            if tmin <= lo and hi <= tmax:
+                return dtype
+        return None
+    try:
+        exact = all(_float32_exact(float(n)) for n in numbers)
+    except OverflowError:
+        return None
+    return 'float32' if exact else None
+
+
+def learn_schema(path, sample_rows=SAMPLE_ROWS, encoding='utf-8'):
+    """
+    Scan the first `sample_rows` rows and return {column: dtype} for the
+    columns that can be stored more compactly than pandas would by default.
+    """
+    with open_text(path, 'r', encoding=encoding, errors='ignore', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return {}
+        samples = [[] for _ in header]
+        has_empty = [False] * len(header)
+        for n, row in enumerate(reader):
+            if n >= sample_rows:
+                break
+            for i in range(len(header)):
+                v = row[i].strip() if i < len(row) else ''
+                if v in EMPTY_VALUES:
+                    has_empty[i] = True
+                else:
+                    samples[i].append(v)
+
+    schema = {}
+    for i, col in enumerate(header):
+        known, dtype = _pattern_dtype(col)
+        if not known:
+            dtype = _learn_column(samples[i], has_empty[i])
+        if dtype:
+            schema[col] = dtype
+    return schema
+
+
+def _read_header(path, encoding='utf-8'):
+    with open_text(path, 'r', encoding=encoding, errors='ignore', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def _cache_path(header):
+    key = f"v{SCHEMA_VERSION}\x1e" + '\x1f'.join(header)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SCHEMA_CACHE_DIR, f"{digest}.json")
+
+
+def get_schema(path, refresh=False, sample_rows=SAMPLE_ROWS):
+    """Cached schema for `path`, learned on first use for its header."""
+    header = _read_header(path)
+    cache_path = _cache_path(header)
+    if not refresh and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['schema']
+
+    schema = learn_schema(path, sample_rows)
+    os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.abspath(path), 'header': header, 'schema': schema}, f, indent=1)
+    return schema
+
+
+def forget_schema(path):
+    cache_path = _cache_path(_read_header(path))
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+
+
+def downcast_frame(df, schema):
+    """Apply `schema` to an already-parsed frame, skipping columns that don't convert."""
+    for col, dtype in schema.items():
+        if col in df.columns and str(df[col].dtype) != dtype:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (ValueError, TypeError, OverflowError):
+                pass
+    return df
+
+
+def _categories_only(schema):
+    return {c: t for c, t in schema.items() if t == 'category'}
+
+
+def _without_floats(schema):
+    return {c: t for c, t in schema.items() if not t.startswith('float')}
+
+
+def typed_read_csv(path, schema=None, floats=True, **kwargs):
+    """
+    pd.read_csv with the registry dtypes; falls back to inference if the sample was wrong.
+    floats=False keeps every float column float64.
+    """
+    import pandas as pd
+
+    schema = get_schema(path) if schema is None else schema
+    if not floats:
+        schema = _without_floats(schema)
+    try:
+        return pd.read_csv(path, dtype=schema, **kwargs)
+    except (ValueError, TypeError, OverflowError) as e:
+        print(f"Schema for {os.path.basename(path)} did not fit ({e}); re-reading with inferred dtypes.")
+        forget_schema(path)
+        df = pd.read_csv(path, dtype=_categories_only(schema), **kwargs)
+        return downcast_frame(df, schema)
+
+
+def iter_typed_chunks(path, chunksize, schema=None, floats=True, **kwargs):
+    """
+    Chunked read (csv_engine.read_csv_chunks) with the registry dtypes. If a later chunk doesn't fit
+    the learned schema, reading restarts after the last good chunk with
+    inferred numeric dtypes, so no rows are lost or duplicated.
+    floats=False keeps every float column float64.
+    """
+    import pandas as pd
+
+    schema = get_schema(path) if schema is None else schema
+    if not floats:
+        schema = _without_floats(schema)
+    rows_done = 0
+    reader = read_csv_chunks(path, chunksize, dtype=schema, **kwargs)
+    try:
+        for chunk in reader:
+            rows_done += len(chunk)
+            yield chunk
+        return
+    except (ValueError, TypeError, OverflowError) as e:
+        print(f"Schema for {os.path.basename(path)} did not fit after {rows_done} rows ({e}); "
+              f"continuing with inferred dtypes.")
+        forget_schema(path)
+    finally:
+        reader.close()
+
+    skip = range(1, rows_done + 1) if rows_done else None
+    with pd.read_csv(path, chunksize=chunksize, dtype=_categories_only(schema),
+                     skiprows=skip, **kwargs) as reader:
+        for chunk in reader:
+            yield downcast_frame(chunk, schema)
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
@@ -0,0 +1,198 @@
+"""
+Deterministic instance sharding for align_multiple.py.
+
+A run with shards=N, shard_id=k keeps only the instances with
+crc32(instance_id) % N == k: the ECS fault index is cut down first, and the
+GPU chunk filter and the per-instance outputs follow from it, so N runs (local
+processes or separate machines) write disjoint sets of files. crc32 rather than
+hash(): Python salts str hashes per process.
+
+Each shard writes a manifest (<output_dir>/shards/shard-k-of-N.json) listing
+its instances with their output file, size and row count, the run settings, and
+a digest of the full ECS instance list. merge_manifests() checks that all N
+shards are present, were run on the same ECS input with the same settings, own
+disjoint instances that hash to them and together cover every instance, and
+that the listed files exist with the recorded sizes; with `into` it also
+gathers the files of shards written to different directories.
+
+    python sharding.py out/shard0 out/shard1 --into out/merged
+"""
+import os
+import json
+import time
+import shutil
+import zlib
+import hashlib
+
+MANIFEST_DIR = 'shards'
+MERGED_MANIFEST = 'merged.json'
+
+
+def shard_of(instance_id, shards):
+    return zlib.crc32(str(instance_id).encode('utf-8')) % shards
+
+
+def in_shard(instance_id, shards, shard_id):
+    return shards <= 1 or shard_of(instance_id, shards) == shard_id
+
+
+def check_shard_args(shards, shard_id):
+    if shards < 1 or not 0 <= shard_id < shards:
+        raise ValueError(f"shard_id must be in [0, {shards}), got {shard_id} (shards={shards})")
+
+
+def shard_index(faults_index, shards, shard_id):
+    """The {instance_id: faults} entries owned by this shard."""
+    check_shard_args(shards, shard_id)
+    return {iid: faults for iid, faults in faults_index.items() if in_shard(iid, shards, shard_id)}
+
+
+def instances_digest(instance_ids):
+    h = hashlib.sha256()
+    for iid in sorted(str(i) for i in instance_ids):
+        h.update(iid.encode('utf-8') + b'\n')
+    return h.hexdigest()
+
+
+def manifest_path(output_dir, shards, shard_id):
+    return os.path.join(output_dir, MANIFEST_DIR, f"shard-{shard_id}-of-{shards}.json")
+
+
+def write_manifest(output_dir, shards, shard_id, all_instance_ids, outputs, settings=None):
+    """
+    outputs: [(instance_id, path or None, rows)] for this shard's instances.
+    all_instance_ids: every instance in the ECS index before sharding.
+    """
+    instances = {}
+    for instance_id, path, rows in outputs:
+        instances[str(instance_id)] = {
+            'file': os.path.basename(path) if path else None,
+            'bytes': os.path.getsize(path) if path else 0,
+            'rows': rows,
+        }
+    manifest = {
+        'shards': shards,
+        'shard_id': shard_id,
+        'hash': 'crc32(instance_id) % shards',
+        'settings': settings or {},
+        'ecs_instances': len(all_instance_ids),
+        'ecs_instances_digest': instances_digest(all_instance_ids),
+        'instances': instances,
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    path = manifest_path(output_dir, shards, shard_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def _find_manifests(output_dirs):
+    found = []
+    for d in output_dirs:
+        mdir = os.path.join(d, MANIFEST_DIR)
+        if not os.path.isdir(mdir):
+            continue
+        for name in sorted(os.listdir(mdir)):
+            if name.startswith('shard-') and name.endswith('.json'):
+                with open(os.path.join(mdir, name), encoding='utf-8') as f:
+                    found.append((d, json.load(f)))
+    return found
+
+
+def merge_manifests(output_dirs, into=None, move=False):
+    """
+    Verify the shard manifests found under `output_dirs` and write the combined
+    manifest (to `into`, else to the first directory). Returns (manifest, problems).
+    """
+    problems = []
+    found = _find_manifests(output_dirs)
+    if not found:
+        return None, [f"no shard manifests under {list(output_dirs)}"]
+
+    first = found[0][1]
+    shards = first['shards']
+    by_id = {}
+    for d, m in found:
+        if m['shards'] != shards:
+            problems.append(f"shard {m['shard_id']} in {d} was run with {m['shards']} shards, expected {shards}")
+            continue
+        if m['shard_id'] in by_id:
+            problems.append(f"shard {m['shard_id']} found twice ({by_id[m['shard_id']][0]} and {d})")
+            continue
+        by_id[m['shard_id']] = (d, m)
+        if m['settings'] != first['settings']:
+            problems.append(f"shard {m['shard_id']} settings differ: {m['settings']} vs {first['settings']}")
+        if m['ecs_instances_digest'] != first['ecs_instances_digest']:
+            problems.append(f"shard {m['shard_id']} was run on a different ECS instance list")
+    missing = sorted(set(range(shards)) - set(by_id))
+    if missing:
+        problems.append(f"missing shards: {missing}")
+
+    owner = {}
+    for shard_id, (d, m) in sorted(by_id.items()):
+        for iid, entry in m['instances'].items():
+            if iid in owner:
+                problems.append(f"instance {iid} in shards {owner[iid][0]} and {shard_id}")
+            owner[iid] = (shard_id, d, entry)
+            if shard_of(iid, shards) != shard_id:
+                problems.append(f"instance {iid} hashes to shard {shard_of(iid, shards)}, found in {shard_id}")
+            if entry['file']:
+                path = os.path.join(d, entry['file'])
+                if not os.path.exists(path):
+                    problems.append(f"missing output {path}")
+                elif os.path.getsize(path) != entry['bytes']:
+                    problems.append(f"{path} is {os.path.getsize(path)} bytes, manifest says {entry['bytes']}")
+    if not missing and len(owner) != first['ecs_instances']:
+        problems.append(f"shards cover {len(owner)} instances, the ECS index has {first['ecs_instances']}")
+
+    dest = into or output_dirs[0]
+    if into:
+        os.makedirs(into, exist_ok=True)
+        transfer = shutil.move if move else shutil.copy2
+        for iid, (_, d, entry) in owner.items():
+            if not entry['file'] or os.path.abspath(d) == os.path.abspath(into):
+                continue
+            for name in (entry['file'], entry['file'] + '.idx.json'):
+                src = os.path.join(d, name)
+                if os.path.exists(src):
+                    transfer(src, os.path.join(into, name))
+
+    merged = {
+        'shards': shards,
+        'settings': first['settings'],
+        'ecs_instances': first['ecs_instances'],
+        'ecs_instances_digest': first['ecs_instances_digest'],
+        'instances': {iid: dict(entry, shard=shard_id) for iid, (shard_id, _, entry) in sorted(owner.items())},
+        'ok': not problems,
+        'problems': problems,
+    }
+    path = os.path.join(dest, MANIFEST_DIR, MERGED_MANIFEST)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, ensure_ascii=False, indent=1)
+    return merged, problems
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verify and combine the shard manifests of a sharded alignment run.")
+    parser.add_argument('output_dirs', nargs='+', help="Output directories of the shards (one if they shared it).")
+    parser.add_argument('--into', default=None, help="Gather the shard outputs into this directory.")
+    parser.add_argument('--move', action='store_true', help="Move instead of copy when gathering.")
+    args = parser.parse_args()
+
+    result, issues = merge_manifests(args.output_dirs, into=args.into, move=args.move)
+    if result is not None:
+        files = sum(1 for e in result['instances'].values() if e['file'])
+        rows = sum(e['rows'] for e in result['instances'].values())
+        print(f"{result['shards']} shards, {len(result['instances'])}/{result['ecs_instances']} instances, "
+              f"{files} files, {rows} rows")
+    for issue in issues:
+        print(f"  PROBLEM: {issue}")
+    print("Shards verified." if not issues else f"{len(issues)} problem(s) found.")
+    sys.exit(1 if issues else 0)
@@ -0,0 +1,220 @@
+"""
+Online anomaly detector for the DCGM / network / CPU metric streams.
+
+Instead of fixed per-IP thresholds (GPU_TEMP < 45, NVLINK_RX_BYTES > 1e8, ...),
+every (host, gpu, metric) series keeps O(1) state: an EWMA mean and variance
+and an EWMA absolute deviation. A sample is scored by its robust z-score
+|x - mean| / (sqrt(pi/2) * abs_dev) (or the plain EWMA z-score) and the row's
+score is the largest one over its metrics. The scale is floored at
+`min_relative_scale` of the series level, so a step after a constant stretch
+gives a bounded score instead of ~1e6. Outliers are clipped before they
+update the state, so a long anomaly does not immediately become the new
+normal. The first `warmup` samples of a series only train it (score 0).
+
+Rows come straight from the transfer_* parsers or their CSVs:
+
+    detector = StreamDetector(threshold=4.0)
+    for row in score_rows(parse_metrics_file(path)[0], 'dcgm', detector):
+        ...  # row['anomaly_score'], row['anomaly_metric'], row['target']
+
+or `label_csv(output_file, output_file, 'dcgm')` in place of a target_adjustment_* call.
+"""
+import os
+import csv
+import math
+
+from instrument import instrumented, current
+from csv_io import open_text, compression_of
+
+# Fields that identify a series per source; the rest (minus NON_METRIC_FIELDS) are metrics
+SOURCE_KEYS = {
+    'dcgm': ('url', 'gpu_id'),
+    'network': ('IP',),
+    'cpu': ('ip',),
+}
+NON_METRIC_FIELDS = {'Time', 'target', 'type', 'url', 'gpu_id', 'IP', 'ip',
+                     'anomaly_score', 'anomaly_metric'}
+
+ALPHA = 0.05
+THRESHOLD = 4.0
+WARMUP = 30
+CLIP = 6.0
+MIN_SCALE = 1e-6
+MIN_RELATIVE_SCALE = 0.01
+# Mean absolute deviation -> standard deviation for normal data (1.4826 is for the median absolute deviation)
+MEAN_ABS_DEV_TO_STD = math.sqrt(math.pi / 2)
+
+
+class SeriesState:
+    """EWMA mean / variance / absolute deviation of one metric series."""
+    __slots__ = ('n', 'mean', 'var', 'abs_dev')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.abs_dev = 0.0
+
+
+class StreamDetector:
+    def __init__(self, alpha=ALPHA, threshold=THRESHOLD, warmup=WARMUP, clip=CLIP,
+                 robust=True, metrics=None, min_scale=MIN_SCALE, min_relative_scale=MIN_RELATIVE_SCALE):
+        """
+        alpha: EWMA weight of a new sample; threshold: score above which a row
+        is labelled 1; warmup: samples per series before it is scored; clip:
+        outliers update the state as if they were `clip` scales away; robust:
+        score with the absolute deviation instead of the standard deviation;
+        metrics: only these fields are scored (default: every numeric field);
+        min_scale / min_relative_scale: the scale is at least min_scale and at
+        least min_relative_scale * |mean|.
+        """
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.clip = clip
+        self.robust = robust
+        self.metrics = set(metrics) if metrics else None
+        self.min_scale = min_scale
+        self.min_relative_scale = min_relative_scale
+        self.states = {}
+
+    def _scale(self, state):
+        floor = max(self.min_scale, self.min_relative_scale * abs(state.mean))
+        if self.robust:
+            return max(MEAN_ABS_DEV_TO_STD * state.abs_dev, floor)
+        return max(math.sqrt(state.var), floor)
+
+    def update_value(self, key, value):
+        """Score `value` against series `key`, then fold it into the state."""
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = SeriesState()
+
+        dev = value - state.mean
+        if state.n == 0:
+            state.n = 1
+            state.mean = value
+            return 0.0
+
+        scale = self._scale(state)
+        score = abs(dev) / scale if state.n >= self.warmup else 0.0
+        if state.n >= self.warmup and abs(dev) > self.clip * scale:
+            dev = math.copysign(self.clip * scale, dev)
+
+        # A running average during warm-up converges faster than a small alpha
+        state.n += 1
+        alpha = max(self.alpha, 1.0 / state.n)
+        state.mean += alpha * dev
+        state.var = (1 - alpha) * (state.var + alpha * dev * dev)
+        state.abs_dev += alpha * (abs(dev) - state.abs_dev)
+        return score
+
+    def update(self, series, row):
+        """Score every metric of `row` for `series`; returns (score, metric, label)."""
+        best_score, best_metric = 0.0, ''
+        for field, raw in row.items():
+            if field in NON_METRIC_FIELDS or (self.metrics is not None and field not in self.metrics):
+                continue
+            value = _to_float(raw)
+            if value is None:
+                continue
+            score = self.update_value(series + (field,), value)
+            if score > best_score:
+                best_score, best_metric = score, field
+        return best_score, best_metric, int(best_score > self.threshold)
+
+    def score_view(self, view):
+        """
+        Score a ts_store.SeriesView sample by sample, reading its metric
+        arrays in place. Returns (scores, labels) arrays, one entry per sample.
+        """
+        import numpy as np
+
+        metrics = [m for m in view.metrics if self.metrics is None or m in self.metrics]
+        columns = [view[m].tolist() for m in metrics]
+        keys = [tuple(view.key) + (m,) for m in metrics]
+        scores = np.zeros(len(view))
+        for i in range(len(view)):
+            best = 0.0
+            for key, col in zip(keys, columns):
+                value = col[i]
+                if value == value:
+                    score = self.update_value(key, value)
+                    if score > best:
+                        best = score
+            scores[i] = best
+        return scores, (scores > self.threshold).astype('int8')
+
+
+def _to_float(raw):
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def series_key(row, source):
+    return tuple(str(row.get(k, '')) for k in SOURCE_KEYS[source])
+
+
+def score_rows(rows, source, detector):
+    """
+    Stream rows (parser dicts or csv.DictReader rows), adding anomaly_score,
+    anomaly_metric and the detector's label as target.
+    """
+    if source not in SOURCE_KEYS:
+        raise ValueError(f"Unknown source {source!r}, expected one of {sorted(SOURCE_KEYS)}")
+    for row in rows:
+        score, metric, label = detector.update(series_key(row, source), row)
+        row['anomaly_score'] = round(score, 4)
+        row['anomaly_metric'] = metric
+        row['target'] = label
+        yield row
+
+
+@instrumented('stream_detector.label_csv', inputs=('filepath',), outputs=('output_path',))
+def label_csv(filepath, output_path, source, **detector_params):
+    """
+    Relabel a transfer_* CSV with the streaming detector. Reads and writes one
+    row at a time; `output_path` may equal `filepath`.
+    """
+    detector = StreamDetector(**detector_params)
+    stage_metrics = current()
+    tmp_path = output_path + '.labelling'
+    anomalies = 0
+    with open_text(filepath, 'r', newline='', encoding='utf-8') as fin, \
+         open_text(tmp_path, 'w', newline='', encoding='utf-8', compression=compression_of(output_path)) as fout:
+        reader = csv.DictReader(fin)
+        fieldnames = [f for f in reader.fieldnames if f not in ('anomaly_score', 'anomaly_metric')]
+        fieldnames += ['anomaly_score', 'anomaly_metric']
+        if 'target' not in fieldnames:
+            fieldnames.append('target')
+        writer = csv.DictWriter(fout, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in score_rows(reader, source, detector):
+            stage_metrics.rows_in += 1
+            anomalies += row['target']
+            writer.writerow(row)
+    os.replace(tmp_path, output_path)
+    stage_metrics.rows_out = stage_metrics.rows_in
+    stage_metrics.extra['anomalies'] = anomalies
+    print(f"🔎 在线检测: {stage_metrics.rows_in} 行, {anomalies} 行异常, {len(detector.states)} 条序列")
+    return anomalies
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Label a DCGM/network/CPU CSV with the streaming detector.")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('source', choices=sorted(SOURCE_KEYS))
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--metrics', nargs='*', default=None)
+    parser.add_argument('--ewma', action='store_true', help="Score with the EWMA std instead of the robust scale.")
+    args = parser.parse_args()
+    label_csv(args.input, args.output, args.source, alpha=args.alpha, threshold=args.threshold,
+              warmup=args.warmup, metrics=args.metrics, robust=not args.ewma)
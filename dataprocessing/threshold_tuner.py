@@ -0,0 +1,218 @@
+"""
+Threshold tuning against a labelled capture.
+
+The target_adjustment_* functions label a row 1 when a metric is above (or
+below) a hand-picked per-IP threshold. This loads a labelled CSV once, sorts
+each (IP, metric) series and sweeps every distinct value as a candidate
+threshold in a single pass over the sorted values, so all precision / recall /
+F1 points cost O(n log n) per series instead of one CSV rewrite per guess.
+
+    python threshold_tuner.py network_metrics_labeled.csv network_thresholds.json --metrics rx_packets
+
+The JSON holds, per IP and metric, the best rule ({"direction": "above",
+"threshold": 8000, "f1": ...}); apply_thresholds() labels a CSV with it.
+"""
+import os
+import csv
+import json
+import math
+
+from instrument import instrumented, current
+from csv_io import open_text, compression_of
+
+GROUP_FIELDS = ('IP', 'ip', 'url')
+LABEL_FIELD = 'target'
+NON_METRIC_FIELDS = {'Time', 'target', 'type', 'url', 'gpu_id', 'IP', 'ip',
+                     'anomaly_score', 'anomaly_metric'}
+DIRECTIONS = ('above', 'below')
+
+
+def _to_float(raw):
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+@instrumented('threshold_tuner.load_capture', inputs=('filepath',))
+def load_capture(filepath, metrics=None, group_field=None, label_field=LABEL_FIELD):
+    """
+    Read a labelled CSV into {ip: {metric: [(value, label), ...]}}.
+    Rows without a parsable label or value are skipped for that metric.
+    """
+    stage_metrics = current()
+    series = {}
+    with open_text(filepath, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if group_field is None:
+            group_field = next((g for g in GROUP_FIELDS if g in fields), None)
+        if label_field not in fields:
+            raise ValueError(f"{filepath} has no '{label_field}' column")
+        metric_fields = [m for m in (metrics or fields) if m in fields and m not in NON_METRIC_FIELDS]
+
+        for row in reader:
+            stage_metrics.rows_in += 1
+            label = _to_float(row[label_field])
+            if label is None:
+                continue
+            group = series.setdefault(row[group_field] if group_field else '', {})
+            for metric in metric_fields:
+                value = _to_float(row[metric])
+                if value is not None:
+                    group.setdefault(metric, []).append((value, label > 0))
+    return series
+
+
+def sweep(pairs, direction='above'):
+    """
+    Every candidate rule "label 1 if value > t" ('above') or "value < t"
+    ('below') for `pairs` of (value, label). Returns curve points
+    (threshold, tp, fp, fn, precision, recall, f1), one per distinct value
+    plus the endpoint just past the last one that labels every row 1, from a
+    single sort and a single pass.
+    """
+    total_pos = sum(1 for _, label in pairs if label)
+    # 'below' is 'above' on negated values
+    sign = 1 if direction == 'above' else -1
+    ordered = sorted(((sign * v, label) for v, label in pairs), reverse=True)
+
+    curve = []
+
+    def add_point(value, tp, fp):
+        fn = total_pos - tp
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / total_pos if total_pos else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        curve.append((sign * value, tp, fp, fn, precision, recall, f1))
+
+    tp = fp = 0
+    i, n = 0, len(ordered)
+    while i < n:
+        value = ordered[i][0]
+        # With t = value, everything strictly beyond it (already counted) is labelled 1
+        add_point(value, tp, fp)
+        while i < n and ordered[i][0] == value:
+            if ordered[i][1]:
+                tp += 1
+            else:
+                fp += 1
+            i += 1
+    if n:
+        # Just past the last value: every row is labelled 1
+        add_point(math.nextafter(ordered[-1][0], -math.inf), tp, fp)
+    return curve
+
+
+def best_rule(pairs, directions=DIRECTIONS):
+    """Highest-F1 rule over both directions (ties keep the first one found)."""
+    best, curves = None, {}
+    for direction in directions:
+        curve = sweep(pairs, direction)
+        curves[direction] = curve
+        for threshold, tp, fp, fn, precision, recall, f1 in curve:
+            if best is None or f1 > best['f1']:
+                best = {'direction': direction, 'threshold': threshold, 'precision': round(precision, 4),
+                        'recall': round(recall, 4), 'f1': round(f1, 4), 'tp': tp, 'fp': fp, 'fn': fn}
+    if best is not None:
+        best['support'] = len(pairs)
+    return best, curves
+
+
+@instrumented('threshold_tuner.tune', inputs=('filepath',), outputs=('output_json', 'curves_csv'))
+def tune(filepath, output_json, metrics=None, group_field=None, directions=DIRECTIONS, curves_csv=None):
+    """Best per-IP, per-metric thresholds for a labelled capture, saved as JSON."""
+    series = load_capture(filepath, metrics, group_field)
+    results = {}
+    curve_writer = None
+    curve_file = open_text(curves_csv, 'w', newline='', encoding='utf-8') if curves_csv else None
+    try:
+        if curve_file:
+            curve_writer = csv.writer(curve_file)
+            curve_writer.writerow(['ip', 'metric', 'direction', 'threshold', 'tp', 'fp', 'fn',
+                                   'precision', 'recall', 'f1'])
+        for ip in sorted(series):
+            for metric in sorted(series[ip]):
+                best, curves = best_rule(series[ip][metric], directions)
+                if best is None:
+                    continue
+                results.setdefault(ip, {})[metric] = best
+                if curve_writer:
+                    for direction, curve in curves.items():
+                        for point in curve:
+                            curve_writer.writerow([ip, metric, direction, *point[:4],
+                                                   *(round(x, 4) for x in point[4:])])
+    finally:
+        if curve_file:
+            curve_file.close()
+
+    with open_text(output_json, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    current().rows_out = sum(len(m) for m in results.values())
+
+    for ip, by_metric in results.items():
+        metric, rule = max(by_metric.items(), key=lambda kv: kv[1]['f1'])
+        op = '>' if rule['direction'] == 'above' else '<'
+        print(f"  {ip or '(all)'}: {metric} {op} {rule['threshold']:g}  "
+              f"P={rule['precision']:.3f} R={rule['recall']:.3f} F1={rule['f1']:.3f}")
+    print(f"💾 阈值已保存至: {output_json}")
+    return results
+
+
+def load_thresholds(path):
+    with open_text(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@instrumented('threshold_tuner.apply_thresholds', inputs=('filepath',), outputs=('output_path',))
+def apply_thresholds(filepath, output_path, thresholds, metrics, group_field=None):
+    """
+    Label rows 1 when any of `metrics` passes its tuned per-IP rule. IPs or
+    metrics missing from `thresholds` never fire. `output_path` may equal `filepath`.
+    """
+    if isinstance(thresholds, str):
+        thresholds = load_thresholds(thresholds)
+    stage_metrics = current()
+    tmp_path = output_path + '.labelling'
+    with open_text(filepath, 'r', newline='', encoding='utf-8') as fin, \
+         open_text(tmp_path, 'w', newline='', encoding='utf-8', compression=compression_of(output_path)) as fout:
+        reader = csv.DictReader(fin)
+        if group_field is None:
+            group_field = next((g for g in GROUP_FIELDS if g in reader.fieldnames), None)
+        fieldnames = list(reader.fieldnames)
+        if LABEL_FIELD not in fieldnames:
+            fieldnames.append(LABEL_FIELD)
+        writer = csv.DictWriter(fout, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in reader:
+            rules = thresholds.get(row[group_field] if group_field else '', {})
+            label = 0
+            for metric in metrics:
+                rule = rules.get(metric)
+                value = _to_float(row.get(metric))
+                if rule is None or value is None:
+                    continue
+                if (value > rule['threshold']) if rule['direction'] == 'above' else (value < rule['threshold']):
+                    label = 1
+                    break
+            row[LABEL_FIELD] = label
+            writer.writerow(row)
+            stage_metrics.rows_in += 1
+    os.replace(tmp_path, output_path)
+    stage_metrics.rows_out = stage_metrics.rows_in
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune per-IP metric thresholds against a labelled CSV.")
+    parser.add_argument('input', help="Labelled CSV (with a target column)")
+    parser.add_argument('output', help="Thresholds JSON")
+    parser.add_argument('--metrics', nargs='*', default=None, help="Metrics to tune (default: all numeric).")
+    parser.add_argument('--group-field', default=None, help="Per-host column (default: IP, ip or url).")
+    parser.add_argument('--direction', choices=DIRECTIONS, default=None, help="Only tune this direction.")
+    parser.add_argument('--curves', default=None, help="Also write every P/R/F1 point to this CSV.")
+    args = parser.parse_args()
+    tune(args.input, args.output, args.metrics, args.group_field,
+         (args.direction,) if args.direction else DIRECTIONS, args.curves)
@@ -1,8 +1,15 @@
 import re
 import csv
 
+from instrument import instrumented, current
+from csv_io import open_text
+from csv_engine import open_dicts
+from stream_detector import label_csv
+from metric_export import export_csv
+
+@instrumented('transfer_cpu.parse_cpu_metrics_file', inputs=('filepath',))
 def parse_cpu_metrics_file(filepath):
-    with open(filepath, 'r') as f:
+    with open_text(filepath, 'r') as f:
         content = f.read()
 
     blocks = re.split(r'^# Time:', content, flags=re.MULTILINE)[1:]
@@ -50,22 +57,27 @@ def parse_cpu_metrics_file(filepath):
                     metric_order.append(key)
             all_rows.append(row)
 
+    current().rows_out = len(all_rows)
     return all_rows, metric_order
 
+@instrumented('transfer_cpu.save_cpu_to_csv', outputs=('output_path',))
 def save_cpu_to_csv(rows, metric_names, output_path):
     fieldnames = ['Time', 'ip'] + metric_names + ['target']
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
         writer.writeheader()
         for row in rows:
             filtered_row = {k: row.get(k, '') for k in fieldnames}
             writer.writerow(filtered_row)
+    current().rows_out = len(rows)
 
 
+@instrumented('transfer_cpu.target_adjustment_cpuidle', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_cpuidle(filepath, output_path, threshold02=95, thereshold03=97):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     start_time=None
     duration=20
     for row in records:
@@ -84,20 +96,30 @@ def target_adjustment_cpuidle(filepath, output_path, threshold02=95, thereshold0
             row['target'] = 0
         else:
             row['target'] = 0
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
 # ===== 使用示例 =====
-input_file = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/cpu-1769854457.6318326'
-output_file = '/workspace/gpu_cluster/data_processing/4090/cpu/cpu_metrics_with_label.csv'
+INPUT_FILE = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/cpu-1769854457.6318326'
+OUTPUT_FILE = '/workspace/gpu_cluster/data_processing/4090/cpu/cpu_metrics_with_label.csv'
+
+
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, export_dir=None, detect_threshold=None):
+    rows, metric_names = parse_cpu_metrics_file(input_file)
+    save_cpu_to_csv(rows, metric_names, output_file)
+    target_adjustment_cpuidle(output_file, output_file, threshold02=95, thereshold03=97)
+    if detect_threshold is not None:
+        label_csv(output_file, output_file, 'cpu', threshold=detect_threshold) # 在线检测，替代上面的固定阈值
+    if export_dir:
+        export_csv(output_file, export_dir, 'cpu') # 二进制列导出（含 target 标签），训练时 np.memmap 直接加载
+
+    print(f"✅ 已解析 {len(rows)} 行 CPU 数据")
+    print(f"📊 涉及指标: {metric_names}")
+    print(f"💾 保存至: {output_file}")
 
-rows, metric_names = parse_cpu_metrics_file(input_file)
-save_cpu_to_csv(rows, metric_names, output_file)
-target_adjustment_cpuidle(output_file, output_file, threshold02=95, thereshold03=97)
 
-print(f"✅ 已解析 {len(rows)} 行 CPU 数据")
-print(f"📊 涉及指标: {metric_names}")
-print(f"💾 保存至: {output_file}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,16 @@
 import re
 import csv
+
+from instrument import instrumented, current
+from csv_io import open_text
+from csv_engine import open_dicts
+from stream_detector import label_csv
+from metric_export import export_csv
 from collections import defaultdict
 
+@instrumented('transfer_dcgm.parse_metrics_file', inputs=('filepath',))
 def parse_metrics_file(filepath):
-    with open(filepath, 'r') as f:
+    with open_text(filepath, 'r') as f:
         content = f.read()
 
     # 按 #Time: 分割多个采集块
@@ -74,21 +81,27 @@ def parse_metrics_file(filepath):
                 row = {'Time': timestamp, 'gpu_id': gpu_id, 'url': url_ip_port, **metrics, 'target': target}
                 all_rows.append(row)
 
+    current().rows_out = len(all_rows)
     return all_rows, sorted(all_metric_names)
 
+@instrumented('transfer_dcgm.save_to_csv', outputs=('output_path',))
 def save_to_csv(rows, metric_names, output_path):
     fieldnames = ['Time', 'gpu_id', 'url'] + metric_names + ['target']
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
         writer.writeheader()
         for row in rows:
             filtered_row = {k: row.get(k, '') for k in fieldnames}
             writer.writerow(filtered_row)
+    current().rows_out = len(rows)
 
+@instrumented('transfer_dcgm.swap_gpuid_url_and_replace_ip', inputs=('input_csv',), outputs=('output_csv',))
 def swap_gpuid_url_and_replace_ip(input_csv, output_csv):
-    with open(input_csv, 'r', encoding='utf-8') as f:
+    with open_text(input_csv, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
         rows = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(rows)
         fieldnames = reader.fieldnames
 
     # 交换 gpu_id 和 url 列的位置
@@ -114,46 +127,52 @@ def swap_gpuid_url_and_replace_ip(input_csv, output_csv):
             ip_match = re.match(r'([\d\.]+)', url)
             row['url'] = ip_match.group(1) if ip_match else url
 
-    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_csv, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         for row in rows:
             writer.writerow(row)
 
+@instrumented('transfer_dcgm.target_adjustment_nvlink_sm', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_nvlink_sm(filepath, output_path, threshold_nv=0.50+1e8, threshold_sm=0.45):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     for row in records:
         if float(row['DCGM_FI_PROF_NVLINK_RX_BYTES']) > threshold_nv or float(row['DCGM_FI_PROF_SM_ACTIVE']) > threshold_sm:
             row['target'] = 1
         else:
             row['target'] = 0
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
+@instrumented('transfer_dcgm.target_adjustment_nvlinkbandwidth', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_nvlinkbandwidth(filepath, output_path, threshold=50):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     for row in records:
         if float(row['DCGM_FI_DEV_NVLINK_BANDWIDTH_TOTAL']) > threshold:
             row['target'] = 1
         else:
             row['target'] = 0
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
+@instrumented('transfer_dcgm.target_adjustment_gpu_temp', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_gpu_temp(filepath, output_path, threshold02=45, threshold03=40):    
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     start_time=None
     duration=80
     for row in records:
@@ -172,23 +191,33 @@ def target_adjustment_gpu_temp(filepath, output_path, threshold02=45, threshold0
             row['target'] = 1
         else:
             row['target'] = 0
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
 # ===== 使用示例 =====
-input_file = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/dcgm-1769854457.6318326'  # 替换为你的真实文件路径
-output_file = '/workspace/gpu_cluster/data_processing/4090/cpu/dcgm_metrics_with_label.csv'
-
-rows, metric_names = parse_metrics_file(input_file)
-save_to_csv(rows, metric_names, output_file)
-swap_gpuid_url_and_replace_ip(output_file, output_file)
-# target_adjustment_gpu_temp(output_file, output_file, threshold02=45, threshold03=40)
-# target_adjustment_nvlink_sm(output_file, output_file, threshold_nv=0.50+1e8, threshold_sm=0.45) # for burst
-# target_adjustment_nvlinkbandwidth(output_file, output_file, threshold=50) # for oom
-
-print(f"✅ 已解析 {len(rows)} 行 GPU 数据")
-print(f"📊 涉及指标: {metric_names}")
-print(f"💾 保存至: {output_file}")
\ No newline at end of file
+INPUT_FILE = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/dcgm-1769854457.6318326'  # 替换为你的真实文件路径
+OUTPUT_FILE = '/workspace/gpu_cluster/data_processing/4090/cpu/dcgm_metrics_with_label.csv'
+
+
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, export_dir=None, detect_threshold=None):
+    rows, metric_names = parse_metrics_file(input_file)
+    save_to_csv(rows, metric_names, output_file)
+    swap_gpuid_url_and_replace_ip(output_file, output_file)
+    # target_adjustment_gpu_temp(output_file, output_file, threshold02=45, threshold03=40)
+    # target_adjustment_nvlink_sm(output_file, output_file, threshold_nv=0.50+1e8, threshold_sm=0.45) # for burst
+    # target_adjustment_nvlinkbandwidth(output_file, output_file, threshold=50) # for oom
+    if detect_threshold is not None:
+        label_csv(output_file, output_file, 'dcgm', threshold=detect_threshold) # 在线检测，替代上面的固定阈值
+    if export_dir:
+        export_csv(output_file, export_dir, 'dcgm') # 二进制列导出（含 target 标签），训练时 np.memmap 直接加载
+
+    print(f"✅ 已解析 {len(rows)} 行 GPU 数据")
+    print(f"📊 涉及指标: {metric_names}")
+    print(f"💾 保存至: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
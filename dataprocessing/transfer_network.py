@@ -1,8 +1,15 @@
 import re
 import csv
 
+from instrument import instrumented, current
+from csv_io import open_text
+from csv_engine import open_dicts
+from stream_detector import label_csv
+from metric_export import export_csv
+
+@instrumented('transfer_network.parse_network_file', inputs=('filepath',))
 def parse_network_file(filepath):
-    with open(filepath, 'r') as f:
+    with open_text(filepath, 'r') as f:
         lines = f.readlines()
 
     records = []
@@ -48,8 +55,10 @@ def parse_network_file(filepath):
                     i += 1
         else:
             i += 1
+    current().rows_out = len(records)
     return records
 
+@instrumented('transfer_network.save_to_csv', outputs=('output_path',))
 def save_to_csv(records, output_path):
     if not records:
         raise ValueError("未解析到任何有效数据！")
@@ -65,13 +74,14 @@ def save_to_csv(records, output_path):
     fieldnames += sorted(metric_keys)  # 或按出现顺序
     fieldnames.append('target')
 
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
         writer.writeheader()
         for row in records:
             # 补全缺失字段（理论上不会缺）
             full_row = {k: row.get(k, '') for k in fieldnames}
             writer.writerow(full_row)
+    current().rows_out = len(records)
 
 def parse_normal_intervals(config_str):
     intervals = []
@@ -98,10 +108,12 @@ config_data = "2:600,200:10,1:300,100:15,1:450,150:10,2:600"
 normal_duration = parse_normal_intervals(config_data)
 
 # 调整 CSV 文件中的 target 列, normal_duration为正常区间列表，将正常区间内的 target 设为 0，异常区间的target设为1
+@instrumented('transfer_network.target_adjustment_duration', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_duration(filepath, output_path, normal_duration):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     first_timestamp = None
     for row in records:
         timestamp = float(row['Time'])
@@ -111,16 +123,18 @@ def target_adjustment_duration(filepath, output_path, normal_duration):
         is_normal = any(start <= (timestamp-first_timestamp) < end for start, end in normal_duration)
         row['target'] = 0 if is_normal else 1
     # 保存调整后的文件
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
+@instrumented('transfer_network.target_adjustment_rxpackets', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_rxpackets(filepath, output_path, threshold_h,threshold_l):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     pri_02 = 0
     pri_03 = 0
     for row in records:
@@ -157,40 +171,52 @@ def target_adjustment_rxpackets(filepath, output_path, threshold_h,threshold_l):
                 else:
                     row['target'] = 0
     # 保存调整后的文件
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
+@instrumented('transfer_network.target_adjustment_txbytes', inputs=('filepath',), outputs=('output_path',))
 def target_adjustment_txbytes(filepath, output_path, threshold=50000):
-    with open(filepath, 'r') as f:
-        reader = csv.DictReader(f)
+    with open_dicts(filepath) as reader:
         records = list(reader)
+        stage_metrics = current()
+        stage_metrics.rows_in = stage_metrics.rows_out = len(records)
     for row in records:
         if int(row['tx_bytes']) > threshold:
             row['target'] = 1
         else:
             row['target'] = 0
     # 保存调整后的文件
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open_text(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = records[0].keys()
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
 
 # ===== 使用示例 =====
-input_file = "/workspace/lyc/abnormal_data/network-error/collapse_caused_by_speed/network-1765122029.9178896"      # 替换为你的实际文件名
-output_file = "/workspace/gpu_cluster/data_processing/4090/network/network_metrics_labeled.csv"
-
-records = parse_network_file(input_file)
-save_to_csv(records, output_file)
-# target_adjustment_rxpackets(output_file, output_file, threshold=300) # for burst
-# target_adjustment_txbytes(output_file, output_file, threshold=50000) # for oom
-target_adjustment_rxpackets(output_file, output_file, threshold_h=300000, threshold_l=8000) # for 4090 oom
-print(f"✅ 成功解析 {len(records)} 个时间点")
-print(f"💾 已保存带标签的 CSV 文件：{output_file}")
-
-# 可选：打印前几行验证
-for r in records[:2]:
-    print(r)
\ No newline at end of file
+INPUT_FILE = "/workspace/lyc/abnormal_data/network-error/collapse_caused_by_speed/network-1765122029.9178896"      # 替换为你的实际文件名
+OUTPUT_FILE = "/workspace/gpu_cluster/data_processing/4090/network/network_metrics_labeled.csv"
+
+
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, export_dir=None, detect_threshold=None):
+    records = parse_network_file(input_file)
+    save_to_csv(records, output_file)
+    # target_adjustment_rxpackets(output_file, output_file, threshold=300) # for burst
+    # target_adjustment_txbytes(output_file, output_file, threshold=50000) # for oom
+    target_adjustment_rxpackets(output_file, output_file, threshold_h=300000, threshold_l=8000) # for 4090 oom
+    if detect_threshold is not None:
+        label_csv(output_file, output_file, 'network', threshold=detect_threshold) # 在线检测，替代上面的固定阈值
+    if export_dir:
+        export_csv(output_file, export_dir, 'network') # 二进制列导出（含 target 标签），训练时 np.memmap 直接加载
+    print(f"✅ 成功解析 {len(records)} 个时间点")
+    print(f"💾 已保存带标签的 CSV 文件：{output_file}")
+
+    # 可选：打印前几行验证
+    for r in records[:2]:
+        print(r)
+
+
+if __name__ == '__main__':
+    main()
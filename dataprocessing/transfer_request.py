@@ -1,17 +1,33 @@
-import pandas as pd
 import os
 
-input_path = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/request feature-1769854461.csv'
-output_path = '/workspace/gpu_cluster/data_processing/4090/cpu/request_metrics_label.csv'
+from schema_registry import typed_read_csv
+from csv_io import pandas_compression
+from instrument import instrumented, current
 
-# 读取数据
-df = pd.read_csv(input_path)
+INPUT_PATH = '/workspace/gpu_cluster/lyc/abnormal_data/cpu/fullload/3/request feature-1769854461.csv'
+OUTPUT_PATH = '/workspace/gpu_cluster/data_processing/4090/cpu/request_metrics_label.csv'
 
-# 新增target列，ttft>50为1，否则为0
-# df['target'] = (df['ttft'] > 50).astype(int) # for burst
-df['target'] = (df['ttft'] > 0.5).astype(int)
 
-# 保存到新文件
-os.makedirs(os.path.dirname(output_path), exist_ok=True)
-df.to_csv(output_path, index=False)
-print(f"Labeled data saved to {output_path}")
\ No newline at end of file
+@instrumented('transfer_request.label_ttft', inputs=('input_path',), outputs=('output_path',))
+def label_ttft(input_path, output_path, threshold=0.5):
+    # 读取数据
+    df = typed_read_csv(input_path, floats=False)
+    current().rows_in = len(df)
+
+    # 新增target列，ttft>threshold为1，否则为0（burst 场景用 threshold=50）
+    df['target'] = (df['ttft'] > threshold).astype(int)
+
+    # 保存到新文件
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    df.to_csv(output_path, index=False, compression=pandas_compression(output_path))
+    current().rows_out = len(df)
+    return df
+
+
+def main(input_path=INPUT_PATH, output_path=OUTPUT_PATH):
+    label_ttft(input_path, output_path)
+    print(f"Labeled data saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
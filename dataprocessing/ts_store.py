@@ -0,0 +1,200 @@
+"""
+Compact in-memory store for parsed cluster metrics.
+
+A list of csv.DictReader rows costs a dict plus a string per value. The store
+keeps, per series ((url, gpu_id) for DCGM, IP for network, ip for CPU), one
+sorted float64 timestamp array and one typed array per metric (NaN where a
+sample lacks the metric). time_range() finds a window with two binary searches
+and returns a SeriesView whose arrays are slices of the stored ones, so several
+windows over a series (StreamDetector.score_view, ad-hoc window queries) share
+its memory. The transfer_* labelers don't use it: they rewrite each CSV row in
+place, keeping its text and order, which float arrays sorted per series don't.
+
+    store = TimeSeriesStore.from_csv('dcgm_metrics_with_label.csv', 'dcgm')
+    view = store.time_range(('192.168.122.102', '0'), t0, t0 + 300)
+    hot = view.mask('DCGM_FI_DEV_GPU_TEMP', 80, 'above')
+"""
+import csv
+from array import array
+
+from csv_io import open_text
+from stream_detector import SOURCE_KEYS, NON_METRIC_FIELDS
+
+TIME_FIELD = 'Time'
+
+
+class SeriesView:
+    """Time-ordered window of one series. Arrays are views, not copies."""
+
+    def __init__(self, key, times, columns):
+        self.key = key
+        self.times = times
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, metric):
+        return self.columns[metric]
+
+    @property
+    def metrics(self):
+        return list(self.columns)
+
+    def slice(self, start, stop):
+        return SeriesView(self.key, self.times[start:stop],
+                          {m: col[start:stop] for m, col in self.columns.items()})
+
+    def matrix(self, metrics=None):
+        """[T, M] float64 array of the chosen metrics (a copy)."""
+        import numpy as np
+
+        metrics = metrics or self.metrics
+        return np.column_stack([self.columns[m].astype('float64', copy=False) for m in metrics]) \
+            if metrics else np.empty((len(self), 0))
+
+    def mask(self, metric, threshold, direction='above'):
+        """Boolean array: the metric is above / below `threshold` (NaN never is)."""
+        col = self.columns[metric]
+        return col > threshold if direction == 'above' else col < threshold
+
+    def rows(self):
+        """Dict rows, for code written against the parsers' output."""
+        names = self.metrics
+        cols = [self.columns[m] for m in names]
+        for i, t in enumerate(self.times):
+            row = {TIME_FIELD: float(t)}
+            for name, col in zip(names, cols):
+                row[name] = float(col[i])
+            yield row
+
+
+class TimeSeriesStore:
+    def __init__(self, source, dtype='float64'):
+        if source not in SOURCE_KEYS:
+            raise ValueError(f"Unknown source {source!r}, expected one of {sorted(SOURCE_KEYS)}")
+        self.source = source
+        self.dtype = dtype
+        self.series = {}  # key -> (times, {metric: array})
+        self._building = {}  # key -> [times array('d'), {metric: array('d')}]
+
+    # --- building ---
+    def append(self, key, time, values):
+        """Add one sample; `values` maps metric -> float (missing metrics become NaN)."""
+        entry = self._building.get(key)
+        if entry is None:
+            entry = self._building[key] = [array('d'), {}]
+        times, cols = entry
+        n = len(times)
+        times.append(time)
+        for metric, value in values.items():
+            col = cols.get(metric)
+            if col is None:
+                col = cols[metric] = array('d', [float('nan')]) * n
+            col.append(value)
+        for metric, col in cols.items():
+            if len(col) == n:
+                col.append(float('nan'))
+
+    def freeze(self):
+        """Convert the build buffers to sorted NumPy arrays. Called by the from_* constructors."""
+        import numpy as np
+
+        for key, (times, cols) in self._building.items():
+            t = np.frombuffer(times, dtype='float64').copy()
+            order = None
+            if len(t) > 1 and np.any(t[1:] < t[:-1]):
+                order = np.argsort(t, kind='stable')
+                t = t[order]
+            arrays = {}
+            for metric, col in cols.items():
+                a = np.frombuffer(col, dtype='float64')
+                a = a[order] if order is not None else a
+                arrays[metric] = a.astype(self.dtype)
+            self.series[key] = (t, arrays)
+        self._building = {}
+        return self
+
+    @classmethod
+    def from_rows(cls, rows, source, dtype='float64'):
+        """Build from parser output (lists of dicts with Time, key fields and metrics)."""
+        store = cls(source, dtype)
+        fields = SOURCE_KEYS[source]
+        for row in rows:
+            time = _to_float(row.get(TIME_FIELD))
+            if time is None:
+                continue
+            values = {}
+            for name, raw in row.items():
+                if name not in NON_METRIC_FIELDS and name != TIME_FIELD:
+                    value = _to_float(raw)
+                    if value is not None:
+                        values[name] = value
+            store.append(tuple(str(row.get(f, '')) for f in fields), time, values)
+        return store.freeze()
+
+    @classmethod
+    def from_csv(cls, path, source, dtype='float64', metrics=None):
+        """Build from a transfer_* CSV (plain or compressed) without materialising its rows."""
+        store = cls(source, dtype)
+        with open_text(path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            time_idx = header.index(TIME_FIELD)
+            key_idx = [header.index(k) for k in SOURCE_KEYS[source] if k in header]
+            metric_idx = [(i, name) for i, name in enumerate(header)
+                          if name not in NON_METRIC_FIELDS and name != TIME_FIELD
+                          and (metrics is None or name in metrics)]
+            for row in reader:
+                time = _to_float(row[time_idx]) if time_idx < len(row) else None
+                if time is None:
+                    continue
+                values = {}
+                for i, name in metric_idx:
+                    value = _to_float(row[i]) if i < len(row) else None
+                    if value is not None:
+                        values[name] = value
+                store.append(tuple(row[i] for i in key_idx), time, values)
+        return store.freeze()
+
+    # --- queries ---
+    def keys(self):
+        return list(self.series)
+
+    def view(self, key):
+        times, cols = self.series[key]
+        return SeriesView(key, times, cols)
+
+    def time_range(self, key, start=None, end=None):
+        """Samples with start <= Time < end, located by binary search."""
+        import numpy as np
+
+        times, cols = self.series[key]
+        i = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        j = len(times) if end is None else int(np.searchsorted(times, end, side='left'))
+        return SeriesView(key, times[i:j], {m: col[i:j] for m, col in cols.items()})
+
+    def window(self, key, center, before, after):
+        """(pre, post) views: [center - before, center) and [center, center + after]."""
+        pre = self.time_range(key, center - before, center)
+        post = self.time_range(key, center, _next_up(center + after))
+        return pre, post
+
+    def nbytes(self):
+        return sum(t.nbytes + sum(c.nbytes for c in cols.values()) for t, cols in self.series.values())
+
+    def __len__(self):
+        return sum(len(t) for t, _ in self.series.values())
+
+
+def _next_up(x):
+    import math
+    return math.nextafter(x, math.inf)
+
+
+def _to_float(raw):
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
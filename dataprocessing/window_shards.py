@@ -0,0 +1,132 @@
+"""
+Sharded training-window export for the alignment results.
+
+Instead of per-instance CSVs with blank separator rows (which get_data's
+filter_files has to rediscover), every fault becomes one fixed-length window:
+the `pre_steps` GPU samples before the fault and the `post_steps` samples at or
+after it, left/right padded. Windows are written as compressed .npz shards of
+bounded size with these arrays:
+
+    values      float32 [N, L, M]  metric values (NaN where missing or padded)
+    status      int8    [N, L]     -1 before / 1 after the fault, 0 for padding
+    mask        bool    [N, L]     True for real samples
+    offset      float32 [N, L]     sample time - fault time, in seconds
+    fault_ts    int64   [N]
+    instance_id, ip, diag_id, ...  unicode [N] fault metadata from the ECS row
+
+with L = pre_steps + post_steps. manifest.json lists the metric columns and
+the shards, so readers can stream shards in parallel with np.load only.
+"""
+import os
+import json
+
+MANIFEST_FILE = 'manifest.json'
+SHARD_MAX_BYTES = 256 * 1024 * 1024  # uncompressed size of one shard
+FAULT_META_COLUMNS = ('ip', 'diag_id', 'description', 'date')
+
+
+class WindowShardWriter:
+    def __init__(self, output_dir, metrics, pre_steps, post_steps, shard_max_bytes=SHARD_MAX_BYTES):
+        self.output_dir = output_dir
+        self.metrics = list(metrics)
+        self.pre_steps = pre_steps
+        self.post_steps = post_steps
+        self.length = pre_steps + post_steps
+        self.shard_max_bytes = shard_max_bytes
+        # values + status + mask + offset per window, plus metadata
+        self.window_bytes = self.length * (4 * len(self.metrics) + 1 + 1 + 4) + 8 + 64 * (1 + len(FAULT_META_COLUMNS))
+        self.shards = []
+        self._pending = []  # (fault_ts, meta, pre_rows, post_rows)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def add(self, instance_id, fault_ts, ecs_row, gpu_rows):
+        """gpu_rows: {gpu_ts: row dict} as collected by align_multiple."""
+        timestamps = sorted(gpu_rows)
+        pre = [ts for ts in timestamps if ts < fault_ts][-self.pre_steps:] if self.pre_steps else []
+        post = [ts for ts in timestamps if ts >= fault_ts][:self.post_steps]
+        meta = {'instance_id': str(instance_id)}
+        for col in FAULT_META_COLUMNS:
+            value = ecs_row.get(col) if ecs_row is not None else None
+            meta[col] = '' if value is None or value != value else str(value)
+        self._pending.append((int(fault_ts), meta, [(ts, gpu_rows[ts]) for ts in pre],
+                              [(ts, gpu_rows[ts]) for ts in post]))
+        if len(self._pending) * self.window_bytes >= self.shard_max_bytes:
+            self.flush()
+
+    def flush(self):
+        import numpy as np
+        import pandas as pd
+
+        if not self._pending:
+            return
+        n, length = len(self._pending), self.length
+        status = np.zeros((n, length), dtype=np.int8)
+        offset = np.zeros((n, length), dtype=np.float32)
+        fault_ts = np.array([p[0] for p in self._pending], dtype=np.int64)
+
+        # Pre samples are right-aligned against the fault, post samples left-aligned after it
+        rows, win_idx, slot_idx = [], [], []
+        for i, (fts, _, pre, post) in enumerate(self._pending):
+            for j, (ts, row) in enumerate(pre):
+                slot = self.pre_steps - len(pre) + j
+                rows.append(row)
+                win_idx.append(i)
+                slot_idx.append(slot)
+                status[i, slot] = -1
+                offset[i, slot] = ts - fts
+            for j, (ts, row) in enumerate(post):
+                slot = self.pre_steps + j
+                rows.append(row)
+                win_idx.append(i)
+                slot_idx.append(slot)
+                status[i, slot] = 1
+                offset[i, slot] = ts - fts
+
+        values = np.full((n, length, len(self.metrics)), np.nan, dtype=np.float32)
+        if rows:
+            # One frame for all samples of the shard, converted column by column
+            frame = pd.DataFrame.from_records(rows, columns=self.metrics)
+            matrix = frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+            values[np.array(win_idx), np.array(slot_idx)] = matrix
+
+        arrays = {'values': values, 'status': status, 'mask': status != 0, 'offset': offset, 'fault_ts': fault_ts}
+        for key in ('instance_id',) + FAULT_META_COLUMNS:
+            arrays[key] = np.array([p[1][key] for p in self._pending], dtype=str)
+
+        name = f"windows_{len(self.shards):05d}.npz"
+        path = os.path.join(self.output_dir, name)
+        np.savez_compressed(path, **arrays)
+        self.shards.append({'file': name, 'windows': n, 'bytes': os.path.getsize(path)})
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        manifest = {
+            'metrics': self.metrics,
+            'pre_steps': self.pre_steps,
+            'post_steps': self.post_steps,
+            'windows': sum(s['windows'] for s in self.shards),
+            'shards': self.shards,
+        }
+        tmp_path = os.path.join(self.output_dir, MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.output_dir, MANIFEST_FILE))
+        return manifest
+
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_shards(output_dir, shard_ids=None):
+    """Yield each shard as {array name: ndarray}; `shard_ids` picks a subset (e.g. one per reader)."""
+    import numpy as np
+
+    manifest = read_manifest(output_dir)
+    for i, shard in enumerate(manifest['shards']):
+        if shard_ids is not None and i not in shard_ids:
+            continue
+        with np.load(os.path.join(output_dir, shard['file'])) as data:
+            yield {k: data[k] for k in data.files}